@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,6 +32,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'users.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -116,5 +118,66 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
 
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'users.authentication.JWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'users.pagination.KeysetPagination',
+    # Default page size of the keyset-paginated list endpoints; clients may
+    # ask for up to API_MAX_PAGE_SIZE rows with ?page_size=.
+    'PAGE_SIZE': 50,
+    # List 'users.renderers.ORJSONRenderer' in DEFAULT_RENDERER_CLASSES to
+    # render JSON with orjson, as settings_api does.
+}
+
+API_MAX_PAGE_SIZE = 500
+
+# Tokens issued by /api/login. Verified tokens and their users are cached per
+# process for JWT_AUTH_CACHE_TTL seconds.
+JWT_SECRET_KEY = SECRET_KEY
+JWT_AUTH_CACHE_SIZE = 10000
+JWT_AUTH_CACHE_TTL = 60
+
+# Serve the read-only book/user/history endpoints from async views. asgi.py
+# turns this on; under WSGI the sync DRF views are used throughout.
+ASYNC_READ_VIEWS = os.environ.get('LIBRARY_ASYNC_READS') == '1'
+
+# Overdue loans are found by the nightly `process_overdue` run (or the
+# /api/overdue/run scheduler hook, authorized with `Bearer CRON_SECRET`).
+# Fines accrue per day late up to the cap.
+OVERDUE_FINE_PER_DAY = '0.25'
+OVERDUE_FINE_CAP = '10.00'
+CRON_SECRET = os.environ.get('CRON_SECRET')
+
+# A copy set aside for a hold waits this many days after `ready_at`; the
+# overdue run then passes it on to the next patron in line.
+HOLD_PICKUP_DAYS = 3
+
+# Per-route request metrics are served at /metrics. Requests slower than
+# SLOW_REQUEST_THRESHOLD_MS (None disables it) are logged with their SQL to the
+# 'users.metrics' logger.
+SLOW_REQUEST_THRESHOLD_MS = None
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Book list/detail responses are cached and invalidated on every Book change.
+# locmem is per process: deployments running several workers should point
+# this at a shared backend (file, redis or memcached).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'library-catalog',
+    }
+}
+
+BOOK_CACHE_TIMEOUT = 300
+
+# Catalog search backend used by `?search=` on /api/books.
+# 'users.search.LikeSearchBackend' restores the unindexed icontains scan.
+BOOK_SEARCH_BACKEND = 'users.search.SQLiteFTSBackend'
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""
+API-only settings for the serverless (Vercel) deployment.
+
+Every lambda cold start imports the whole app registry before serving its first
+request, so this profile drops what the JSON API never touches: the admin,
+sessions, messages, static files, templates and the browsable API. Clients
+authenticate with JWT bearer tokens, the `jwt` cookie or HTTP Basic.
+Use `python manage.py profile_startup` to compare it with the default settings.
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'corsheaders',
+    'users',
+]
+
+MIDDLEWARE = [
+    'users.metrics.MetricsMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'libraryproject.urls_api'
+
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'users.authentication.JWTAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    # Same bytes as JSONRenderer, written by orjson (see users.renderers).
+    'DEFAULT_RENDERER_CLASSES': ['users.renderers.ORJSONRenderer'],
+}
@@ -0,0 +1,8 @@
+from django.urls import path, include
+
+from users.metrics import metrics_view
+
+urlpatterns = [
+    path('api/', include('users.urls')),
+    path('metrics', metrics_view, name='metrics'),
+]
@@ -1,3 +1,48 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+
+from .models import Book, Hold, Loan, Overdue, Transaction, User
 
 # Register your models here.
+admin.site.register(User, UserAdmin)
+
+
+@admin.register(Book)
+class BookAdmin(admin.ModelAdmin):
+  list_display = ['title', 'author', 'isbn', 'published_date', 'copies_available']
+  search_fields = ['title', 'author', 'isbn']
+  show_full_result_count = False
+
+
+@admin.register(Transaction)
+class TransactionAdmin(admin.ModelAdmin):
+  list_display = ['id', 'user', 'book', 'transaction_type', 'transaction_date', 'due_date']
+  list_filter = ['transaction_type']
+  list_select_related = ['user', 'book']
+  raw_id_fields = ['user', 'book']
+  show_full_result_count = False
+
+
+@admin.register(Loan)
+class LoanAdmin(admin.ModelAdmin):
+  list_display = ['user', 'book', 'checked_out_at', 'due_date']
+  list_select_related = ['user', 'book']
+  raw_id_fields = ['user', 'book', 'checkout']
+  show_full_result_count = False
+
+
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+  list_display = ['user', 'book', 'status', 'created_at', 'ready_at']
+  list_filter = ['status']
+  list_select_related = ['user', 'book']
+  raw_id_fields = ['user', 'book']
+  show_full_result_count = False
+
+
+@admin.register(Overdue)
+class OverdueAdmin(admin.ModelAdmin):
+  list_display = ['user', 'book', 'due_date', 'returned_at', 'fine']
+  list_select_related = ['user', 'book']
+  raw_id_fields = ['user', 'book', 'checkout']
+  show_full_result_count = False
@@ -0,0 +1,95 @@
+"""
+Transaction log archival: old, settled transactions move from the hot
+Transaction table to ArchivedTransaction, keeping their ids and columns, and
+their counts are folded into one TransactionSummary row per user and book.
+
+Only rows nothing else still reads are moved: RETURNs, and CHECKOUTs already
+returned, at or below the overdue engine's watermark and with no Overdue
+attached. Everything older than the latest ArchiveRun's cutoff that is not in
+the hot table is in the archive, so the borrowing history only reads the
+archive once a page reaches past that cutoff.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import ArchivedTransaction, ArchiveRun, Loan, Overdue, OverdueRun, Transaction, TransactionSummary
+
+FIELDS = ['id', 'user_id', 'book_id', 'transaction_type', 'transaction_date', 'due_date']
+
+
+def archive_bound():
+  """The latest archive cutoff as a subquery, to annotate onto the user lookup."""
+  return Subquery(ArchiveRun.objects.order_by('-cutoff').values('cutoff')[:1])
+
+
+def eligible(cutoff, watermark):
+  """Transactions before `cutoff` that can leave the hot table."""
+  returned = Transaction.objects.filter(
+    user=OuterRef('user_id'), book=OuterRef('book_id'), transaction_type=Transaction.RETURN,
+    id__gt=OuterRef('id'), id__lte=watermark,
+  )
+  return (
+    Transaction.objects.filter(transaction_date__lt=cutoff, id__lte=watermark)
+    .filter(Q(transaction_type=Transaction.RETURN) | Q(transaction_type=Transaction.CHECKOUT) & Exists(returned))
+    .filter(~Exists(Overdue.objects.filter(checkout_id=OuterRef('id'))))
+    .filter(~Exists(Loan.objects.filter(checkout_id=OuterRef('id'))))
+  )
+
+
+def summarize(rows):
+  """Add a batch of archived rows to the TransactionSummary table: one SELECT and one upsert."""
+  totals = defaultdict(lambda: [0, 0, None])
+  for _, user_id, book_id, transaction_type, transaction_date, _ in rows:
+    total = totals[user_id, book_id]
+    total[0 if transaction_type == Transaction.CHECKOUT else 1] += 1
+    total[2] = transaction_date if total[2] is None else max(total[2], transaction_date)
+  existing = TransactionSummary.objects.filter(
+    user_id__in={user_id for user_id, _ in totals}, book_id__in={book_id for _, book_id in totals},
+  ).values_list('user_id', 'book_id', 'checkouts', 'returns', 'last_at')
+  for user_id, book_id, checkouts, returns, last_at in existing:
+    if (user_id, book_id) in totals:
+      total = totals[user_id, book_id]
+      total[0] += checkouts
+      total[1] += returns
+      total[2] = max(filter(None, [total[2], last_at]))
+  TransactionSummary.objects.bulk_create(
+    [
+      TransactionSummary(user_id=user_id, book_id=book_id, checkouts=checkouts, returns=returns, last_at=last_at)
+      for (user_id, book_id), (checkouts, returns, last_at) in totals.items()
+    ],
+    update_conflicts=True, unique_fields=['user', 'book'], update_fields=['checkouts', 'returns', 'last_at'],
+  )
+
+
+def archive_transactions(cutoff, batch_size=5000):
+  """
+  Move every eligible transaction before `cutoff` to the archive in id-ordered
+  batches, one database transaction each, and record the run. The run is
+  recorded first, so readers look in the archive before anything is moved;
+  an interrupted run is completed by the next one. Returns a summary dict.
+  """
+  previous = OverdueRun.objects.first()
+  watermark = previous.last_transaction_id if previous else 0
+  run = ArchiveRun.objects.create(cutoff=cutoff, started_at=timezone.now())
+  archived = last_id = 0
+  while True:
+    with transaction.atomic():
+      rows = list(eligible(cutoff, watermark).filter(id__gt=last_id).order_by('id').values_list(*FIELDS)[:batch_size])
+      if not rows:
+        break
+      ArchivedTransaction.objects.bulk_create([ArchivedTransaction(**dict(zip(FIELDS, row))) for row in rows])
+      summarize(rows)
+      Transaction.objects.filter(pk__in=[row[0] for row in rows]).delete()
+    archived += len(rows)
+    last_id = rows[-1][0]
+  run.archived, run.finished_at = archived, timezone.now()
+  run.save(update_fields=['archived', 'finished_at'])
+  return {
+    'cutoff': cutoff.isoformat(),
+    'archived': archived,
+    'hot': Transaction.objects.count(),
+    'elapsed_ms': round((run.finished_at - run.started_at).total_seconds() * 1000, 1),
+  }
@@ -0,0 +1,131 @@
+"""
+Async versions of the read-only endpoints, served when running under ASGI.
+
+Each route pairs an async GET handler using Django's async ORM with the
+existing sync DRF view for writes, so a request waiting on the database
+does not hold a worker thread. Reads are authenticated with the DRF view's
+authenticators first, and output matches the DRF views byte for byte.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .archive import archive_bound
+from .db import read_replica
+from .cache import acached_response, acatalog_version, detail_key, list_key
+from .facets import afacet_counts, requested_facets
+from .models import Book, User
+from .pagination import KeysetPagination
+from .rows import RowSerializer
+from .serializers import BookSerializer, TransactionSerializer, UserSerializer
+from .sparse import QueryParamError, requested_fields
+from .views import (
+  BookDetailAPIView,
+  BookListCreateAPIView,
+  BorrowingHistoryAPIView,
+  UserDetailAPIView,
+  history_tiers,
+)
+
+# The configured JSON renderer, e.g. users.renderers.ORJSONRenderer.
+renderer = next(cls for cls in api_settings.DEFAULT_RENDERER_CLASSES if cls.format == 'json')()
+
+
+def json_response(data, status=200):
+  return HttpResponse(renderer.render(data), content_type='application/json', status=status)
+
+
+async def aget_or_404(queryset, **lookup):
+  try:
+    return await queryset.aget(**lookup)
+  except queryset.model.DoesNotExist:
+    raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+
+@read_replica
+async def book_list(request):
+  async def build():
+    params = request.query_params
+    serializer = RowSerializer(BookSerializer, requested_fields(params, BookSerializer))
+    facets = requested_facets(params)
+    books = BookListCreateAPIView.filter_books(params)
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(serializer.rows(books), request)
+    data = paginator.get_paginated_response(serializer.serialize(page)).data
+    if facets:
+      data['facets'] = await afacet_counts(facets, books, BookListCreateAPIView.is_filtered(params))
+    return data, None
+
+  key = list_key(request, await acatalog_version())
+  try:
+    return await acached_response(request, 'book-list', key, build, json_response)
+  except QueryParamError as exc:
+    return json_response({'error': str(exc)}, status=400)
+
+
+@read_replica
+async def book_detail(request, pk):
+  async def build():
+    book = await aget_or_404(Book.objects.all(), pk=pk)
+    return BookSerializer(book).data, book.updated_at
+
+  return await acached_response(request, 'book-detail', detail_key(pk), build, json_response)
+
+
+@read_replica
+async def user_detail(request, pk):
+  user = await aget_or_404(User.objects.all(), pk=pk)
+  return json_response(UserSerializer(user).data)
+
+
+@read_replica
+async def borrowing_history(request, pk):
+  user = await aget_or_404(User.objects.annotate(archived_before=archive_bound()), pk=pk)
+  serializer = RowSerializer(TransactionSerializer)
+  paginator = KeysetPagination()
+  page = await paginator.apaginate_tiers(history_tiers(serializer, user), request)
+  return json_response(paginator.get_paginated_response(serializer.serialize(page)).data)
+
+
+def split_view(read_view, write_view):
+  """
+  Route GET/HEAD to the async `read_view` and everything else to the sync DRF
+  view. `read_view` gets a DRF Request already run through the DRF view's
+  authenticators, so bad credentials are refused as they are under WSGI.
+  """
+  write = sync_to_async(write_view.as_view())
+
+  async def view(request, *args, **kwargs):
+    if request.method in ('GET', 'HEAD'):
+      drf_request = Request(request, authenticators=[auth() for auth in write_view.authentication_classes])
+      try:
+        # Authenticators read the database through the sync ORM.
+        await sync_to_async(lambda: drf_request.user)()
+        return await read_view(drf_request, *args, **kwargs)
+      except Http404 as exc:
+        return json_response({'detail': str(exc)}, status=404)
+      except (exceptions.NotAuthenticated, exceptions.AuthenticationFailed) as exc:
+        return auth_failed(drf_request, exc)
+      except exceptions.APIException as exc:
+        return json_response({'detail': exc.detail}, status=exc.status_code)
+    return await write(request, *args, **kwargs)
+
+  view.csrf_exempt = True
+  return view
+
+
+def auth_failed(request, exc):
+  """A 401 with the first authenticator's challenge, or a 403 without one, as APIView.handle_exception does."""
+  header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+  response = json_response({'detail': exc.detail}, status=401 if header else 403)
+  if header:
+    response['WWW-Authenticate'] = header
+  return response
+
+
+book_list_view = split_view(book_list, BookListCreateAPIView)
+book_detail_view = split_view(book_detail, BookDetailAPIView)
+user_detail_view = split_view(user_detail, UserDetailAPIView)
+borrowing_history_view = split_view(borrowing_history, BorrowingHistoryAPIView)
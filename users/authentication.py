@@ -0,0 +1,149 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from django.middleware.csrf import CsrfViewMiddleware
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .models import User
+
+ALGORITHM = 'HS256'
+
+
+class TTLCache:
+  """A small thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+  def __init__(self, maxsize, ttl):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.data = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      item = self.data.get(key)
+      if item is None:
+        return None
+      expires, value = item
+      if expires < time.monotonic():
+        del self.data[key]
+        return None
+      self.data.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl=None):
+    with self.lock:
+      self.data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+      self.data.move_to_end(key)
+      while len(self.data) > self.maxsize:
+        self.data.popitem(last=False)
+
+  def delete(self, key):
+    with self.lock:
+      self.data.pop(key, None)
+
+  def discard_where(self, predicate):
+    with self.lock:
+      for key in [key for key, (_, value) in self.data.items() if predicate(value)]:
+        del self.data[key]
+
+  def clear(self):
+    with self.lock:
+      self.data.clear()
+
+
+def get_secret():
+  return getattr(settings, 'JWT_SECRET_KEY', settings.SECRET_KEY)
+
+
+def encode_token(user, lifetime):
+  now = int(time.time())
+  payload = {'id': user.id, 'iat': now, 'exp': now + int(lifetime.total_seconds())}
+  return jwt.encode(payload, get_secret(), algorithm=ALGORITHM)
+
+
+# token -> (user id, exp) and user id -> User, per process. The TTL bounds how
+# long another process may keep serving a user deactivated elsewhere.
+token_cache = TTLCache(getattr(settings, 'JWT_AUTH_CACHE_SIZE', 10000), getattr(settings, 'JWT_AUTH_CACHE_TTL', 60))
+user_cache = TTLCache(getattr(settings, 'JWT_AUTH_CACHE_SIZE', 10000), getattr(settings, 'JWT_AUTH_CACHE_TTL', 60))
+
+
+def forget_user(user_id):
+  user_cache.delete(user_id)
+  token_cache.discard_where(lambda value: value[0] == user_id)
+
+
+class JWTAuthentication(BaseAuthentication):
+  """
+  Authenticates the token issued by `LoginView`, sent as a Bearer header or in
+  the `jwt` cookie. Verified tokens and the active users they resolve to are
+  cached, so repeat requests skip both signature verification and the `User`
+  query. Cookie-authenticated requests are CSRF-checked like sessions.
+  """
+  keyword = b'bearer'
+  cookie_name = 'jwt'
+
+  def get_token(self, request):
+    header = get_authorization_header(request).split()
+    if header and header[0].lower() == self.keyword:
+      if len(header) != 2:
+        raise exceptions.AuthenticationFailed('Invalid Authorization header.')
+      return header[1].decode('latin-1'), False
+    token = request.COOKIES.get(self.cookie_name)
+    return (token, True) if token else (None, False)
+
+  def authenticate(self, request):
+    token, from_cookie = self.get_token(request)
+    if token is None:
+      return None
+
+    user_id = self.verify(token)
+    user = user_cache.get(user_id)
+    if user is None:
+      user = User.objects.filter(pk=user_id, is_active=True).first()
+      if user is None:
+        token_cache.delete(token)
+        raise exceptions.AuthenticationFailed('User not found or inactive.')
+      user_cache.set(user_id, user)
+
+    if from_cookie:
+      self.enforce_csrf(request)
+    return copy.copy(user), token
+
+  def verify(self, token):
+    cached = token_cache.get(token)
+    if cached is not None:
+      user_id, expires = cached
+      if expires > time.time():
+        return user_id
+      token_cache.delete(token)
+
+    try:
+      payload = jwt.decode(token, get_secret(), algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+      raise exceptions.AuthenticationFailed('Token has expired.')
+    except jwt.InvalidTokenError:
+      raise exceptions.AuthenticationFailed('Invalid token.')
+    if 'id' not in payload:
+      raise exceptions.AuthenticationFailed('Invalid token.')
+
+    expires = payload.get('exp', 0)
+    token_cache.set(token, (payload['id'], expires), ttl=min(token_cache.ttl, max(0, expires - time.time())))
+    return payload['id']
+
+  def enforce_csrf(self, request):
+    def dummy_get_response(request):
+      return None
+
+    check = CsrfViewMiddleware(dummy_get_response)
+    check.process_request(request)
+    reason = check.process_view(request, None, (), {})
+    if reason:
+      raise exceptions.PermissionDenied(f'CSRF Failed: {reason}')
+
+  def authenticate_header(self, request):
+    return 'Bearer'
@@ -0,0 +1,10 @@
+"""
+Benchmarks for the library API, run with `python manage.py benchmark <name>`.
+
+Each module in this package exposes `add_arguments(parser)` and
+`run(stdout, **options)`. Benchmarks run against a throwaway database so the
+development `db.sqlite3` is never touched; `data` builds the seeded synthetic
+library they share and `report` compares a run with a stored baseline.
+"""
+
+BENCHMARKS = ['load', 'search', 'checkout', 'auth', 'asgi', 'sqlite', 'onboarding', 'metrics', 'serialize']
@@ -0,0 +1,98 @@
+"""Read-endpoint load test: async views under ASGI against the sync views under WSGI."""
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import include, path
+
+from users.models import Book, User
+from users.urls import urlpatterns as sync_urlpatterns, with_async_reads
+
+from .data import generate_library
+from .utils import summarize, temporary_database
+
+# Used as ROOT_URLCONF while the ASGI half of the benchmark runs.
+urlpatterns = [path('api/', include(with_async_reads(sync_urlpatterns)))]
+
+
+def add_arguments(parser):
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--concurrency', type=int, default=16)
+  parser.add_argument('--books', type=int, default=5000)
+  parser.add_argument('--users', type=int, default=200)
+  parser.add_argument('--cache', action='store_true', help='Keep the book response cache enabled.')
+
+
+def make_urls(count, user_ids, book_ids):
+  rng = random.Random(2)
+  urls = []
+  for _ in range(count):
+    kind = rng.random()
+    if kind < 0.4:
+      urls.append(f'/api/books/{rng.choice(book_ids)}')
+    elif kind < 0.7:
+      urls.append('/api/books?page_size=20')
+    elif kind < 0.85:
+      urls.append(f'/api/users/{rng.choice(user_ids)}')
+    else:
+      urls.append(f'/api/users/{rng.choice(user_ids)}/borrowing-history?page_size=20')
+  return urls
+
+
+def run_wsgi(urls, concurrency):
+  local = threading.local()
+
+  def fetch(url):
+    if not hasattr(local, 'client'):
+      local.client = Client()
+    client = local.client
+    start = time.perf_counter()
+    response = client.get(url)
+    assert response.status_code == 200, (url, response.status_code)
+    return time.perf_counter() - start
+
+  def close(_):
+    connection.close()
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(concurrency) as pool:
+    samples = list(pool.map(fetch, urls))
+    list(pool.map(close, range(concurrency)))
+  return samples, time.perf_counter() - start
+
+
+async def run_asgi(urls, concurrency):
+  client = AsyncClient()
+  semaphore = asyncio.Semaphore(concurrency)
+
+  async def fetch(url):
+    async with semaphore:
+      start = time.perf_counter()
+      response = await client.get(url)
+      assert response.status_code == 200, (url, response.status_code)
+      return time.perf_counter() - start
+
+  start = time.perf_counter()
+  samples = await asyncio.gather(*(fetch(url) for url in urls))
+  return samples, time.perf_counter() - start
+
+
+def report(samples, elapsed):
+  return {**summarize(samples), 'elapsed_s': round(elapsed, 3), 'throughput_per_s': round(len(samples) / elapsed, 1)}
+
+
+def run(stdout, requests, concurrency, books, users, cache, **options):
+  caches = {} if cache else {'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}}
+  with temporary_database(), override_settings(**caches):
+    generate_library(users, books, users * 20)
+    user_ids = list(User.objects.values_list('id', flat=True))
+    book_ids = list(Book.objects.values_list('id', flat=True))
+    urls = make_urls(requests, user_ids, book_ids)
+    wsgi = report(*run_wsgi(urls, concurrency))
+    with override_settings(ROOT_URLCONF=__name__):
+      asgi = report(*asyncio.run(run_asgi(urls, concurrency)))
+    return {'requests': requests, 'concurrency': concurrency, 'cache': cache, 'wsgi': wsgi, 'asgi': asgi}
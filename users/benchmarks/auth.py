@@ -0,0 +1,40 @@
+"""Per-request authentication overhead of JWTAuthentication, cold and cached."""
+import datetime
+
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from users.authentication import JWTAuthentication, encode_token, token_cache, user_cache
+from users.models import User
+
+from .utils import measure, temporary_database
+
+
+def add_arguments(parser):
+  parser.add_argument('--repeat', type=int, default=5000)
+
+
+def run(stdout, repeat, **options):
+  with temporary_database(on_disk=False):
+    user = User.objects.create(username='bench')
+    token = encode_token(user, datetime.timedelta(hours=1))
+    factory = APIRequestFactory()
+    authenticator = JWTAuthentication()
+
+    def authenticate():
+      request = Request(factory.get('/api/books', HTTP_AUTHORIZATION=f'Bearer {token}'))
+      authenticator.authenticate(request)
+
+    def cold():
+      token_cache.clear()
+      user_cache.clear()
+      authenticate()
+
+    baseline = measure(lambda: Request(factory.get('/api/books', HTTP_AUTHORIZATION=f'Bearer {token}')), repeat)
+    results = {
+      'request_construction': baseline,
+      'uncached': measure(cold, repeat),
+      'cached': measure(authenticate, repeat),
+    }
+    results['saved_per_request_ms'] = round(results['uncached']['mean_ms'] - results['cached']['mean_ms'], 4)
+    return results
@@ -0,0 +1,67 @@
+"""Concurrent checkout throughput against a single book, with an oversell check."""
+import threading
+import time
+from datetime import date
+
+from django.db import connection
+
+from users.circulation import CirculationError, checkout_book
+from users.models import Book, Transaction, User
+
+from .utils import isbn13, temporary_database
+
+
+def add_arguments(parser):
+  parser.add_argument('--threads', type=int, default=8)
+  parser.add_argument('--attempts', type=int, default=200, help='Checkouts attempted per thread.')
+  parser.add_argument('--copies', type=int, default=1000)
+
+
+def run(stdout, threads, attempts, copies, **options):
+  with temporary_database():
+    book = Book.objects.create(
+      title='Bestseller', author='Benchmark', isbn=isbn13(0),
+      published_date=date(2020, 1, 1), copies_available=copies
+    )
+    User.objects.bulk_create([User(username=f'bench{i}') for i in range(threads * attempts)])
+    users = list(User.objects.order_by('id'))
+    counts = {'ok': 0, 'refused': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker(batch):
+      local = {'ok': 0, 'refused': 0, 'errors': 0}
+      try:
+        for user in batch:
+          try:
+            checkout_book(user, book.pk)
+            local['ok'] += 1
+          except CirculationError:
+            local['refused'] += 1
+          except Exception:
+            local['errors'] += 1
+      finally:
+        connection.close()
+        with lock:
+          for key, value in local.items():
+            counts[key] += value
+
+    workers = [threading.Thread(target=worker, args=(users[i::threads],)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+      thread.start()
+    for thread in workers:
+      thread.join()
+    elapsed = time.perf_counter() - start
+
+    book.refresh_from_db()
+    checkouts = Transaction.objects.filter(book=book).count()
+    return {
+      'threads': threads,
+      'attempts': threads * attempts,
+      'copies': copies,
+      'elapsed_s': round(elapsed, 3),
+      'throughput_per_s': round((threads * attempts) / elapsed, 1),
+      **counts,
+      'copies_left': book.copies_available,
+      'oversold': checkouts > copies or book.copies_available < 0,
+    }
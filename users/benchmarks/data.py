@@ -0,0 +1,157 @@
+"""
+Seeded synthetic library: users, books with valid ISBNs and a transaction log
+whose checkouts follow a Zipf-like popularity curve. Everything is written
+with bulk inserts and generated in batches, so millions of rows fit in memory.
+"""
+import itertools
+import random
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from users.circulation import LOAN_PERIOD
+from users.models import Book, Loan, Transaction, User
+
+from .utils import isbn13
+
+WORDS = [
+  'history', 'python', 'garden', 'river', 'night', 'empire', 'ocean', 'machine', 'winter', 'silent',
+  'modern', 'secret', 'kitchen', 'mountain', 'physics', 'letters', 'children', 'stone', 'light', 'war',
+  'theory', 'journey', 'city', 'data', 'music', 'forest', 'island', 'design', 'shadow', 'language',
+]
+SURNAMES = ['Okafor', 'Smith', 'Garcia', 'Chen', 'Adeyemi', 'Kowalski', 'Silva', 'Nguyen', 'Muller', 'Haddad']
+
+
+def seed_books(count, seed=1, batch_size=5000, offset=0):
+  rng = random.Random(seed)
+  batch = []
+  for number in range(offset, offset + count):
+    batch.append(Book(
+      title=' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(2, 5))),
+      author=f'{rng.choice(SURNAMES)} {rng.choice(WORDS).title()}',
+      isbn=isbn13(number),
+      isbn13=isbn13(number),
+      published_date=date(rng.randint(1900, 2024), rng.randint(1, 12), rng.randint(1, 28)),
+      copies_available=rng.randint(0, 5),
+    ))
+    if len(batch) >= batch_size:
+      Book.objects.bulk_create(batch)
+      batch = []
+  Book.objects.bulk_create(batch)
+
+
+def seed_users(count, seed=1, batch_size=5000, password='library-bench'):
+  rng = random.Random(seed)
+  # Hashing once keeps generation fast; every synthetic user shares the password.
+  hashed = make_password(password)
+  now = timezone.now()
+  batch = []
+  for number in range(count):
+    batch.append(User(
+      username=f'reader{number}',
+      email=f'reader{number}@example.com',
+      password=hashed,
+      date_joined=now - timedelta(days=rng.randint(0, 3650), seconds=rng.randint(0, 86400)),
+    ))
+    if len(batch) >= batch_size:
+      User.objects.bulk_create(batch)
+      batch = []
+  User.objects.bulk_create(batch)
+
+
+@contextmanager
+def historical_dates():
+  """Let bulk_create keep the generated transaction_date instead of auto_now_add."""
+  field = Transaction._meta.get_field('transaction_date')
+  field.auto_now_add = False
+  try:
+    yield
+  finally:
+    field.auto_now_add = True
+
+
+def seed_transactions(count, seed=1, days=730, skew=1.1, return_rate=0.45, batch_size=5000):
+  """
+  Simulate `count` checkout/return events over the last `days` days.
+
+  Books are drawn with weight 1 / rank ** skew, so a few titles take most of
+  the traffic. Loans still open at the end become `Loan` rows and reduce
+  the book's stock, keeping the seeded state consistent with the log.
+  """
+  rng = random.Random(seed)
+  user_ids = list(User.objects.values_list('id', flat=True))
+  stock = dict(Book.objects.values_list('id', 'copies_available'))
+  book_ids = list(stock)
+  rng.shuffle(book_ids)
+  cum_weights = list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, len(book_ids) + 1)))
+  initial = dict(stock)
+
+  active, open_loans = {}, []
+  start = timezone.now() - timedelta(days=days)
+  step = timedelta(days=days) / max(count, 1)
+  batch, written = [], 0
+
+  with historical_dates():
+    for event in range(count):
+      moment = start + step * event
+      if open_loans and rng.random() < return_rate:
+        index = rng.randrange(len(open_loans))
+        open_loans[index], open_loans[-1] = open_loans[-1], open_loans[index]
+        user_id, book_id = open_loans.pop()
+        del active[(user_id, book_id)]
+        stock[book_id] += 1
+        batch.append(Transaction(user_id=user_id, book_id=book_id, transaction_type=Transaction.RETURN, transaction_date=moment))
+      else:
+        user_id = rng.choice(user_ids)
+        book_id = rng.choices(book_ids, cum_weights=cum_weights)[0]
+        if stock[book_id] <= 0 or (user_id, book_id) in active:
+          continue
+        stock[book_id] -= 1
+        checkout = Transaction(
+          user_id=user_id, book_id=book_id, transaction_type=Transaction.CHECKOUT,
+          transaction_date=moment, due_date=(moment + LOAN_PERIOD).date()
+        )
+        active[(user_id, book_id)] = checkout
+        open_loans.append((user_id, book_id))
+        batch.append(checkout)
+      if len(batch) >= batch_size:
+        Transaction.objects.bulk_create(batch)
+        written += len(batch)
+        batch = []
+    Transaction.objects.bulk_create(batch)
+    written += len(batch)
+
+  loans = [
+    Loan(user_id=user_id, book_id=book_id, checkout=checkout, checked_out_at=checkout.transaction_date, due_date=checkout.due_date)
+    for (user_id, book_id), checkout in active.items()
+  ]
+  Loan.objects.bulk_create(loans, batch_size=batch_size)
+  changed = [Book(pk=book_id, copies_available=copies) for book_id, copies in stock.items() if copies != initial[book_id]]
+  Book.objects.bulk_update(changed, ['copies_available'], batch_size=1000)
+  return {'transactions': written, 'active_loans': len(loans)}
+
+
+def generate_library(users, books, transactions, seed=1):
+  """Populate the current database and rebuild the derived search index, counters, facets, overdue table and related books."""
+  from users.counters import repair_counters
+  from users.facets import rebuild_facets
+  from users.overdue import process_overdue
+  from users.related import rebuild_related
+  from users.search import get_search_backend
+
+  with transaction.atomic():
+    seed_users(users, seed)
+    seed_books(books, seed)
+    summary = seed_transactions(transactions, seed)
+  get_search_backend().rebuild()
+  repair_counters()
+  rebuild_facets()
+  overdue = process_overdue()
+  related = rebuild_related()
+  return {
+    'users': users, 'books': books, **summary, 'overdue': overdue['open'], 'overdue_run_ms': overdue['elapsed_ms'],
+    'related_pairs': related['pairs'],
+  }
@@ -0,0 +1,312 @@
+"""
+Mixed load over every route in users/urls.py, with a per-endpoint report.
+
+Requests go through the Django test client in-process (which also counts
+queries per request) or over HTTP to a local threaded WSGI server. Pass
+`--output` to store the run and `--baseline` to flag regressions against an
+earlier one.
+"""
+import io
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.client import HTTPConnection
+
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.test.client import BOUNDARY, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from users import urls as user_urls
+from users.authentication import encode_token
+from users.models import Book, Loan, User
+
+from . import report
+from .data import generate_library
+from .utils import isbn13, summarize, temporary_database
+
+logger = logging.getLogger('users.benchmarks')
+
+# Relative weight of each named route in the generated mix.
+WEIGHTS = {
+  'book-list-create': 20,
+  'book-detail': 25,
+  'book-popular': 3,
+  'book-related': 3,
+  'book-isbn-detail': 4,
+  'book-isbn-batch': 1,
+  'user-detail': 8,
+  'user-borrowing-history': 8,
+  'user-active-loans': 6,
+  'user-list-create': 4,
+  'book-checkout': 10,
+  'book-return': 8,
+  'book-checkout-batch': 2,
+  'book-return-batch': 2,
+  'book-hold': 3,
+  'book-cache-stats': 1,
+  'transaction-export': 1,
+  'book-import': 1,
+  'user-import': 1,
+  'user-login': 1,
+  'overdue-list': 2,
+}
+
+# Write-heavy desk traffic: as many checkouts/returns as catalog reads.
+MIXED_WEIGHTS = {
+  'book-list-create': 15,
+  'book-detail': 20,
+  'user-borrowing-history': 10,
+  'book-checkout': 30,
+  'book-return': 25,
+}
+MIXES = {'read-heavy': WEIGHTS, 'mixed': MIXED_WEIGHTS}
+
+
+class Context:
+  def __init__(self):
+    self.user_ids = list(User.objects.values_list('id', flat=True))
+    self.book_ids = list(Book.objects.values_list('id', flat=True))
+    self.loans = list(Loan.objects.values_list('user_id', 'book_id'))
+    self.out_of_stock = list(Book.objects.filter(copies_available=0).values_list('id', flat=True)) or self.book_ids
+    self.holds = []
+    self.tokens = {}
+    self.sequence = itertools.count(10 ** 7)
+    # The staff-only routes are called by a librarian, not by a random patron.
+    self.staff_id = User.objects.create(username='bench-librarian', is_staff=True).pk
+
+  def token(self, user_id):
+    if user_id not in self.tokens:
+      self.tokens[user_id] = encode_token(User(pk=user_id), timedelta(hours=1))
+    return self.tokens[user_id]
+
+  def auth(self, rng):
+    return {'HTTP_AUTHORIZATION': f'Bearer {self.token(rng.choice(self.user_ids))}'}
+
+  def staff(self):
+    return {'HTTP_AUTHORIZATION': f'Bearer {self.token(self.staff_id)}'}
+
+
+def build_request(name, ctx, rng):
+  """(method, path, body, content type, extra headers) for one request to route `name`."""
+  user_id, book_id = rng.choice(ctx.user_ids), rng.choice(ctx.book_ids)
+  if name == 'book-list-create':
+    query = rng.choice([
+      '', '?search=garden', '?search=pyth', '?page_size=100', '?copies_available=0', '?fields=id,title,copies_available',
+      '?facets=author,year,available', '?search=garden&facets=author,year,available',
+    ])
+    return 'GET', reverse(name) + query, None, None, {}
+  if name == 'book-popular':
+    return 'GET', reverse(name) + rng.choice(['', '?page_size=10']), None, None, {}
+  if name in ('book-detail', 'book-related'):
+    return 'GET', reverse(name, kwargs={'pk': book_id}), None, None, {}
+  if name == 'book-isbn-detail':
+    return 'GET', reverse(name, kwargs={'isbn': isbn13(rng.randrange(len(ctx.book_ids)))}), None, None, {}
+  if name == 'book-isbn-batch':
+    isbns = ', '.join(f'"{isbn13(rng.randrange(len(ctx.book_ids) * 2))}"' for _ in range(200))
+    return 'POST', reverse(name), f'{{"isbns": [{isbns}]}}', 'application/json', {}
+  if name in ('user-detail', 'user-borrowing-history', 'user-active-loans'):
+    return 'GET', reverse(name, kwargs={'pk': user_id}), None, None, {}
+  if name == 'user-list-create':
+    if rng.random() < 0.8:
+      return 'GET', reverse(name), None, None, {}
+    number = next(ctx.sequence)
+    body = f'{{"username": "new{number}", "email": "new{number}@example.com", "password": "library-bench"}}'
+    return 'POST', reverse(name), body, 'application/json', {}
+  if name == 'book-checkout':
+    return 'POST', reverse(name, kwargs={'pk': book_id}), None, None, ctx.auth(rng)
+  if name == 'book-return':
+    if ctx.loans:
+      user_id, book_id = ctx.loans.pop(rng.randrange(len(ctx.loans)))
+    return 'POST', reverse(name, kwargs={'pk': book_id}), None, None, {'HTTP_AUTHORIZATION': f'Bearer {ctx.token(user_id)}'}
+  if name == 'book-checkout-batch':
+    books = ', '.join(str(pk) for pk in rng.sample(ctx.book_ids, 10))
+    return 'POST', reverse(name), f'{{"books": [{books}], "mode": "best-effort"}}', 'application/json', ctx.auth(rng)
+  if name == 'book-return-batch':
+    if ctx.loans:
+      user_id = rng.choice(ctx.loans)[0]
+    cart = [book for loan_user, book in ctx.loans if loan_user == user_id][:20]
+    ctx.loans = [loan for loan in ctx.loans if loan[0] != user_id or loan[1] not in cart]
+    books = ', '.join(str(pk) for pk in cart)
+    return 'POST', reverse(name), f'{{"books": [{books}], "mode": "best-effort"}}', 'application/json', {'HTTP_AUTHORIZATION': f'Bearer {ctx.token(user_id)}'}
+  if name == 'book-hold':
+    # Mostly patrons polling a hold they placed, the rest placing new ones.
+    if ctx.holds and rng.random() < 0.7:
+      user_id, book_id = rng.choice(ctx.holds)
+      return 'GET', reverse(name, kwargs={'pk': book_id}), None, None, {'HTTP_AUTHORIZATION': f'Bearer {ctx.token(user_id)}'}
+    book_id = rng.choice(ctx.out_of_stock)
+    ctx.holds.append((user_id, book_id))
+    return 'POST', reverse(name, kwargs={'pk': book_id}), None, None, {'HTTP_AUTHORIZATION': f'Bearer {ctx.token(user_id)}'}
+  if name == 'book-cache-stats':
+    return 'GET', reverse(name), None, None, {}
+  if name == 'transaction-export':
+    return 'GET', reverse(name, kwargs={'file_format': 'ndjson'}) + f'?user={user_id}', None, None, ctx.staff()
+  if name == 'book-import':
+    number = next(ctx.sequence)
+    csv = f'title,author,isbn,published_date,copies_available\nImported {number},Bench,{isbn13(number)},2020-01-01,2\n'
+    upload = io.BytesIO(csv.encode('utf-8'))
+    upload.name = 'books.csv'
+    return 'POST', reverse(name), encode_multipart(BOUNDARY, {'file': upload}), f'multipart/form-data;boundary={BOUNDARY}', ctx.auth(rng)
+  if name == 'user-import':
+    number = next(ctx.sequence)
+    upload = io.BytesIO(f'username,email,password\nimported{number},imported{number}@example.com,library-bench\n'.encode('utf-8'))
+    upload.name = 'users.csv'
+    return 'POST', reverse(name), encode_multipart(BOUNDARY, {'file': upload}), f'multipart/form-data;boundary={BOUNDARY}', ctx.staff()
+  if name == 'overdue-list':
+    return 'GET', reverse(name) + '?status=open', None, None, ctx.staff()
+  if name == 'user-login':
+    number = rng.randrange(len(ctx.user_ids))
+    body = f'{{"email": "reader{number}@example.com", "password": "library-bench"}}'
+    return 'POST', reverse(name), body, 'application/json', {}
+  return None
+
+
+class ClientTransport:
+  counts_queries = True
+
+  def __init__(self):
+    self.local = threading.local()
+
+  def send(self, method, path, body, content_type, headers):
+    if not hasattr(self.local, 'client'):
+      # Server errors come back as 500s and are logged by django.request; the
+      # client's re-raise is driven by a process-wide signal and would pin an
+      # exception on whichever thread is listening.
+      self.local.client = Client(raise_request_exception=False)
+    client = self.local.client
+    kwargs = dict(headers)
+    if body is not None:
+      kwargs.update(data=body, content_type=content_type)
+    # The log is capped, so start each capture from an empty one.
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+      response = getattr(client, method.lower())(path, **kwargs)
+      if response.streaming:
+        b''.join(response.streaming_content)
+    return response.status_code, len(queries.captured_queries)
+
+  def close(self):
+    pass
+
+
+class QuietHandler(WSGIRequestHandler):
+  def log_message(self, *args):
+    pass
+
+
+class WSGIServerTransport:
+  counts_queries = False
+
+  def __init__(self):
+    self.server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+    self.server.set_app(get_wsgi_application())
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+    self.port = self.server.server_address[1]
+
+  def send(self, method, path, body, content_type, headers):
+    http = HTTPConnection('127.0.0.1', self.port, timeout=60)
+    request_headers = {
+      key[5:].replace('_', '-').title(): value for key, value in headers.items() if key.startswith('HTTP_')
+    }
+    if content_type:
+      request_headers['Content-Type'] = content_type
+    http.request(method, path, body=body.encode('utf-8') if isinstance(body, str) else body, headers=request_headers)
+    response = http.getresponse()
+    response.read()
+    http.close()
+    return response.status, None
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+
+def route_names():
+  return [pattern.name for pattern in user_urls.urlpatterns if pattern.name]
+
+
+def add_arguments(parser):
+  parser.add_argument('--users', type=int, default=1000)
+  parser.add_argument('--books', type=int, default=10000)
+  parser.add_argument('--transactions', type=int, default=50000)
+  parser.add_argument('--requests', type=int, default=3000)
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--transport', choices=['client', 'wsgi'], default='client')
+  parser.add_argument('--mix', choices=sorted(MIXES), default='read-heavy')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--baseline', help='Earlier --output of this benchmark to compare against.')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown before flagging.')
+  parser.add_argument('--fail-on-regression', action='store_true')
+
+
+def run(stdout, users, books, transactions, requests, concurrency, transport, mix, seed, baseline, tolerance, **options):
+  with temporary_database():
+    dataset = generate_library(users, books, transactions, seed)
+    ctx = Context()
+    names = route_names()
+    weights = MIXES[mix]
+    weighted = [name for name in names if weights.get(name)]
+    rng = random.Random(seed)
+    plan = rng.choices(weighted, weights=[weights[name] for name in weighted], k=requests)
+    plan = [(name, build_request(name, ctx, random.Random(seed + index))) for index, name in enumerate(plan)]
+
+    sender = ClientTransport() if transport == 'client' else WSGIServerTransport()
+    samples, statuses, queries = defaultdict(list), defaultdict(Counter), defaultdict(list)
+    lock = threading.Lock()
+
+    def execute(item):
+      name, (method, path, body, content_type, headers) = item
+      key = f'{method} {name}'
+      start = time.perf_counter()
+      try:
+        status, query_count = sender.send(method, path, body, content_type, headers)
+      except Exception:
+        logger.exception('%s %s raised', method, path)
+        status, query_count = 'error', None
+      elapsed = time.perf_counter() - start
+      with lock:
+        samples[key].append(elapsed)
+        statuses[key][status] += 1
+        if query_count is not None:
+          queries[key].append(query_count)
+
+    def close_connection(_):
+      connection.close()
+
+    start = time.perf_counter()
+    try:
+      with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(execute, plan))
+        list(pool.map(close_connection, range(concurrency)))
+    finally:
+      sender.close()
+    elapsed = time.perf_counter() - start
+
+  results = {
+    'dataset': dataset,
+    'requests': requests,
+    'concurrency': concurrency,
+    'transport': transport,
+    'mix': mix,
+    'overall': {
+      **summarize([sample for values in samples.values() for sample in values]),
+      'elapsed_s': round(elapsed, 3),
+      'throughput_per_s': round(requests / elapsed, 1),
+    },
+    'endpoints': {
+      key: report.endpoint_report(samples[key], statuses[key], queries[key], elapsed) for key in sorted(samples)
+    },
+    'uncovered_routes': sorted(set(names) - set(weighted)),
+  }
+  if baseline:
+    results['regressions'] = report.compare(results, report.load_baseline(baseline), tolerance)
+  return results
@@ -0,0 +1,109 @@
+"""Per-request overhead of MetricsMiddleware and of the SQL capture behind the slow-request log."""
+import random
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.urls import reverse
+
+from users.metrics import MetricsMiddleware, RequestStats, _current, record_query, registry
+from users.models import Book, User
+
+from .data import generate_library
+from .utils import summarize, temporary_database
+
+MIDDLEWARE = 'users.metrics.MetricsMiddleware'
+# (mode, middleware on, SLOW_REQUEST_THRESHOLD_MS). The threshold is never
+# reached, so 'slow-log' measures capturing the SQL without logging it.
+MODES = [('off', False, None), ('on', True, None), ('slow-log', True, 10 ** 9)]
+
+
+def add_arguments(parser):
+  parser.add_argument('--requests', type=int, default=2000, help='Requests per route and mode.')
+  parser.add_argument('--rounds', type=int, default=5, help='Interleaved rounds, to spread out noise.')
+  parser.add_argument('--users', type=int, default=200)
+  parser.add_argument('--books', type=int, default=2000)
+  parser.add_argument('--transactions', type=int, default=5000)
+  parser.add_argument('--seed', type=int, default=1)
+
+
+def run(stdout, requests, rounds, users, books, transactions, seed, **options):
+  without = [name for name in settings.MIDDLEWARE if name != MIDDLEWARE]
+  with temporary_database(on_disk=False):
+    generate_library(users, books, transactions, seed)
+    rng = random.Random(seed)
+    book_ids = list(Book.objects.values_list('id', flat=True))
+    user_ids = list(User.objects.values_list('id', flat=True))
+    routes = {
+      # Served from the response cache after the first hit: the worst case in relative terms.
+      'book-detail': lambda: reverse('book-detail', kwargs={'pk': rng.choice(book_ids[:50])}),
+      'book-list-create': lambda: reverse('book-list-create') + f'?search={rng.choice(["garden", "river", "pyth"])}',
+      'user-borrowing-history': lambda: reverse('user-borrowing-history', kwargs={'pk': rng.choice(user_ids)}),
+    }
+
+    samples = {(route, mode): [] for route in routes for mode, _, _ in MODES}
+    per_round = max(requests // rounds, 1)
+    # Round 0 warms up caches and is not recorded; later rounds rotate the mode order.
+    for number in range(rounds + 1):
+      for mode, enabled, threshold in MODES[number % len(MODES):] + MODES[:number % len(MODES)]:
+        with override_settings(MIDDLEWARE=[MIDDLEWARE, *without] if enabled else without,
+                               SLOW_REQUEST_THRESHOLD_MS=threshold):
+          client = Client()
+          for route, url in routes.items():
+            for _ in range(per_round):
+              path = url()
+              started = time.perf_counter()
+              client.get(path)
+              if number:
+                samples[(route, mode)].append(time.perf_counter() - started)
+    queries = {route: stats.queries / stats.count for (route, _), stats in registry.routes.items()}
+    registry.reset()
+
+  results = {'requests_per_mode': per_round * rounds, 'isolated': isolated_costs(), 'routes': {}}
+  for route in routes:
+    report = {mode: summarize(samples[(route, mode)]) for mode, _, _ in MODES}
+    baseline = report['off']['p50_ms']
+    for mode, _, _ in MODES[1:]:
+      report[mode]['overhead_pct'] = round((report[mode]['p50_ms'] - baseline) / baseline * 100, 2)
+    # End-to-end differences of a few percent are within run-to-run noise; the
+    # isolated per-request and per-query costs bound the real overhead.
+    report['mean_queries'] = round(queries.get(route, 0), 2)
+    added_us = results['isolated']['middleware_us'] + results['isolated']['per_query_us'] * report['mean_queries']
+    report['estimated_overhead_pct'] = round(added_us / 1000 / baseline * 100, 2)
+    results['routes'][route] = report
+  return results
+
+
+def isolated_costs(repeat=100000):
+  """Microseconds added per request by the middleware alone, and per query by the wrapper."""
+  response = HttpResponse(b'x' * 1000)
+  request = RequestFactory().get('/api/books')
+  request.resolver_match = None
+  middleware = MetricsMiddleware(lambda request: response)
+  started = time.perf_counter()
+  for _ in range(repeat):
+    middleware(request)
+  per_request = (time.perf_counter() - started) / repeat
+
+  def execute(sql, params, many, context):
+    return None
+
+  stats = RequestStats()
+  token = _current.set(stats)
+  try:
+    started = time.perf_counter()
+    for _ in range(repeat):
+      record_query(execute, 'SELECT 1', (), False, {})
+    wrapped = time.perf_counter() - started
+  finally:
+    _current.reset(token)
+  started = time.perf_counter()
+  for _ in range(repeat):
+    execute('SELECT 1', (), False, {})
+  bare = time.perf_counter() - started
+  registry.reset()
+  return {
+    'middleware_us': round(per_request * 1e6, 2),
+    'per_query_us': round((wrapped - bare) / repeat * 1e6, 2),
+  }
@@ -0,0 +1,50 @@
+"""Bulk user import throughput as the password-hashing pool grows."""
+import io
+import os
+import time
+
+from users.imports import import_users
+from users.models import User
+
+from .utils import temporary_database
+
+
+def add_arguments(parser):
+  parser.add_argument('--users', type=int, default=400, help='Users per run.')
+  parser.add_argument(
+    '--workers', type=int, nargs='+',
+    help='Pool sizes to compare (defaults to 1, 2, 4, ... up to the CPU count).',
+  )
+  parser.add_argument('--batch-size', type=int, default=1000)
+
+
+def user_csv(count, prefix):
+  lines = ['username,email,password']
+  lines += [f'{prefix}{number},{prefix}{number}@example.com,secret-{number}' for number in range(count)]
+  return '\n'.join(lines) + '\n'
+
+
+def run(stdout, users, workers, batch_size, **options):
+  cpus = os.cpu_count() or 1
+  if not workers:
+    workers = sorted({1, cpus} | {2 ** power for power in range(1, cpus.bit_length()) if 2 ** power <= cpus})
+
+  results = {'users': users, 'cpus': cpus, 'runs': {}}
+  with temporary_database():
+    for count in workers:
+      stdout.write(f'Importing {users} users with {count} hashing process(es)...')
+      stream = io.StringIO(user_csv(users, f'w{count}u'))
+      started = time.perf_counter()
+      report = import_users(stream, 'csv', batch_size=batch_size, workers=count)
+      elapsed = time.perf_counter() - started
+      results['runs'][str(count)] = {
+        'imported': report['imported'],
+        'failed': report['failed'],
+        'seconds': round(elapsed, 3),
+        'users_per_s': round(report['imported'] / elapsed, 1),
+      }
+    single = results['runs'][str(workers[0])]['seconds']
+    for run_result in results['runs'].values():
+      run_result['speedup'] = round(single / run_result['seconds'], 2)
+    results['total_users'] = User.objects.count()
+  return results
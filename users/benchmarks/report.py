@@ -0,0 +1,48 @@
+"""Per-endpoint latency/query report and comparison against a stored baseline run."""
+import json
+
+from .utils import summarize
+
+
+def endpoint_report(samples, statuses, queries, elapsed):
+  report = summarize(samples)
+  report['throughput_per_s'] = round(len(samples) / elapsed, 1) if elapsed else 0.0
+  report['errors'] = sum(count for status, count in statuses.items() if status == 'error' or int(status) >= 500)
+  report['statuses'] = {str(status): count for status, count in sorted(statuses.items(), key=str)}
+  if queries:
+    report['mean_queries'] = round(sum(queries) / len(queries), 2)
+    report['max_queries'] = max(queries)
+  return report
+
+
+def load_baseline(path):
+  with open(path) as baseline:
+    return json.load(baseline)
+
+
+def compare(results, baseline, tolerance=0.2, min_delta_ms=1.0):
+  """
+  List regressions against `baseline`: p95 latency more than `tolerance` (and
+  `min_delta_ms`) slower, a higher query count, new server errors, or lower
+  overall throughput.
+  """
+  regressions = []
+  previous = baseline.get('endpoints', {})
+  for name, current in results.get('endpoints', {}).items():
+    before = previous.get(name)
+    if not before:
+      continue
+    if current['p95_ms'] > before['p95_ms'] * (1 + tolerance) and current['p95_ms'] - before['p95_ms'] > min_delta_ms:
+      regressions.append({'endpoint': name, 'metric': 'p95_ms', 'baseline': before['p95_ms'], 'current': current['p95_ms']})
+    if 'max_queries' in current and 'max_queries' in before and current['max_queries'] > before['max_queries']:
+      regressions.append({'endpoint': name, 'metric': 'max_queries', 'baseline': before['max_queries'], 'current': current['max_queries']})
+    if current['errors'] > before['errors']:
+      regressions.append({'endpoint': name, 'metric': 'errors', 'baseline': before['errors'], 'current': current['errors']})
+
+  overall, before = results.get('overall', {}), baseline.get('overall', {})
+  if before.get('throughput_per_s') and overall.get('throughput_per_s', 0) < before['throughput_per_s'] * (1 - tolerance):
+    regressions.append({
+      'endpoint': 'overall', 'metric': 'throughput_per_s',
+      'baseline': before['throughput_per_s'], 'current': overall['throughput_per_s'],
+    })
+  return regressions
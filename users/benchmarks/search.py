@@ -0,0 +1,29 @@
+"""Catalog search latency: FTS5 index against the legacy icontains scan."""
+from users.models import Book
+from users.search import LikeSearchBackend, SQLiteFTSBackend
+
+from .data import seed_books
+from .utils import measure, temporary_database
+
+QUERIES = ['python', 'riv', 'secret garden', 'okafor', '97980000', 'nothingmatches']
+
+
+def add_arguments(parser):
+  parser.add_argument('--books', type=int, default=100000)
+  parser.add_argument('--repeat', type=int, default=20)
+  parser.add_argument('--limit', type=int, default=50, help='Rows fetched per query (one result page).')
+  parser.add_argument('--seed', type=int, default=1)
+
+
+def run(stdout, books, repeat, limit, seed, **options):
+  with temporary_database():
+    seed_books(books, seed)
+    SQLiteFTSBackend().rebuild()
+    results = {}
+    for query in QUERIES:
+      results[query] = {}
+      for backend in (LikeSearchBackend(), SQLiteFTSBackend()):
+        queryset = backend.search(Book.objects.all(), query)
+        results[query][type(backend).__name__] = measure(lambda: list(queryset[:limit]), repeat)
+        results[query][type(backend).__name__]['matches'] = queryset.count()
+    return {'books': books, 'limit': limit, 'queries': results}
@@ -0,0 +1,57 @@
+"""Serializing and rendering large result sets: DRF serializers against RowSerializer and orjson."""
+from rest_framework.renderers import JSONRenderer
+
+from users.models import Book, Transaction
+from users.renderers import ORJSONRenderer
+from users.rows import RowSerializer
+from users.serializers import BookSerializer, TransactionSerializer
+
+from .data import seed_books, seed_transactions, seed_users
+from .utils import measure, temporary_database
+
+TARGETS = {
+  'books': (BookSerializer, lambda: Book.objects.all()),
+  'transactions': (TransactionSerializer, lambda: Transaction.objects.select_related('user')),
+}
+
+
+def add_arguments(parser):
+  parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='Result set sizes to serialize.')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--seed', type=int, default=1)
+
+
+def strategies(serializer_class, queryset, limit):
+  rows = RowSerializer(serializer_class)
+  json, fast = JSONRenderer(), ORJSONRenderer()
+  return {
+    'drf': lambda: json.render(serializer_class(queryset[:limit], many=True).data),
+    'rows': lambda: json.render(rows.serialize(rows.rows(queryset)[:limit])),
+    'rows+orjson': lambda: fast.render(rows.serialize(rows.rows(queryset)[:limit])),
+  }
+
+
+def run(stdout, rows, repeat, seed, **options):
+  largest = max(rows)
+  with temporary_database():
+    seed_users(max(largest // 50, 100), seed)
+    seed_books(largest, seed)
+    # Roughly 2 events per transaction row survive the stock checks.
+    seed_transactions(largest * 2, seed)
+    results = {'rows': {}}
+    for limit in rows:
+      report = results['rows'][limit] = {}
+      for name, (serializer_class, queryset) in TARGETS.items():
+        runs = strategies(serializer_class, queryset(), limit)
+        outputs = {strategy: func() for strategy, func in runs.items()}
+        timings = {strategy: measure(func, repeat) for strategy, func in runs.items()}
+        baseline = timings['drf']['p50_ms']
+        for timing in timings.values():
+          timing['speedup'] = round(baseline / timing['p50_ms'], 2)
+        report[name] = {
+          'count': queryset()[:limit].count(),
+          'bytes': len(outputs['drf']),
+          'identical': len(set(outputs.values())) == 1,
+          **timings,
+        }
+    return results
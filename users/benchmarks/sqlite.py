@@ -0,0 +1,48 @@
+"""Mixed read/write load under the default SQLite settings and the production profile."""
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+PROFILES = {
+  'default': 'libraryproject.settings',
+  'production': 'libraryproject.settings_production',
+}
+
+
+def add_arguments(parser):
+  parser.add_argument('--users', type=int, default=500)
+  parser.add_argument('--books', type=int, default=5000)
+  parser.add_argument('--transactions', type=int, default=20000)
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--concurrency', type=int, default=16)
+  parser.add_argument('--transport', choices=['client', 'wsgi'], default='wsgi')
+
+
+def run(stdout, users, books, transactions, requests, concurrency, transport, **options):
+  # Each profile needs its own settings module, so run `benchmark load` in a
+  # fresh interpreter per profile.
+  results = {}
+  for profile, module in PROFILES.items():
+    command = [
+      sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark', 'load',
+      '--mix', 'mixed', '--users', str(users), '--books', str(books), '--transactions', str(transactions),
+      '--requests', str(requests), '--concurrency', str(concurrency), '--transport', transport,
+    ]
+    output = subprocess.run(
+      command, check=True, capture_output=True, text=True, env={**os.environ, 'DJANGO_SETTINGS_MODULE': module}
+    ).stdout
+    run_result = json.loads(output)
+    results[profile] = {
+      'overall': run_result['overall'],
+      'errors': sum(endpoint['errors'] for endpoint in run_result['endpoints'].values()),
+      'endpoints': {
+        name: {key: endpoint[key] for key in ('count', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput_per_s', 'errors')}
+        for name, endpoint in run_result['endpoints'].items()
+      },
+    }
+  baseline, tuned = results['default']['overall'], results['production']['overall']
+  results['throughput_change'] = round(tuned['throughput_per_s'] / baseline['throughput_per_s'] - 1, 3)
+  return results
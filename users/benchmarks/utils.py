@@ -0,0 +1,67 @@
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+
+@contextmanager
+def temporary_database(on_disk=True):
+  """Create the test database (on disk by default, like production) and drop it afterwards."""
+  directory = None
+  if on_disk:
+    directory = tempfile.mkdtemp(prefix='library-bench-')
+    for alias in connections:
+      test_settings = connections[alias].settings_dict.setdefault('TEST', {})
+      if connections[alias].vendor == 'sqlite' and not test_settings.get('MIRROR'):
+        test_settings['NAME'] = os.path.join(directory, f'{alias}.sqlite3')
+  setup_test_environment()
+  old_config = setup_databases(verbosity=0, interactive=False)
+  try:
+    yield
+  finally:
+    teardown_databases(old_config, verbosity=0)
+    teardown_test_environment()
+    if directory:
+      for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+      os.rmdir(directory)
+
+
+def percentile(samples, pct):
+  ordered = sorted(samples)
+  if not ordered:
+    return 0.0
+  index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+  return ordered[index]
+
+
+def summarize(samples):
+  """Latency summary in milliseconds for a list of durations in seconds."""
+  ms = [sample * 1000 for sample in samples]
+  return {
+    'count': len(ms),
+    'mean_ms': round(statistics.fmean(ms), 3) if ms else 0.0,
+    'p50_ms': round(percentile(ms, 50), 3),
+    'p95_ms': round(percentile(ms, 95), 3),
+    'p99_ms': round(percentile(ms, 99), 3),
+  }
+
+
+def measure(func, repeat):
+  samples = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    samples.append(time.perf_counter() - start)
+  return summarize(samples)
+
+
+def isbn13(number):
+  """A valid ISBN-13 in the 979-8 range built from an integer."""
+  body = f'9798{number % 10 ** 8:08d}'
+  total = sum(int(digit) * (1 if i % 2 == 0 else 3) for i, digit in enumerate(body))
+  return body + str((10 - total % 10) % 10)
@@ -0,0 +1,151 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+VERSION_KEY = 'books:version'
+
+
+class CacheStats:
+  """In-process hit/miss counters for the catalog response cache."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.counts = Counter()
+
+  def record(self, kind, outcome):
+    with self.lock:
+      self.counts[(kind, outcome)] += 1
+
+  def snapshot(self):
+    with self.lock:
+      counts = dict(self.counts)
+    stats = {}
+    for (kind, outcome), count in counts.items():
+      stats.setdefault(kind, {'hits': 0, 'misses': 0, 'not_modified': 0})[outcome] = count
+    return stats
+
+  def reset(self):
+    with self.lock:
+      self.counts.clear()
+
+
+stats = CacheStats()
+
+
+def get_cache():
+  return caches[getattr(settings, 'BOOK_CACHE_ALIAS', 'default')]
+
+
+def catalog_version():
+  """
+  Version of the catalog in list and ISBN cache keys. A missing key starts
+  from the clock, so a version evicted from the cache can never come back
+  equal to one that older entries and ETags still carry.
+  """
+  cache = get_cache()
+  version = cache.get(VERSION_KEY)
+  if version is None:
+    seed = time.time_ns()
+    cache.add(VERSION_KEY, seed, timeout=None)
+    version = cache.get(VERSION_KEY, seed)
+  return version
+
+
+async def acatalog_version():
+  cache = get_cache()
+  version = await cache.aget(VERSION_KEY)
+  if version is None:
+    seed = time.time_ns()
+    await cache.aadd(VERSION_KEY, seed, timeout=None)
+    version = await cache.aget(VERSION_KEY, seed)
+  return version
+
+
+def detail_key(pk):
+  return f'books:detail:{pk}'
+
+
+def isbn_key(isbn13, version=None):
+  return f'books:isbn:{version or catalog_version()}:{isbn13}'
+
+
+def list_key(request, version=None, name='list'):
+  query = request.query_params.urlencode() if request.query_params else ''
+  digest = hashlib.md5(query.encode('utf-8')).hexdigest()
+  return f'books:{name}:{version or catalog_version()}:{digest}'
+
+
+def invalidate_books(pks=()):
+  cache = get_cache()
+  cache.delete_many([detail_key(pk) for pk in pks])
+  try:
+    cache.incr(VERSION_KEY)
+  except ValueError:
+    cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def books_changed(pks=()):
+  """
+  Drop cached responses for the given books and every cached list page. Runs
+  now and again after commit, so a read racing the writing transaction cannot
+  leave a stale entry behind.
+  """
+  pks = list(pks)
+  invalidate_books(pks)
+  transaction.on_commit(lambda: invalidate_books(pks))
+
+
+def make_entry(key, data, last_modified):
+  timestamp = last_modified.timestamp() if last_modified else None
+  etag = '"%s"' % hashlib.md5(f'{key}:{timestamp}'.encode('utf-8')).hexdigest()
+  return {'data': data, 'etag': etag, 'last_modified': timestamp}
+
+
+def entry_response(request, kind, entry, response_class):
+  last_modified = int(entry['last_modified']) if entry['last_modified'] is not None else None
+  response = get_conditional_response(request, etag=entry['etag'], last_modified=last_modified)
+  if response is not None:
+    stats.record(kind, 'not_modified')
+  else:
+    response = response_class(entry['data'])
+  response['ETag'] = entry['etag']
+  if last_modified is not None:
+    response['Last-Modified'] = http_date(last_modified)
+  return response
+
+
+def cached_response(request, kind, key, build, response_class=Response):
+  """
+  Serve `build()` -> (data, last_modified) through the cache with ETag and
+  Last-Modified validators, answering matching conditional requests with 304.
+  """
+  cache = get_cache()
+  entry = cache.get(key)
+  if entry is None:
+    stats.record(kind, 'misses')
+    entry = make_entry(key, *build())
+    cache.set(key, entry, getattr(settings, 'BOOK_CACHE_TIMEOUT', 300))
+  else:
+    stats.record(kind, 'hits')
+  return entry_response(request, kind, entry, response_class)
+
+
+async def acached_response(request, kind, key, build, response_class):
+  """`cached_response` for async views; `build` is a coroutine function."""
+  cache = get_cache()
+  entry = await cache.aget(key)
+  if entry is None:
+    stats.record(kind, 'misses')
+    entry = make_entry(key, *(await build()))
+    await cache.aset(key, entry, getattr(settings, 'BOOK_CACHE_TIMEOUT', 300))
+  else:
+    stats.record(kind, 'hits')
+  return entry_response(request, kind, entry, response_class)
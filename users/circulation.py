@@ -0,0 +1,426 @@
+import functools
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, Count, Exists, F, IntegerField, OuterRef, Q, Subquery, Value, When, Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.http import Http404
+from django.utils import timezone
+
+from .cache import books_changed
+from .facets import availability_changed
+from .models import Book, Hold, Loan, Transaction, User
+from .related import complete_checkouts, count_checkouts
+
+LOAN_PERIOD = timedelta(days=14)
+
+
+class CirculationError(Exception):
+  """A checkout, return or hold that is refused for a reason the patron can act on."""
+
+
+def checkout_counters(count, now):
+  """UPDATE values recording `count` checkouts on the user, or on each book alongside its stock."""
+  return {
+    'active_loans': F('active_loans') + count,
+    'total_checkouts': F('total_checkouts') + count,
+    'last_activity_at': now,
+  }
+
+
+def return_counters(count, now):
+  """UPDATE values recording `count` returns; never below zero, repair_counters fixes any drift."""
+  return {'active_loans': Greatest(F('active_loans') - count, 0), 'last_activity_at': now}
+
+
+def lock_patron(user, now):
+  """
+  Open a batch by writing the patron's row, which the batch updates anyway.
+  The transaction then holds SQLite's write lock before it reads any stock,
+  instead of failing to upgrade its read lock when another writer got there
+  first; that error is not retried by the busy timeout.
+  """
+  User.objects.filter(pk=user.pk).update(last_activity_at=now)
+
+
+def lock_table(model):
+  """
+  Take the write lock the way `lock_patron` does, for transactions with no row
+  to write before they read: an UPDATE that matches nothing still takes it.
+  """
+  model.objects.filter(pk__isnull=True).update(**{model._meta.pk.attname: F('pk')})
+
+
+def restock_book(book_id, now, **counters):
+  """
+  Put one copy back on the shelf: None if there is no such book, else whether
+  the shelf was empty. Books still in stock take the first UPDATE, so the
+  common case stays a single query.
+  """
+  values = {'copies_available': F('copies_available') + 1, 'updated_at': now, **counters}
+  if Book.objects.filter(pk=book_id, copies_available__gt=0).update(**values):
+    return False
+  return True if Book.objects.filter(pk=book_id).update(**values) else None
+
+
+def is_busy_error(exc):
+  message = str(exc).lower()
+  return 'locked' in message or 'busy' in message
+
+
+def retry_on_busy(func=None, attempts=5, delay=0.02):
+  """
+  Retry `func` when SQLite reports the database as locked. Only the outermost
+  call retries: inside an enclosing atomic block the whole transaction has to be
+  restarted by its owner.
+  """
+  if func is None:
+    return functools.partial(retry_on_busy, attempts=attempts, delay=delay)
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    for attempt in range(attempts):
+      try:
+        return func(*args, **kwargs)
+      except OperationalError as exc:
+        if connection.in_atomic_block or attempt == attempts - 1 or not is_busy_error(exc):
+          raise
+        time.sleep(delay * (2 ** attempt) * (1 + random.random()))
+  return wrapper
+
+
+def complete_after_commit(user, checkouts):
+  """
+  Queue the "also borrowed" upkeep that is kept out of the write lock. It runs
+  once the checkouts are committed; a failure there is logged, not raised, and
+  the next rebuild_related makes up for it.
+  """
+  transaction.on_commit(functools.partial(
+    retry_on_busy(complete_checkouts), user.pk,
+    [checkout.book_id for checkout in checkouts], [checkout.pk for checkout in checkouts],
+  ), robust=True)
+
+
+@retry_on_busy
+def checkout_book(user, book_id):
+  """
+  Take one copy of the book, open the active loan and record the CHECKOUT in a
+  single transaction.
+
+  The stock is decremented with a conditional UPDATE first, so the write lock is
+  taken up front and two concurrent checkouts can never both see the last copy.
+  A patron whose hold is ready takes the copy set aside for them instead, and
+  any hold they had on the book is closed.
+  """
+  now = timezone.now()
+  ready = Exists(Hold.objects.filter(user=user, book=OuterRef('pk'), status=Hold.READY))
+  with transaction.atomic():
+    taken = Book.objects.filter(Q(copies_available__gt=0) | ready, pk=book_id).update(
+      copies_available=F('copies_available') - Case(When(ready, then=Value(0)), default=Value(1)),
+      updated_at=now, **checkout_counters(1, now)
+    )
+    state = Book.objects.filter(pk=book_id).annotate(
+      on_loan=Exists(Loan.objects.filter(user=user, book=OuterRef('pk'))),
+      hold=Hold.objects.filter(user=user, book=OuterRef('pk')).order_by().values('status'),
+    ).values_list('copies_available', 'on_loan', 'hold').first()
+    if state is None:
+      raise Http404('Book not found')
+    copies, on_loan, hold = state
+    if on_loan:
+      raise CirculationError('You already have this book checked out')
+    if not taken:
+      raise CirculationError('No copies available')
+    if hold is not None:
+      Hold.objects.filter(user=user, book_id=book_id).delete()
+    if hold != Hold.READY and copies == 0:
+      availability_changed(-1)
+    User.objects.filter(pk=user.pk).update(**checkout_counters(1, now))
+    count_checkouts(user, [book_id])
+    books_changed([book_id])
+
+    checkout = Transaction.objects.create(
+      user=user,
+      book_id=book_id,
+      transaction_type=Transaction.CHECKOUT,
+      due_date=now.date() + LOAN_PERIOD
+    )
+    Loan.objects.create(
+      user=user,
+      book_id=book_id,
+      checkout=checkout,
+      checked_out_at=checkout.transaction_date,
+      due_date=checkout.due_date
+    )
+    complete_after_commit(user, [checkout])
+    return checkout
+
+
+@retry_on_busy
+def return_book(user, book_id):
+  """
+  Put the copy back, close the active loan and record the RETURN in a single
+  transaction. If patrons are waiting for the book, the copy goes straight to
+  the first of them.
+  """
+  now = timezone.now()
+  with transaction.atomic():
+    was_empty = restock_book(book_id, now, **return_counters(1, now))
+    if was_empty is None:
+      raise Http404('Book not found')
+
+    returned, _ = Loan.objects.filter(user=user, book_id=book_id).delete()
+    if not returned:
+      raise CirculationError('You have not checked out this book')
+    User.objects.filter(pk=user.pk).update(**return_counters(1, now))
+    allocate_holds([book_id], now, restocked=[book_id] if was_empty else [])
+    books_changed([book_id])
+
+    return Transaction.objects.create(
+      user=user,
+      book_id=book_id,
+      transaction_type=Transaction.RETURN
+    )
+
+
+def batch_results(book_ids, errors, status, processed):
+  """One entry per book: `status` when it went through, `skipped` when the batch was rolled back."""
+  return [
+    {'book': book_id, 'status': 'failed', 'error': errors[book_id]} if book_id in errors
+    else {'book': book_id, 'status': status if processed else 'skipped'}
+    for book_id in book_ids
+  ]
+
+
+@retry_on_busy
+def checkout_books(user, book_ids, all_or_nothing=True):
+  """
+  Check out several books in one transaction with a fixed number of queries:
+  one UPDATE taking the write lock (`lock_patron`), one SELECT of stock,
+  existing loans and holds, one UPDATE each of the stock
+  and the user's counters and one bulk INSERT each of CHECKOUT transactions
+  and loans, plus one DELETE when the user had holds on any of the books and
+  one UPDATE of the "also borrowed" scores (users.related.count_checkouts).
+  The rest of that upkeep runs after commit.
+
+  Books that cannot be checked out get an error; with `all_or_nothing` any
+  error leaves the whole batch undone. Repeated ids are processed once.
+  """
+  book_ids = list(dict.fromkeys(book_ids))
+  now = timezone.now()
+  with transaction.atomic():
+    lock_patron(user, now)
+    stock = {
+      book_id: (copies, on_loan, hold)
+      for book_id, copies, on_loan, hold in Book.objects.select_for_update().filter(pk__in=book_ids)
+      .annotate(
+        on_loan=Exists(Loan.objects.filter(user=user, book=OuterRef('pk'))),
+        hold=Hold.objects.filter(user=user, book=OuterRef('pk')).order_by().values('status'),
+      )
+      .values_list('id', 'copies_available', 'on_loan', 'hold')
+    }
+    errors = {}
+    for book_id in book_ids:
+      if book_id not in stock:
+        errors[book_id] = 'Book not found'
+      elif stock[book_id][1]:
+        errors[book_id] = 'You already have this book checked out'
+      elif stock[book_id][0] <= 0 and stock[book_id][2] != Hold.READY:
+        errors[book_id] = 'No copies available'
+    taken = [book_id for book_id in book_ids if book_id not in errors]
+    if not taken or (errors and all_or_nothing):
+      transaction.set_rollback(True)
+      return batch_results(book_ids, errors, 'checked_out', processed=False)
+
+    # Ready holds already took their copy off the shelf. The guard repeats the
+    # check above; it only fails if the stock moved under a backend that
+    # ignores select_for_update.
+    ready = [book_id for book_id in taken if stock[book_id][2] == Hold.READY]
+    updated = Book.objects.filter(Q(copies_available__gt=0) | Q(pk__in=ready), pk__in=taken).update(
+      copies_available=F('copies_available') - Case(When(pk__in=ready, then=Value(0)), default=Value(1)),
+      updated_at=now, **checkout_counters(1, now)
+    )
+    if updated != len(taken):
+      raise CirculationError('The stock changed during checkout, please try again')
+    held = [book_id for book_id in taken if stock[book_id][2] is not None]
+    if held:
+      Hold.objects.filter(user=user, book_id__in=held).delete()
+    availability_changed(-sum(1 for book_id in taken if book_id not in ready and stock[book_id][0] == 1))
+    User.objects.filter(pk=user.pk).update(**checkout_counters(len(taken), now))
+    count_checkouts(user, taken)
+    books_changed(taken)
+
+    checkouts = Transaction.objects.bulk_create([
+      Transaction(user=user, book_id=book_id, transaction_type=Transaction.CHECKOUT, due_date=now.date() + LOAN_PERIOD)
+      for book_id in taken
+    ])
+    Loan.objects.bulk_create([
+      Loan(
+        user=user, book_id=checkout.book_id, checkout=checkout,
+        checked_out_at=checkout.transaction_date, due_date=checkout.due_date
+      )
+      for checkout in checkouts
+    ])
+    complete_after_commit(user, checkouts)
+  return batch_results(book_ids, errors, 'checked_out', processed=True)
+
+
+@retry_on_busy
+def return_books(user, book_ids, all_or_nothing=True):
+  """
+  Return several books in one transaction: the `lock_patron` UPDATE, one
+  SELECT of the user's loans, one DELETE of them, one UPDATE each of the stock
+  and the user's counters, the hold allocation and one bulk INSERT of RETURN
+  transactions. Errors are reported as by `checkout_books`.
+  """
+  book_ids = list(dict.fromkeys(book_ids))
+  now = timezone.now()
+  with transaction.atomic():
+    lock_patron(user, now)
+    stock = {
+      book_id: (copies, on_loan)
+      for book_id, copies, on_loan in Book.objects.filter(pk__in=book_ids)
+      .annotate(on_loan=Exists(Loan.objects.filter(user=user, book=OuterRef('pk'))))
+      .values_list('id', 'copies_available', 'on_loan')
+    }
+    errors = {}
+    for book_id in book_ids:
+      if book_id not in stock:
+        errors[book_id] = 'Book not found'
+      elif not stock[book_id][1]:
+        errors[book_id] = 'You have not checked out this book'
+    returned = [book_id for book_id in book_ids if book_id not in errors]
+    if not returned or (errors and all_or_nothing):
+      transaction.set_rollback(True)
+      return batch_results(book_ids, errors, 'returned', processed=False)
+
+    deleted, _ = Loan.objects.filter(user=user, book_id__in=returned).delete()
+    if deleted != len(returned):
+      raise CirculationError('A loan changed during the return, please try again')
+    Book.objects.filter(pk__in=returned).update(
+      copies_available=F('copies_available') + 1, updated_at=now, **return_counters(1, now)
+    )
+    User.objects.filter(pk=user.pk).update(**return_counters(len(returned), now))
+    allocate_holds(returned, now, restocked=[book_id for book_id in returned if stock[book_id][0] == 0])
+    books_changed(returned)
+
+    Transaction.objects.bulk_create([
+      Transaction(user=user, book_id=book_id, transaction_type=Transaction.RETURN)
+      for book_id in returned
+    ])
+  return batch_results(book_ids, errors, 'returned', processed=True)
+
+
+def allocate_holds(book_ids, now=None, restocked=()):
+  """
+  Set the free copies of `book_ids` aside for their longest-waiting holds, in
+  at most three queries however many books and holds are involved: one SELECT
+  ranking each book's waiting holds against its stock, one UPDATE marking the
+  winners ready and one UPDATE taking their copies off the shelf.
+
+  Call it in the transaction that freed the copies, with the books among them
+  whose shelf was empty as `restocked`, so that the availability facet moves
+  once for both. Returns {book_id: copies allocated}.
+  """
+  now = now or timezone.now()
+  winners = list(
+    Hold.objects.filter(book_id__in=book_ids, status=Hold.WAITING)
+    .annotate(
+      copies=F('book__copies_available'),
+      place=Window(RowNumber(), partition_by=F('book_id'), order_by=[F('created_at').asc(), F('id').asc()]),
+    )
+    .filter(place__lte=F('copies'))
+    .values_list('id', 'book_id', 'copies')
+  )
+  allocated = Counter(book_id for _, book_id, _ in winners)
+  stock = {book_id: copies for _, book_id, copies in winners}
+  if allocated:
+    Hold.objects.filter(pk__in=[pk for pk, _, _ in winners]).update(status=Hold.READY, ready_at=now)
+    Book.objects.filter(pk__in=allocated).update(
+      copies_available=F('copies_available') - Case(
+        *[When(pk=book_id, then=Value(count)) for book_id, count in allocated.items()], default=Value(0)
+      ),
+      updated_at=now,
+    )
+    books_changed(allocated)
+  emptied = sum(1 for book_id, count in allocated.items() if stock[book_id] == count)
+  availability_changed(len(restocked) - emptied)
+  return dict(allocated)
+
+
+def holds_with_position(queryset):
+  """Annotate `position`: 1 for the next waiting hold on its book, None once a hold is ready."""
+  ahead = Hold.objects.filter(
+    Q(created_at__lt=OuterRef('created_at')) | Q(created_at=OuterRef('created_at'), id__lt=OuterRef('id')),
+    book=OuterRef('book'), status=Hold.WAITING,
+  ).order_by().values('book').annotate(count=Count('id')).values('count')
+  return queryset.annotate(position=Case(
+    When(status=Hold.WAITING, then=Coalesce(Subquery(ahead), 0) + 1), default=None, output_field=IntegerField()
+  ))
+
+
+@retry_on_busy
+def place_hold(user, book_id):
+  """Queue the user for a book that has no copies on the shelf."""
+  with transaction.atomic():
+    lock_table(Hold)
+    state = Book.objects.filter(pk=book_id).annotate(
+      on_loan=Exists(Loan.objects.filter(user=user, book=OuterRef('pk'))),
+      held=Exists(Hold.objects.filter(user=user, book=OuterRef('pk'))),
+    ).values_list('copies_available', 'on_loan', 'held').first()
+    if state is None:
+      raise Http404('Book not found')
+    copies, on_loan, held = state
+    if on_loan:
+      raise CirculationError('You already have this book checked out')
+    if held:
+      raise CirculationError('You already have a hold on this book')
+    if copies > 0:
+      raise CirculationError('Copies are available, check the book out instead')
+    hold = Hold.objects.create(user=user, book_id=book_id)
+  return hold
+
+
+@retry_on_busy
+def expire_ready_holds(now=None):
+  """
+  Drop the ready holds whose patron has not picked the copy up within
+  HOLD_PICKUP_DAYS of `ready_at`, and pass each copy on to the next in line as
+  `cancel_hold` does. Returns the number of holds expired.
+  """
+  now = now or timezone.now()
+  cutoff = now - timedelta(days=getattr(settings, 'HOLD_PICKUP_DAYS', 3))
+  with transaction.atomic():
+    lock_table(Hold)
+    stale = list(Hold.objects.filter(status=Hold.READY, ready_at__lt=cutoff).values_list('id', 'book_id'))
+    if not stale:
+      return 0
+    released = Counter(book_id for _, book_id in stale)
+    restocked = list(Book.objects.filter(pk__in=released, copies_available=0).values_list('pk', flat=True))
+    Hold.objects.filter(pk__in=[pk for pk, _ in stale]).delete()
+    Book.objects.filter(pk__in=released).update(
+      copies_available=F('copies_available') + Case(
+        *[When(pk=book_id, then=Value(count)) for book_id, count in released.items()], default=Value(0)
+      ),
+      updated_at=now,
+    )
+    allocate_holds(list(released), now, restocked=restocked)
+    books_changed(released)
+  return len(stale)
+
+
+@retry_on_busy
+def cancel_hold(user, book_id):
+  """Drop the user's hold; a copy that was set aside for them goes to the next in line."""
+  now = timezone.now()
+  with transaction.atomic():
+    released, _ = Hold.objects.filter(user=user, book_id=book_id, status=Hold.READY).delete()
+    if released:
+      was_empty = restock_book(book_id, now)
+      allocate_holds([book_id], now, restocked=[book_id] if was_empty else [])
+      books_changed([book_id])
+    elif not Hold.objects.filter(user=user, book_id=book_id).delete()[0]:
+      raise CirculationError('You have no hold on this book')
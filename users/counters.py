@@ -0,0 +1,89 @@
+"""
+Denormalized circulation counters on User and Book: `active_loans`,
+`total_checkouts` and `last_activity_at`.
+
+users.circulation updates them in the same transaction as each checkout and
+return. The loans and the transaction log, with the TransactionSummary rows
+users.archive leaves for archived transactions, stay the source of truth:
+`repair_counters` recomputes the counters from them, walking each table in
+primary-key batches, and reports (or fixes) the rows that disagree.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+
+from .cache import books_changed
+from .models import Book, Loan, Transaction, TransactionSummary, User
+
+COUNTERS = ['active_loans', 'total_checkouts', 'last_activity_at']
+# Circulation stamps last_activity_at as its transaction starts, a moment
+# before the log row gets its own transaction_date.
+CLOCK_SKEW = timedelta(seconds=1)
+
+
+def recount(column, pks):
+  """{pk: (active_loans, total_checkouts, last_activity_at)} recomputed for the `column` ('user_id' or 'book_id') values `pks`."""
+  active = dict(
+    Loan.objects.filter(**{f'{column}__in': pks}).order_by()
+    .values(column).annotate(count=Count('id')).values_list(column, 'count')
+  )
+  log = {
+    pk: (total, last)
+    for pk, total, last in Transaction.objects.filter(**{f'{column}__in': pks}).order_by().values(column)
+    .annotate(total=Count('id', filter=Q(transaction_type=Transaction.CHECKOUT)), last=Max('transaction_date'))
+    .values_list(column, 'total', 'last')
+  }
+  archived = {
+    pk: (total, last)
+    for pk, total, last in TransactionSummary.objects.filter(**{f'{column}__in': pks}).order_by().values(column)
+    .annotate(total=Sum('checkouts'), last=Max('last_at'))
+    .values_list(column, 'total', 'last')
+  }
+  counts = {}
+  for pk in pks:
+    total, last = log.get(pk, (0, None))
+    archived_total, archived_last = archived.get(pk, (0, None))
+    counts[pk] = (active.get(pk, 0), total + archived_total, max(filter(None, [last, archived_last]), default=None))
+  return counts
+
+
+def agrees(stored, counted):
+  if tuple(stored[:2]) != counted[:2]:
+    return False
+  if stored[2] is None or counted[2] is None:
+    return stored[2] == counted[2]
+  return abs(stored[2] - counted[2]) <= CLOCK_SKEW
+
+
+def repair_table(model, column, batch_size, fix):
+  checked = stale = 0
+  last_pk = 0
+  while True:
+    # Recount and rewrite a batch in one transaction, so a concurrent
+    # checkout cannot slip in between and be overwritten.
+    with transaction.atomic():
+      rows = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *COUNTERS)[:batch_size])
+      if not rows:
+        break
+      last_pk = rows[-1][0]
+      counted = recount(column, [pk for pk, *_ in rows])
+      wrong = [
+        model(pk=pk, **dict(zip(COUNTERS, counted[pk])))
+        for pk, *stored in rows if not agrees(stored, counted[pk])
+      ]
+      checked += len(rows)
+      stale += len(wrong)
+      if fix and wrong:
+        model.objects.bulk_update(wrong, COUNTERS)
+        if model is Book:
+          books_changed([book.pk for book in wrong])
+  return {'checked': checked, 'stale': stale}
+
+
+def repair_counters(batch_size=2000, fix=True):
+  """Compare every user's and book's counters with the log; with `fix`, overwrite the stale ones."""
+  return {
+    'users': repair_table(User, 'user_id', batch_size, fix),
+    'books': repair_table(Book, 'book_id', batch_size, fix),
+  }
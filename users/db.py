@@ -0,0 +1,69 @@
+import contextvars
+import functools
+import inspect
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+READ_ALIAS = 'replica'
+
+_read_only = contextvars.ContextVar('read_only', default=False)
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+  """Run the PRAGMAS configured on a SQLite database alias on every new connection."""
+  if connection.vendor != 'sqlite':
+    return
+  pragmas = connection.settings_dict.get('PRAGMAS') or {}
+  if pragmas:
+    with connection.cursor() as cursor:
+      for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def read_replica(func):
+  """
+  Let the reads made while `func` runs go to the read alias, when one is
+  configured. Only views that never write should be wrapped, so write paths
+  always read their own data from the primary.
+  """
+  if inspect.iscoroutinefunction(func):
+    @functools.wraps(func)
+    async def async_wrapper(*args, **kwargs):
+      token = _read_only.set(True)
+      try:
+        return await func(*args, **kwargs)
+      finally:
+        _read_only.reset(token)
+    return async_wrapper
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    token = _read_only.set(True)
+    try:
+      return func(*args, **kwargs)
+    finally:
+      _read_only.reset(token)
+  return wrapper
+
+
+class ReadReplicaRouter:
+  """Send reads inside `read_replica` views to READ_ALIAS and everything else to the primary."""
+
+  def db_for_read(self, model, **hints):
+    if _read_only.get() and READ_ALIAS in settings.DATABASES:
+      return READ_ALIAS
+    return DEFAULT_DB_ALIAS
+
+  def db_for_write(self, model, **hints):
+    return DEFAULT_DB_ALIAS
+
+  def allow_relation(self, obj1, obj2, **hints):
+    return True
+
+  def allow_migrate(self, db, app_label, model_name=None, **hints):
+    # The read alias is the same SQLite file (or a replica of the primary).
+    return db != READ_ALIAS
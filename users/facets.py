@@ -0,0 +1,154 @@
+"""
+Catalog facets: books per author, per publication year and by availability.
+
+Counts over the whole catalog are read from the BookFacet summary table. It is
+kept current with deltas: signals for Book saves and deletes, the importer for
+bulk upserts and users.circulation when a book's last copy goes out or the
+first one comes back. `rebuild_facets` recomputes it with one aggregate
+query, and counts over a filtered list take the same query on that list.
+"""
+import heapq
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import BooleanField, Case, Count, F, Q, Value, When, Window
+from django.db.models.functions import ExtractYear, RowNumber
+
+from .models import Book, BookFacet
+from .sparse import QueryParamError
+
+AUTHOR = 'author'
+YEAR = 'year'
+AVAILABLE = 'available'
+FACETS = [AUTHOR, YEAR, AVAILABLE]
+# Values reported per facet, the most common first.
+FACET_LIMIT = 20
+
+
+def requested_facets(params):
+  """The facets named in `?facets=`, in FACETS order, or None when absent."""
+  value = params.get('facets')
+  if value is None:
+    return None
+  names = {name.strip() for name in value.split(',') if name.strip()}
+  unknown = sorted(names - set(FACETS))
+  if unknown or not names:
+    raise QueryParamError(f'Unknown facets: {", ".join(unknown)}. Choose from {", ".join(FACETS)}.')
+  return [name for name in FACETS if name in names]
+
+
+def facet_keys(author, year, available):
+  return [(AUTHOR, author), (YEAR, str(year)), (AVAILABLE, 'true' if available else 'false')]
+
+
+FACET_FIELDS = ['author', 'published_date', 'copies_available']
+
+
+def book_facet_keys(author, published_date, copies_available):
+  """Facet keys of a book from its FACET_FIELDS values."""
+  return facet_keys(author, published_date.year, copies_available > 0)
+
+
+def adjust(deltas):
+  """Apply {(facet, value): delta}: one INSERT of missing rows and one UPDATE per distinct delta."""
+  deltas = {key: delta for key, delta in deltas.items() if delta}
+  if not deltas:
+    return
+  BookFacet.objects.bulk_create([BookFacet(facet=facet, value=value) for facet, value in deltas], ignore_conflicts=True)
+  by_delta = defaultdict(list)
+  for key, delta in deltas.items():
+    by_delta[delta].append(key)
+  for delta, keys in by_delta.items():
+    BookFacet.objects.filter(
+      reduce(or_, (Q(facet=facet, value=value) for facet, value in keys))
+    ).update(count=F('count') + delta)
+
+
+def books_replaced(old, new):
+  """Move the counts from the `old` facet key lists to the `new` ones."""
+  deltas = Counter()
+  for keys in new:
+    deltas.update(keys)
+  for keys in old:
+    deltas.subtract(keys)
+  adjust(deltas)
+
+
+def availability_changed(delta):
+  """`delta` more books have a copy on the shelf (fewer, when negative)."""
+  adjust({(AVAILABLE, 'true'): delta, (AVAILABLE, 'false'): -delta})
+
+
+def rebuild_facets():
+  """Recompute the summary table from the catalog with one aggregate query; returns the rows written."""
+  counts = Counter()
+  for author, year, available, count in filtered_query(Book.objects.all()):
+    for key in facet_keys(author, year, available):
+      counts[key] += count
+  rows = [BookFacet(facet=facet, value=value, count=count) for (facet, value), count in counts.items()]
+  with transaction.atomic():
+    BookFacet.objects.all().delete()
+    BookFacet.objects.bulk_create(rows, batch_size=1000)
+  return len(rows)
+
+
+def facet_columns():
+  return {
+    'year': ExtractYear('published_date'),
+    'available': Case(When(copies_available__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField()),
+  }
+
+
+def summary_query(names):
+  """The top FACET_LIMIT values of each facet in `names`, from the summary table in one query."""
+  return (
+    BookFacet.objects.filter(facet__in=names, count__gt=0)
+    .annotate(rank=Window(RowNumber(), partition_by=F('facet'), order_by=[F('count').desc(), F('value').asc()]))
+    .filter(rank__lte=FACET_LIMIT).values_list('facet', 'value', 'count')
+  )
+
+
+def filtered_query(books):
+  """Books counted by (author, year, availability) for a filtered list, in one aggregate query."""
+  return (
+    books.order_by().annotate(**facet_columns())
+    .values_list('author', 'year', 'available').annotate(count=Count('id'))
+    .values_list('author', 'year', 'available', 'count')
+  )
+
+
+def from_summary(names, rows):
+  facets = {name: [] for name in names}
+  for facet, value, count in sorted(rows, key=lambda row: (row[0], -row[2], row[1])):
+    facets[facet].append({'value': value, 'count': count})
+  return facets
+
+
+def from_filtered(names, rows):
+  counts = {name: Counter() for name in names}
+  for author, year, available, count in rows:
+    for facet, value in facet_keys(author, year, available):
+      if facet in counts:
+        counts[facet][value] += count
+  return {
+    name: [
+      {'value': value, 'count': count}
+      for value, count in heapq.nsmallest(FACET_LIMIT, counts[name].items(), key=lambda item: (-item[1], item[0]))
+    ]
+    for name in names
+  }
+
+
+def facet_counts(names, books, filtered):
+  """{facet: [{'value', 'count'}, ...]} for the books of a list; `filtered` lists need the aggregate."""
+  if filtered:
+    return from_filtered(names, filtered_query(books))
+  return from_summary(names, summary_query(names))
+
+
+async def afacet_counts(names, books, filtered):
+  if filtered:
+    return from_filtered(names, [row async for row in filtered_query(books)])
+  return from_summary(names, [row async for row in summary_query(names)])
@@ -0,0 +1,350 @@
+import csv
+import io
+import json
+from datetime import date
+
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from isbnlib import canonical
+
+from .cache import books_changed
+from .circulation import lock_table, retry_on_busy
+from .facets import FACET_FIELDS, book_facet_keys, books_replaced
+from .hashing import PasswordHasherPool
+from .isbn import to_isbn13
+from .models import Book, User
+from .search import get_search_backend
+
+FORMATS = ('csv', 'jsonl')
+BOOK_FIELDS = ['title', 'author', 'isbn', 'published_date', 'copies_available']
+UPDATE_FIELDS = ['title', 'author', 'published_date', 'copies_available', 'updated_at']
+USER_FIELDS = ['username', 'email', 'first_name', 'last_name']
+ISBN_CONFLICT = 'Another book in the catalog already uses this ISBN.'
+
+
+def guess_format(filename, default='csv'):
+  name = (filename or '').lower()
+  if name.endswith(('.jsonl', '.ndjson', '.json')):
+    return 'jsonl'
+  if name.endswith('.csv'):
+    return 'csv'
+  return default
+
+
+def iter_records(stream, input_format):
+  """Yield (line number, dict) pairs from a text stream without reading it whole."""
+  if input_format == 'csv':
+    reader = csv.DictReader(stream)
+    for record in reader:
+      yield reader.line_num, record
+  elif input_format == 'jsonl':
+    for line_number, line in enumerate(stream, start=1):
+      if not line.strip():
+        continue
+      try:
+        record = json.loads(line)
+      except ValueError:
+        record = None
+      yield line_number, record if isinstance(record, dict) else {'__invalid__': line}
+  else:
+    raise ValueError(f'Unsupported format {input_format!r}, expected one of {FORMATS}')
+
+
+def clean_record(record):
+  """Validate one input record, returning (Book kwargs, errors)."""
+  if '__invalid__' in record:
+    return None, {'non_field_errors': 'Line is not a JSON object'}
+  errors, values = {}, {}
+  for field in ('title', 'author'):
+    value = str(record.get(field) or '').strip()
+    if not value:
+      errors[field] = 'This field is required.'
+    elif len(value) > 200:
+      errors[field] = 'Ensure this field has no more than 200 characters.'
+    values[field] = value
+
+  values['isbn'] = canonical(str(record.get('isbn') or ''))
+  values['isbn13'] = to_isbn13(values['isbn'])
+  if values['isbn13'] is None:
+    errors['isbn'] = 'Invalid ISBN number'
+
+  try:
+    values['published_date'] = date.fromisoformat(str(record.get('published_date') or '').strip())
+  except ValueError:
+    errors['published_date'] = 'Date has wrong format. Use YYYY-MM-DD.'
+
+  try:
+    values['copies_available'] = int(record.get('copies_available'))
+    if values['copies_available'] < 0:
+      errors['copies_available'] = 'Ensure this value is greater than or equal to 0.'
+  except (TypeError, ValueError):
+    errors['copies_available'] = 'A valid integer is required.'
+
+  return (None, errors) if errors else (values, None)
+
+
+class BatchImporter:
+  """
+  Reads a stream of records and writes them `batch_size` at a time through
+  `flush`, holding only the current batch in memory.
+
+  Rows that fail validation are counted and the first `max_errors` of them are
+  kept (or passed to `on_error`) for the report. Subclasses provide `clean` and
+  `flush`; an importer is a context manager that releases what it holds open.
+  """
+
+  def __init__(self, batch_size=1000, max_errors=1000, on_error=None):
+    self.batch_size = batch_size
+    self.max_errors = max_errors
+    self.on_error = on_error
+    self.imported = 0
+    self.failed = 0
+    self.errors = []
+
+  def clean(self, record):
+    """Validate one record, returning (values, errors)."""
+    raise NotImplementedError
+
+  def check(self, values):
+    """Errors for a valid row that clashes with an earlier row of the stream, or None."""
+    return None
+
+  def key(self, line, values):
+    """Rows of a batch with the same key replace each other."""
+    return line
+
+  def row(self, values):
+    return values
+
+  def flush(self, rows):
+    """Write a batch of (line, row) pairs, counting what was imported and reporting what was not."""
+    raise NotImplementedError
+
+  def add_error(self, line, errors):
+    self.failed += 1
+    error = {'line': line, 'errors': errors}
+    if self.on_error is not None:
+      self.on_error(error)
+    elif len(self.errors) < self.max_errors:
+      self.errors.append(error)
+
+  def run(self, records):
+    batch = {}
+    for line, record in records:
+      values, errors = self.clean(record)
+      errors = errors or self.check(values)
+      if errors:
+        self.add_error(line, errors)
+        continue
+      batch[self.key(line, values)] = (line, self.row(values))
+      if len(batch) >= self.batch_size:
+        self.flush(list(batch.values()))
+        batch = {}
+    self.flush(list(batch.values()))
+    return self.report()
+
+  def report(self):
+    return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+  def close(self):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class BookImporter(BatchImporter):
+  """Upserts books on their canonical `isbn13` from a stream of records, one `bulk_create` per batch."""
+
+  def clean(self, record):
+    return clean_record(record)
+
+  def key(self, line, values):
+    # A later row for the same ISBN wins, as it would with row-by-row upserts.
+    return values['isbn13']
+
+  def row(self, values):
+    return Book(**values)
+
+  def flush(self, rows):
+    """Upsert a batch of (line, Book) rows; rows the database refuses are reported, not raised."""
+    if not rows:
+      return
+    try:
+      rejected = self.upsert(rows)
+    except IntegrityError:
+      # Something the check in `upsert` did not catch: find the rows one by one.
+      rejected = []
+      for row in rows:
+        try:
+          rejected += self.upsert([row])
+        except IntegrityError:
+          rejected.append(row[0])
+    for line in rejected:
+      self.add_error(line, {'isbn': ISBN_CONFLICT})
+    self.imported += len(rows) - len(rejected)
+
+  @retry_on_busy
+  def upsert(self, rows):
+    """Upsert `rows` in one transaction, returning the lines of the rows left out."""
+    isbn13s = {book.isbn13 for _, book in rows}
+    with transaction.atomic():
+      lock_table(Book)
+      stored = list(
+        Book.objects.filter(Q(isbn13__in=isbn13s) | Q(isbn__in=[book.isbn for _, book in rows]))
+        .values_list('isbn', 'isbn13', *FACET_FIELDS)
+      )
+      # A book holding the row's `isbn` under another (or no) isbn13 would
+      # turn the upsert into an INSERT that breaks the unique `isbn`.
+      owners = {isbn: isbn13 for isbn, isbn13, *_ in stored}
+      rejected = [line for line, book in rows if owners.get(book.isbn, book.isbn13) != book.isbn13]
+      books = [book for line, book in rows if line not in rejected]
+      if not books:
+        return rejected
+      replaced = [book_facet_keys(*row) for _, isbn13, *row in stored if isbn13 in isbn13s]
+      Book.objects.bulk_create(
+        books, update_conflicts=True, unique_fields=['isbn13'], update_fields=UPDATE_FIELDS
+      )
+      saved = Book.objects.filter(isbn13__in=[book.isbn13 for book in books]).only('id', *BOOK_FIELDS)
+      get_search_backend().update_many(saved)
+      books_replaced(replaced, [book_facet_keys(book.author, book.published_date, book.copies_available) for book in books])
+      books_changed([book.pk for book in saved])
+    return rejected
+
+
+def as_text(stream):
+  if isinstance(stream, io.TextIOBase):
+    return stream
+  return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def import_books(stream, input_format, **options):
+  with BookImporter(**options) as importer:
+    return importer.run(iter_records(as_text(stream), input_format))
+
+
+def clean_user_record(record):
+  """Validate one input record, returning (User kwargs plus 'password', errors)."""
+  if '__invalid__' in record:
+    return None, {'non_field_errors': 'Line is not a JSON object'}
+  errors, values = {}, {}
+  for field in USER_FIELDS:
+    values[field] = str(record.get(field) or '').strip()
+
+  if not values['username']:
+    errors['username'] = 'This field is required.'
+  elif len(values['username']) > 150:
+    errors['username'] = 'Ensure this field has no more than 150 characters.'
+  else:
+    try:
+      UnicodeUsernameValidator()(values['username'])
+    except ValidationError as exc:
+      errors['username'] = exc.messages[0]
+
+  if values['email']:
+    try:
+      validate_email(values['email'])
+      values['email'] = User.objects.normalize_email(values['email'])
+    except ValidationError:
+      errors['email'] = 'Enter a valid email address.'
+
+  for field in ('first_name', 'last_name'):
+    if len(values[field]) > 150:
+      errors[field] = 'Ensure this field has no more than 150 characters.'
+
+  password = record.get('password')
+  if not isinstance(password, str) or not password:
+    errors['password'] = 'This field is required.'
+  values['password'] = password
+
+  return (None, errors) if errors else (values, None)
+
+
+class UserImporter(BatchImporter):
+  """
+  Creates users from a stream of records, one `bulk_create` per batch.
+
+  Passwords are hashed across a process pool (`workers` processes, one per CPU
+  by default), which is where nearly all of the time goes. Usernames and emails
+  (case-insensitively) must be new: rows repeating one from earlier in the file
+  or already in the database are reported as errors and skipped.
+  """
+
+  def __init__(self, batch_size=1000, max_errors=1000, on_error=None, workers=None):
+    super().__init__(batch_size=batch_size, max_errors=max_errors, on_error=on_error)
+    # The pool only starts its processes on the first batch worth spreading.
+    self.hasher = PasswordHasherPool(workers)
+    self.seen_usernames = set()
+    self.seen_emails = set()
+
+  def clean(self, record):
+    return clean_user_record(record)
+
+  def check(self, values):
+    email = values['email'].lower()
+    if values['username'] in self.seen_usernames:
+      return {'username': 'A user with that username already exists.'}
+    if email and email in self.seen_emails:
+      return {'email': 'A user with that email already exists.'}
+    self.seen_usernames.add(values['username'])
+    if email:
+      self.seen_emails.add(email)
+    return None
+
+  def close(self):
+    self.hasher.close()
+
+  def drop_taken(self, rows):
+    """Split `rows` into the free ones and (line, errors) for those whose username or email is taken."""
+    taken_usernames = set(
+      User.objects.filter(username__in=[values['username'] for _, values in rows]).values_list('username', flat=True)
+    )
+    emails = [values['email'].lower() for _, values in rows if values['email']]
+    taken_emails = set(
+      User.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails).values_list('email_lower', flat=True)
+    ) if emails else set()
+
+    free, refused = [], []
+    for line, values in rows:
+      if values['username'] in taken_usernames:
+        refused.append((line, {'username': 'A user with that username already exists.'}))
+      elif values['email'] and values['email'].lower() in taken_emails:
+        refused.append((line, {'email': 'A user with that email already exists.'}))
+      else:
+        free.append((line, values))
+    return free, refused
+
+  def flush(self, rows):
+    if not rows:
+      return
+    rows, refused = self.drop_taken(rows)
+    # Hash outside the transaction so the write lock is only held for the insert.
+    hashed = dict(zip([line for line, _ in rows], self.hasher.hash([values['password'] for _, values in rows])))
+    created, late = self.insert(rows, hashed)
+    for line, errors in sorted(refused + late, key=lambda item: item[0]):
+      self.add_error(line, errors)
+    self.imported += created
+
+  @retry_on_busy
+  def insert(self, rows, hashed):
+    """Create the users in one transaction; returns (created, refused rows)."""
+    with transaction.atomic():
+      lock_table(User)
+      # Users created while this batch was being hashed are caught here.
+      rows, refused = self.drop_taken(rows)
+      User.objects.bulk_create(
+        [User(**{**values, 'password': hashed[line]}) for line, values in rows], batch_size=self.batch_size
+      )
+    return len(rows), refused
+
+
+def import_users(stream, input_format, **options):
+  with UserImporter(**options) as importer:
+    return importer.run(iter_records(as_text(stream), input_format))
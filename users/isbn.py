@@ -0,0 +1,12 @@
+"""ISBN normalization shared by the Book model, the importer and the ISBN lookups."""
+
+
+def to_isbn13(value):
+  """
+  The canonical ISBN-13 for an ISBN-10 or ISBN-13 in any common notation
+  ('0-441-17271-7', 'ISBN 9780441172719', ...), or None if it is not valid.
+  """
+  # isbnlib is imported here to keep it off the startup path.
+  from isbnlib import to_isbn13 as convert
+
+  return convert(str(value or '')) or None
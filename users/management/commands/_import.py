@@ -0,0 +1,52 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.imports import FORMATS, guess_format
+
+
+class ImportCommand(BaseCommand):
+  """
+  Shared body of the import commands: open the input (or stdin), stream it
+  through `run_import` and write rejected rows as JSON lines to `--errors` or
+  stderr. Subclasses set `noun` and implement `run_import`.
+  """
+  noun = 'rows'
+
+  def add_arguments(self, parser):
+    parser.add_argument('path', help="Input file, or '-' for stdin.")
+    parser.add_argument('--format', choices=FORMATS, help='Input format (guessed from the file extension by default).')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--errors', help='Write rejected rows to this JSONL file instead of stderr.')
+
+  def run_import(self, stream, input_format, options, on_error):
+    raise NotImplementedError
+
+  def handle(self, *args, **options):
+    path = options['path']
+    input_format = options['format'] or guess_format(path)
+    error_file = open(options['errors'], 'w') if options['errors'] else None
+
+    def on_error(error):
+      line = json.dumps(error)
+      if error_file:
+        error_file.write(line + '\n')
+      else:
+        self.stderr.write(line)
+
+    try:
+      if path == '-':
+        stream = sys.stdin
+      else:
+        try:
+          stream = open(path, encoding='utf-8-sig', newline='')
+        except OSError as exc:
+          raise CommandError(f'Cannot open {path}: {exc}')
+      with stream:
+        report = self.run_import(stream, input_format, options, on_error)
+    finally:
+      if error_file:
+        error_file.close()
+
+    self.stdout.write(self.style.SUCCESS(f"Imported {report['imported']} {self.noun}, rejected {report['failed']} rows."))
@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from users.archive import archive_transactions
+
+
+class Command(BaseCommand):
+  help = 'Move settled transactions older than a cutoff to the archive table and summarize them per user and book.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--before', help='Archive transactions before this date (YYYY-MM-DD).')
+    parser.add_argument('--older-than-days', type=int, default=365, help='Cutoff in days before today when --before is not given.')
+    parser.add_argument('--batch-size', type=int, default=5000)
+
+  def handle(self, *args, **options):
+    if options['before']:
+      try:
+        day = datetime.date.fromisoformat(options['before'])
+      except ValueError:
+        raise CommandError('--before must be in YYYY-MM-DD format.')
+    else:
+      day = timezone.localdate() - datetime.timedelta(days=options['older_than_days'])
+    cutoff = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+    summary = archive_transactions(cutoff, batch_size=options['batch_size'])
+    self.stdout.write(self.style.SUCCESS(
+      f"Archived {summary['archived']} transactions before {summary['cutoff']}; "
+      f"{summary['hot']} remain in the hot table ({summary['elapsed_ms']} ms)."
+    ))
@@ -0,0 +1,29 @@
+import json
+from importlib import import_module
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+  help = 'Run a benchmark from users.benchmarks against a throwaway database and print JSON results.'
+
+  def add_arguments(self, parser):
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    for name in BENCHMARKS:
+      module = import_module(f'users.benchmarks.{name}')
+      subparser = subparsers.add_parser(name, help=(module.__doc__ or '').strip().splitlines()[0])
+      subparser.add_argument('--output', help='Also write the results to this JSON file.')
+      module.add_arguments(subparser)
+
+  def handle(self, *args, **options):
+    module = import_module(f"users.benchmarks.{options['benchmark']}")
+    results = module.run(self.stdout, **options)
+    report = json.dumps(results, indent=2, default=str)
+    if options.get('output'):
+      with open(options['output'], 'w') as output:
+        output.write(report)
+    self.stdout.write(report)
+    if options.get('fail_on_regression') and results.get('regressions'):
+      raise CommandError(f"{len(results['regressions'])} regression(s) against the baseline.")
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users import exports
+
+
+class Command(BaseCommand):
+  help = 'Stream transactions as NDJSON or CSV at constant memory, optionally resuming after a given id.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--format', choices=sorted(exports.FORMATS), default='ndjson')
+    parser.add_argument('--user', type=int, help='Only export this user id.')
+    parser.add_argument('--since', help='ISO date or datetime lower bound on transaction_date.')
+    parser.add_argument('--until', help='ISO date or datetime upper bound on transaction_date.')
+    parser.add_argument('--after', type=int, help='Resume after this transaction id.')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--output', help='Write to this file instead of stdout.')
+
+  def handle(self, *args, **options):
+    try:
+      rows = exports.export_rows(
+        user=options['user'],
+        since=exports.parse_bound(options['since']),
+        until=exports.parse_bound(options['until'], end=True),
+        after=options['after'],
+        chunk_size=options['chunk_size'],
+      )
+    except ValueError as exc:
+      raise CommandError(exc)
+
+    output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+    try:
+      for text in exports.render(rows, options['format']):
+        output.write(text)
+    finally:
+      if output is not sys.stdout:
+        output.close()
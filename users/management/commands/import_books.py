@@ -0,0 +1,11 @@
+from users.imports import import_books
+
+from ._import import ImportCommand
+
+
+class Command(ImportCommand):
+  help = 'Stream books from a CSV or JSONL file into the catalog, upserting on ISBN.'
+  noun = 'books'
+
+  def run_import(self, stream, input_format, options, on_error):
+    return import_books(stream, input_format, batch_size=options['batch_size'], on_error=on_error)
@@ -0,0 +1,17 @@
+from users.imports import import_users
+
+from ._import import ImportCommand
+
+
+class Command(ImportCommand):
+  help = 'Create users from a CSV or JSONL file, hashing passwords across a process pool.'
+  noun = 'users'
+
+  def add_arguments(self, parser):
+    super().add_arguments(parser)
+    parser.add_argument('--workers', type=int, help='Hashing processes (defaults to the number of CPUs).')
+
+  def run_import(self, stream, input_format, options, on_error):
+    return import_users(
+      stream, input_format, batch_size=options['batch_size'], workers=options['workers'], on_error=on_error
+    )
@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.overdue import process_overdue
+
+
+class Command(BaseCommand):
+  help = (
+    'Record newly overdue loans, settle the fines of returned ones and expire ready holds not picked up. '
+    'Safe to run repeatedly.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('--date', help='Process as of this date (YYYY-MM-DD); defaults to today.')
+    parser.add_argument('--batch-size', type=int, default=5000)
+
+  def handle(self, *args, **options):
+    today = None
+    if options['date']:
+      try:
+        today = datetime.date.fromisoformat(options['date'])
+      except ValueError:
+        raise CommandError('--date must be in YYYY-MM-DD format.')
+
+    summary = process_overdue(today, batch_size=options['batch_size'])
+    self.stdout.write(self.style.SUCCESS(
+      f"{summary['date']}: {summary['newly_overdue']} newly overdue, {summary['settled_returns']} settled, "
+      f"{summary['late_returns']} late returns, {summary['expired_holds']} holds expired; {summary['open']} open with {summary['accrued_fines']} in fines "
+      f"({summary['elapsed_ms']} ms)."
+    ))
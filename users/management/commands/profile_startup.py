@@ -0,0 +1,114 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter, like a lambda cold start: load the WSGI app, then
+# serve one GET through it. wsgiref is imported before the clock starts.
+STARTUP_SCRIPT = """
+import json, sys, time
+from wsgiref.util import setup_testing_defaults
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+ready = time.perf_counter()
+path, _, query = sys.argv[1].partition('?')
+environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query}
+setup_testing_defaults(environ)
+statuses = []
+b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+done = time.perf_counter()
+print(json.dumps({'setup': ready - start, 'first_response': done - ready, 'status': int(statuses[0].split()[0])}))
+"""
+
+
+def parse_importtime(stderr):
+  """(module, self_us, cumulative_us) rows from `python -X importtime` output."""
+  rows = []
+  for line in stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    self_us, cumulative_us, name = line[len('import time:'):].split('|')
+    rows.append((name.strip(), int(self_us), int(cumulative_us)))
+  return rows
+
+
+class Command(BaseCommand):
+  help = 'Measure cold-start import time per module and time to first response for one or more settings modules.'
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      '--profile-settings', nargs='+',
+      help='Settings modules to profile (defaults to the current one and libraryproject.settings_api).',
+    )
+    parser.add_argument('--path', default='/api/books', help='Path of the first request.')
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts per settings module.')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest modules and packages to list.')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+
+  def handle(self, *args, **options):
+    modules = options['profile_settings'] or list(dict.fromkeys([settings.SETTINGS_MODULE, 'libraryproject.settings_api']))
+    results = {'path': options['path'], 'runs': options['runs'], 'profiles': {}}
+    for module in modules:
+      self.stderr.write(f'Profiling {module}...')
+      results['profiles'][module] = self.profile(module, options['path'], options['runs'], options['top'])
+
+    if len(modules) > 1:
+      baseline = results['profiles'][modules[0]]['time_to_first_response_ms']
+      for module in modules[1:]:
+        current = results['profiles'][module]['time_to_first_response_ms']
+        results['profiles'][module]['saved_vs_first_ms'] = round(baseline - current, 1)
+
+    report = json.dumps(results, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as output:
+        output.write(report)
+    self.stdout.write(report)
+
+  def cold_start(self, module, path, importtime=False):
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': module}
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', STARTUP_SCRIPT, path]
+    started = time.perf_counter()
+    process = subprocess.run(command, env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if process.returncode:
+      raise CommandError(f'Cold start under {module} failed:\n{process.stderr.strip()[-2000:]}')
+    timings = json.loads(process.stdout.strip().splitlines()[-1])
+    timings['process'] = elapsed
+    return timings, process.stderr
+
+  def profile(self, module, path, runs, top):
+    samples = [self.cold_start(module, path)[0] for _ in range(max(runs, 1))]
+    # Import timing is collected separately: -X importtime slows the interpreter down.
+    _, stderr = self.cold_start(module, path, importtime=True)
+    imports = parse_importtime(stderr)
+
+    packages = defaultdict(int)
+    for name, self_us, _ in imports:
+      packages[name.split('.')[0]] += self_us
+
+    def median_ms(key):
+      return round(statistics.median(sample[key] for sample in samples) * 1000, 1)
+
+    return {
+      'status': samples[-1]['status'],
+      'setup_ms': median_ms('setup'),
+      'first_response_ms': median_ms('first_response'),
+      'time_to_first_response_ms': round(median_ms('setup') + median_ms('first_response'), 1),
+      'process_ms': median_ms('process'),
+      'modules_imported': len(imports),
+      'import_total_ms': round(sum(self_us for _, self_us, _ in imports) / 1000, 1),
+      'slowest_packages_ms': {
+        name: round(us / 1000, 1) for name, us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+      },
+      'slowest_modules_ms': [
+        {'module': name, 'self': round(self_us / 1000, 1), 'cumulative': round(cumulative_us / 1000, 1)}
+        for name, self_us, cumulative_us in sorted(imports, key=lambda row: -row[1])[:top]
+      ],
+    }
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.facets import rebuild_facets
+
+
+class Command(BaseCommand):
+  help = 'Recompute the catalog facet counts (author, publication year, availability) from the Book table.'
+
+  def handle(self, *args, **options):
+    count = rebuild_facets()
+    self.stdout.write(self.style.SUCCESS(f'Counted {count} facet values.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from users.related import TOP_K, rebuild_related
+
+
+class Command(BaseCommand):
+  help = 'Rebuild the "also borrowed" index from the CHECKOUT transactions.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--chunk-size', type=int, default=20000, help='Transactions read per database round trip.')
+    parser.add_argument('--top', type=int, default=TOP_K, help='Related books kept per book.')
+
+  def handle(self, *args, **options):
+    summary = rebuild_related(chunk_size=options['chunk_size'], top_k=options['top'])
+    self.stdout.write(self.style.SUCCESS(f"Indexed {summary['pairs']} pairs for {summary['books']} books."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from users.search import get_search_backend
+
+
+class Command(BaseCommand):
+  help = 'Rebuild the catalog search index from the Book table.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=2000)
+    parser.add_argument('--backend', help='Dotted path of the search backend (defaults to BOOK_SEARCH_BACKEND).')
+
+  def handle(self, *args, **options):
+    backend = get_search_backend(options['backend'])
+    count = backend.rebuild(batch_size=options['batch_size'])
+    self.stdout.write(self.style.SUCCESS(f'Indexed {count} books with {type(backend).__name__}.'))
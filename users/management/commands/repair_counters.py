@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.counters import repair_counters
+
+
+class Command(BaseCommand):
+  help = 'Recompute the circulation counters on users and books from the loans and the transaction log.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--check', action='store_true', help='Only report stale counters, and fail if there are any.')
+    parser.add_argument('--batch-size', type=int, default=2000)
+
+  def handle(self, *args, **options):
+    report = repair_counters(batch_size=options['batch_size'], fix=not options['check'])
+    summary = ', '.join(f"{name}: {counts['stale']} of {counts['checked']} stale" for name, counts in report.items())
+    if options['check'] and any(counts['stale'] for counts in report.values()):
+      raise CommandError(f'Counters disagree with the log ({summary}).')
+    self.stdout.write(self.style.SUCCESS(f"{'Checked' if options['check'] else 'Repaired'} counters ({summary})."))
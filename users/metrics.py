@@ -0,0 +1,248 @@
+"""
+Per-route request metrics, kept in process and served in the Prometheus text format.
+
+MetricsMiddleware attributes each request to its URL name (`book-checkout`,
+`user-borrowing-history`, ...) and records its latency in a histogram, the
+number and total duration of its SQL queries and the response size. Queries
+are counted by a wrapper installed on every database connection, which does
+nothing outside a request. Aggregates are per process, so scrape every worker.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+logger = logging.getLogger('users.metrics')
+
+# Latency bucket bounds in seconds, as in the Prometheus client defaults.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_SQL_LIMIT = 20
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+  """SQL run on behalf of one request; `sql` is only kept for the slow-request log."""
+  __slots__ = ('queries', 'db_time', 'sql')
+
+  def __init__(self, capture_sql=False):
+    self.queries = 0
+    self.db_time = 0.0
+    self.sql = [] if capture_sql else None
+
+
+def record_query(execute, sql, params, many, context):
+  stats = _current.get()
+  if stats is None:
+    return execute(sql, params, many, context)
+  started = time.perf_counter()
+  try:
+    return execute(sql, params, many, context)
+  finally:
+    elapsed = time.perf_counter() - started
+    stats.queries += 1
+    stats.db_time += elapsed
+    if stats.sql is not None:
+      stats.sql.append((elapsed, sql))
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+  if record_query not in connection.execute_wrappers:
+    connection.execute_wrappers.append(record_query)
+
+
+class RouteStats:
+  __slots__ = ('buckets', 'count', 'latency', 'queries', 'db_time', 'bytes')
+
+  def __init__(self):
+    self.buckets = [0] * (len(BUCKETS) + 1)
+    self.count = 0
+    self.latency = 0.0
+    self.queries = 0
+    self.db_time = 0.0
+    self.bytes = 0
+
+
+def format_value(value):
+  return f'{value:.6f}' if isinstance(value, float) else str(value)
+
+
+class Registry:
+  """Thread-safe aggregates keyed by (route, method)."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.routes = {}
+    self.statuses = {}
+
+  def observe(self, route, method, status, duration, queries, db_time, size):
+    bucket = bisect.bisect_left(BUCKETS, duration)
+    with self.lock:
+      stats = self.routes.get((route, method))
+      if stats is None:
+        stats = self.routes[(route, method)] = RouteStats()
+      stats.buckets[bucket] += 1
+      stats.count += 1
+      stats.latency += duration
+      stats.queries += queries
+      stats.db_time += db_time
+      stats.bytes += size
+      key = (route, method, status)
+      self.statuses[key] = self.statuses.get(key, 0) + 1
+
+  def reset(self):
+    with self.lock:
+      self.routes.clear()
+      self.statuses.clear()
+
+  def render(self):
+    with self.lock:
+      routes = {key: (list(stats.buckets), stats.count, stats.latency, stats.queries, stats.db_time, stats.bytes)
+                for key, stats in self.routes.items()}
+      statuses = dict(self.statuses)
+
+    lines = [
+      '# HELP library_http_requests_total Requests served, by route, method and status.',
+      '# TYPE library_http_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(statuses.items()):
+      lines.append(f'library_http_requests_total{{route="{route}",method="{method}",status="{status}"}} {count}')
+
+    lines += [
+      '# HELP library_http_request_duration_seconds Time to produce the response, by route.',
+      '# TYPE library_http_request_duration_seconds histogram',
+    ]
+    for (route, method), (buckets, count, latency, _, _, _) in sorted(routes.items()):
+      labels = f'route="{route}",method="{method}"'
+      cumulative = 0
+      for bound, observed in zip(BUCKETS + ('+Inf',), buckets):
+        cumulative += observed
+        lines.append(f'library_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+      lines.append(f'library_http_request_duration_seconds_sum{{{labels}}} {format_value(latency)}')
+      lines.append(f'library_http_request_duration_seconds_count{{{labels}}} {count}')
+
+    for name, index, text in [
+      ('library_db_queries_total', 3, 'SQL queries run, by route.'),
+      ('library_db_query_duration_seconds_total', 4, 'Time spent in SQL queries, by route.'),
+      ('library_http_response_size_bytes_total', 5, 'Response body bytes sent, by route.'),
+    ]:
+      lines += [f'# HELP {name} {text}', f'# TYPE {name} counter']
+      for (route, method), values in sorted(routes.items()):
+        lines.append(f'{name}{{route="{route}",method="{method}"}} {format_value(values[index])}')
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+  return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+  """
+  Records every request in `registry`. Set SLOW_REQUEST_THRESHOLD_MS to also log
+  the SQL of requests slower than that to the `users.metrics` logger.
+  """
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.async_mode = iscoroutinefunction(get_response)
+    if self.async_mode:
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if self.async_mode:
+      return self.__acall__(request)
+    stats, started = self.start()
+    token = _current.set(stats)
+    try:
+      response = self.get_response(request)
+    finally:
+      _current.reset(token)
+    return self.finish(request, response, stats, started)
+
+  async def __acall__(self, request):
+    stats, started = self.start()
+    token = _current.set(stats)
+    try:
+      response = await self.get_response(request)
+    finally:
+      _current.reset(token)
+    return self.finish(request, response, stats, started)
+
+  def start(self):
+    return RequestStats(capture_sql=self.slow_threshold() is not None), time.perf_counter()
+
+  def slow_threshold(self):
+    threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', None)
+    return threshold / 1000 if threshold is not None else None
+
+  def finish(self, request, response, stats, started):
+    match = request.resolver_match
+    route = (match.url_name if match else None) or 'unmatched'
+
+    def record(size):
+      duration = time.perf_counter() - started
+      registry.observe(route, request.method, response.status_code, duration, stats.queries, stats.db_time, size)
+      threshold = self.slow_threshold()
+      if threshold is not None and duration >= threshold:
+        self.log_slow(request, route, duration, stats)
+
+    if response.streaming:
+      # Streamed bodies run their queries while being sent; record once they finish.
+      if response.is_async:
+        response.streaming_content = self.acount_stream(response.streaming_content, stats, record)
+      else:
+        response.streaming_content = self.count_stream(response.streaming_content, stats, record)
+    else:
+      record(len(response.content))
+    return response
+
+  @staticmethod
+  def count_stream(content, stats, record):
+    size = 0
+    iterator = iter(content)
+    try:
+      while True:
+        token = _current.set(stats)
+        try:
+          chunk = next(iterator)
+        except StopIteration:
+          return
+        finally:
+          _current.reset(token)
+        size += len(chunk)
+        yield chunk
+    finally:
+      record(size)
+
+  @staticmethod
+  async def acount_stream(content, stats, record):
+    size = 0
+    try:
+      async for chunk in content:
+        size += len(chunk)
+        yield chunk
+    finally:
+      record(size)
+
+  @staticmethod
+  def log_slow(request, route, duration, stats):
+    slowest = sorted(stats.sql or [], key=lambda item: -item[0])[:SLOW_SQL_LIMIT]
+    logger.warning(
+      'Slow request %s %s (%s): %.1f ms, %d queries, %.1f ms in SQL%s',
+      request.method, request.get_full_path(), route, duration * 1000, stats.queries, stats.db_time * 1000,
+      ''.join(f'\n  {elapsed * 1000:.2f} ms  {sql}' for elapsed, sql in slowest),
+    )
@@ -0,0 +1,74 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_loans(apps, schema_editor):
+    # A (user, book) pair is on loan when its latest transaction is a checkout.
+    Transaction = apps.get_model('users', 'Transaction')
+    Loan = apps.get_model('users', 'Loan')
+    rows = Transaction.objects.order_by('user_id', 'book_id', 'transaction_date', 'id').values_list(
+        'id', 'user_id', 'book_id', 'transaction_type', 'transaction_date', 'due_date'
+    )
+    loans, last = [], None
+    for row in rows.iterator(chunk_size=5000):
+        if last is not None and last[1:3] != row[1:3] and last[3] == 'CO':
+            loans.append(Loan(checkout_id=last[0], user_id=last[1], book_id=last[2], checked_out_at=last[4], due_date=last[5]))
+            if len(loans) >= 5000:
+                Loan.objects.bulk_create(loans)
+                loans = []
+        last = row
+    if last is not None and last[3] == 'CO':
+        loans.append(Loan(checkout_id=last[0], user_id=last[1], book_id=last[2], checked_out_at=last[4], due_date=last[5]))
+    Loan.objects.bulk_create(loans)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Loan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checked_out_at', models.DateTimeField()),
+                ('due_date', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-checked_out_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'book', 'transaction_type'], name='txn_user_book_type_idx'),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loans', to='users.book'),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='checkout',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='loan', to='users.transaction'),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loans', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['user', '-checked_out_at', '-id'], name='loan_user_date_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='loan',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='unique_active_loan'),
+        ),
+        migrations.RunPython(populate_loans, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:51
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+from isbnlib import to_isbn13
+
+
+def populate_isbn13(apps, schema_editor):
+    # Rows spelling the same ISBN differently (ISBN-10 and ISBN-13) are one
+    # book: the oldest row keeps the ISBN and the later ones are merged into it.
+    Book = apps.get_model('users', 'Book')
+    keepers, duplicates, batch = {}, defaultdict(list), []
+    for book in Book.objects.order_by('id').only('id', 'isbn').iterator(chunk_size=5000):
+        book.isbn13 = to_isbn13(book.isbn) or None
+        if book.isbn13 is None:
+            continue
+        if book.isbn13 in keepers:
+            duplicates[keepers[book.isbn13]].append(book.id)
+            continue
+        keepers[book.isbn13] = book.id
+        batch.append(book)
+        if len(batch) >= 5000:
+            Book.objects.bulk_update(batch, ['isbn13'])
+            batch = []
+    Book.objects.bulk_update(batch, ['isbn13'])
+    if duplicates:
+        merge_duplicates(apps, schema_editor, duplicates)
+
+
+def merge_duplicates(apps, schema_editor, duplicates):
+    """
+    Move the duplicates' transactions and loans to the book kept for their
+    ISBN, add their copies to its stock and delete them. A patron with loans on
+    two of the rows would end up with two loans of one book, so that stops the
+    migration with a list of the loans to return first.
+    """
+    Book = apps.get_model('users', 'Book')
+    Loan = apps.get_model('users', 'Loan')
+    Transaction = apps.get_model('users', 'Transaction')
+    keeper_of = {duplicate: keeper for keeper, group in duplicates.items() for duplicate in group}
+
+    borrowers = defaultdict(list)
+    loans = Loan.objects.filter(book_id__in=[*duplicates, *keeper_of]).values_list('user_id', 'book_id')
+    for user_id, book_id in loans.iterator(chunk_size=5000):
+        borrowers[user_id, keeper_of.get(book_id, book_id)].append(book_id)
+    conflicts = [
+        f'  user {user_id} has books {", ".join(map(str, sorted(book_ids)))} on loan'
+        for (user_id, _), book_ids in sorted(borrowers.items()) if len(book_ids) > 1
+    ]
+    if conflicts:
+        raise RuntimeError(
+            'Cannot merge books that share an ISBN while a patron has more than one of them on loan. '
+            'Return these loans and migrate again:\n' + '\n'.join(conflicts)
+        )
+
+    for keeper, group in duplicates.items():
+        copies = Book.objects.filter(pk__in=group).aggregate(total=Sum('copies_available'))['total']
+        Transaction.objects.filter(book_id__in=group).update(book_id=keeper)
+        Loan.objects.filter(book_id__in=group).update(book_id=keeper)
+        Book.objects.filter(pk=keeper).update(copies_available=F('copies_available') + copies)
+    merged = list(keeper_of)
+    for start in range(0, len(merged), 500):
+        chunk = merged[start:start + 500]
+        Book.objects.filter(pk__in=chunk).delete()
+        placeholders = ', '.join(['%s'] * len(chunk))
+        schema_editor.execute(f'DELETE FROM users_book_fts WHERE rowid IN ({placeholders})', chunk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_active_loans'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='isbn13',
+            field=models.CharField(editable=False, max_length=13, null=True, unique=True),
+        ),
+        migrations.RunPython(populate_isbn13, migrations.RunPython.noop),
+    ]
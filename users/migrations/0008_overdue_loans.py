@@ -0,0 +1,66 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_book_isbn13'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Overdue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_date', models.DateField()),
+                ('returned_at', models.DateTimeField(blank=True, null=True)),
+                ('fine', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['due_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OverdueRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_date', models.DateField()),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('last_transaction_id', models.BigIntegerField()),
+                ('created', models.IntegerField(default=0)),
+                ('settled', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['due_date'], name='loan_due_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='overdue',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='overdues', to='users.book'),
+        ),
+        migrations.AddField(
+            model_name='overdue',
+            name='checkout',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='overdue', to='users.transaction'),
+        ),
+        migrations.AddField(
+            model_name='overdue',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='overdues', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='overdue',
+            index=models.Index(fields=['due_date', 'id'], name='overdue_due_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:06
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    # One correlated UPDATE per table, from the loans and the transaction log.
+    Loan = apps.get_model('users', 'Loan')
+    Transaction = apps.get_model('users', 'Transaction')
+    for model_name, key in [('User', 'user'), ('Book', 'book')]:
+        model = apps.get_model('users', model_name)
+
+        def aggregate(queryset, expression):
+            rows = queryset.filter(**{key: OuterRef('pk')}).order_by().values(key).annotate(value=expression)
+            return Subquery(rows.values('value'))
+
+        model.objects.update(
+            active_loans=Coalesce(aggregate(Loan.objects.all(), Count('id')), Value(0)),
+            total_checkouts=Coalesce(aggregate(Transaction.objects.all(), Count('id', filter=Q(transaction_type='CO'))), Value(0)),
+            last_activity_at=aggregate(Transaction.objects.all(), Max('transaction_date')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_overdue_loans'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='active_loans',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_checkouts',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='active_loans',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='total_checkouts',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-total_checkouts', '-id'], name='book_popularity_idx'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
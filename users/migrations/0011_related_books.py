@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related', to='users.book')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', '-score', 'other'], name='related_book_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'other'), name='unique_related_pair')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:27
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractYear
+
+
+def populate_facets(apps, schema_editor):
+    # One GROUP BY per facet over the existing catalog.
+    Book = apps.get_model('users', 'Book')
+    BookFacet = apps.get_model('users', 'BookFacet')
+    books = Book.objects.order_by()
+    rows = [
+        BookFacet(facet='author', value=author, count=count)
+        for author, count in books.values_list('author').annotate(count=Count('id'))
+    ]
+    rows += [
+        BookFacet(facet='year', value=str(year), count=count)
+        for year, count in books.annotate(year=ExtractYear('published_date')).values_list('year').annotate(count=Count('id'))
+    ]
+    availability = books.aggregate(true=Count('id', filter=Q(copies_available__gt=0)), false=Count('id', filter=Q(copies_available__lte=0)))
+    rows += [BookFacet(facet='available', value=value, count=count) for value, count in availability.items() if count]
+    BookFacet.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_related_books'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=16)),
+                ('value', models.CharField(max_length=200)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author'], name='book_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['published_date'], name='book_published_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookfacet',
+            index=models.Index(fields=['facet', '-count', 'value'], name='book_facet_count_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookfacet',
+            constraint=models.UniqueConstraint(fields=('facet', 'value'), name='unique_book_facet'),
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
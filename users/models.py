@@ -1,16 +1,34 @@
+from decimal import Decimal
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
-from isbnlib import is_isbn10, is_isbn13
+from django.utils import timezone
+
+from .isbn import to_isbn13
+
+
+def fine_for(days):
+  """The fine for a book returned `days` late: OVERDUE_FINE_PER_DAY a day, capped at OVERDUE_FINE_CAP."""
+  per_day = Decimal(str(getattr(settings, 'OVERDUE_FINE_PER_DAY', '0.25')))
+  cap = Decimal(str(getattr(settings, 'OVERDUE_FINE_CAP', '10.00')))
+  return min(per_day * max(days, 0), cap).quantize(Decimal('0.01'))
+
 
 # Create your models here.
 class User(AbstractUser):
   date_of_membership = models.DateField(auto_now_add=True)
   is_active = models.BooleanField(default=True)
+  # Circulation counters, maintained by users.circulation (see users.counters).
+  active_loans = models.PositiveIntegerField(default=0, editable=False)
+  total_checkouts = models.PositiveIntegerField(default=0, editable=False)
+  last_activity_at = models.DateTimeField(null=True, blank=True, editable=False)
 
   class Meta:
     ordering = ['-date_joined']
+    indexes = [models.Index(fields=['-date_joined', '-id'], name='user_date_joined_id_idx')]
 
   def __str__(self):
     return self.username
@@ -20,18 +38,38 @@ class Book(models.Model):
   title = models.CharField(max_length=200)
   author = models.CharField(max_length=200)
   isbn = models.CharField(max_length=13, unique=True)
+  # Canonical ISBN-13 of `isbn`, kept in sync by save(); NULL for invalid ISBNs.
+  isbn13 = models.CharField(max_length=13, unique=True, null=True, editable=False)
   published_date = models.DateField()
   copies_available = models.IntegerField(validators=[MinValueValidator(0)])
   created_at = models.DateTimeField(auto_now_add=True)
   updated_at = models.DateTimeField(auto_now=True)
+  # Circulation counters, maintained by users.circulation (see users.counters).
+  active_loans = models.PositiveIntegerField(default=0, editable=False)
+  total_checkouts = models.PositiveIntegerField(default=0, editable=False)
+  last_activity_at = models.DateTimeField(null=True, blank=True, editable=False)
 
   class Meta:
     ordering = ['title']
+    indexes = [
+      models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+      models.Index(fields=['-total_checkouts', '-id'], name='book_popularity_idx'),
+      models.Index(fields=['author'], name='book_author_idx'),
+      models.Index(fields=['published_date'], name='book_published_date_idx'),
+    ]
 
   def clean(self):
-    if not (is_isbn10(self.isbn) or is_isbn13(self.isbn)):
+    if to_isbn13(self.isbn) is None:
       raise ValidationError({'isbn': 'Invalid ISBN number'})
 
+  def save(self, *args, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is None or 'isbn' in update_fields:
+      self.isbn13 = to_isbn13(self.isbn)
+      if update_fields is not None:
+        kwargs['update_fields'] = {*update_fields, 'isbn13'}
+    super().save(*args, **kwargs)
+
   def __str__(self):
     return f"{self.title} by {self.author}"
   
@@ -49,6 +87,180 @@ class Transaction(models.Model):
 
   class Meta:
     ordering = ['-transaction_date']
+    indexes = [
+      models.Index(fields=['user', '-transaction_date', '-id'], name='txn_user_date_id_idx'),
+      models.Index(fields=['user', 'book', 'transaction_type'], name='txn_user_book_type_idx'),
+    ]
+
+  def __str__(self):
+    return f"{self.user.username}"
+
+
+class ArchivedTransaction(models.Model):
+  """
+  A Transaction moved out of the hot table by users.archive, with the same id
+  and columns but only the index the borrowing history reads.
+  """
+  id = models.BigIntegerField(primary_key=True)
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+  book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+', db_index=False)
+  transaction_type = models.CharField(max_length=2, choices=Transaction.TRANSACTION_TYPES)
+  transaction_date = models.DateTimeField()
+  due_date = models.DateField(null=True, blank=True)
+
+  class Meta:
+    ordering = ['-transaction_date']
+    indexes = [models.Index(fields=['user', '-transaction_date', '-id'], name='archive_user_date_id_idx')]
+
+  def __str__(self):
+    return f"{self.user_id}"
+
+
+class TransactionSummary(models.Model):
+  """What a user's archived transactions on one book add up to."""
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+  book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+  checkouts = models.PositiveIntegerField(default=0)
+  returns = models.PositiveIntegerField(default=0)
+  last_at = models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    constraints = [models.UniqueConstraint(fields=['user', 'book'], name='unique_transaction_summary')]
+
+  def __str__(self):
+    return f"{self.user_id} archived on {self.book_id}"
+
+
+class ArchiveRun(models.Model):
+  """One pass of users.archive; every archived transaction is older than the latest cutoff."""
+  cutoff = models.DateTimeField()
+  started_at = models.DateTimeField()
+  finished_at = models.DateTimeField(null=True, blank=True)
+  archived = models.IntegerField(default=0)
+
+  class Meta:
+    ordering = ['-id']
+
+  def __str__(self):
+    return f"Archive run before {self.cutoff}"
+
+
+class Loan(models.Model):
+  """A book a user currently has out; created on checkout and deleted on return."""
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='loans')
+  book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='loans')
+  checkout = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='loan')
+  checked_out_at = models.DateTimeField()
+  due_date = models.DateField(null=True, blank=True)
+
+  class Meta:
+    ordering = ['-checked_out_at']
+    constraints = [models.UniqueConstraint(fields=['user', 'book'], name='unique_active_loan')]
+    indexes = [
+      models.Index(fields=['user', '-checked_out_at', '-id'], name='loan_user_date_id_idx'),
+      models.Index(fields=['due_date'], name='loan_due_date_idx'),
+    ]
+
+  def __str__(self):
+    return f"{self.user_id} has {self.book_id}"
+
+
+class Hold(models.Model):
+  """
+  A patron queued for a book that is out of stock, served first come first
+  served. READY means a copy has been set aside for them; the hold is deleted
+  when they check it out or cancel.
+  """
+  WAITING = 'WA'
+  READY = 'RD'
+  STATUSES = [(WAITING, 'Waiting'), (READY, 'Ready')]
+
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+  book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
+  status = models.CharField(max_length=2, choices=STATUSES, default=WAITING)
+  created_at = models.DateTimeField(auto_now_add=True)
+  ready_at = models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    ordering = ['created_at', 'id']
+    constraints = [models.UniqueConstraint(fields=['user', 'book'], name='unique_hold')]
+    indexes = [models.Index(fields=['book', 'created_at', 'id'], name='hold_book_created_idx')]
+
+  def __str__(self):
+    return f"{self.user_id} waits for {self.book_id}"
+
+
+class RelatedBook(models.Model):
+  """How many patrons borrowed both `book` and `other`; the top pairs per book, kept by users.related."""
+  book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='related')
+  other = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+  score = models.PositiveIntegerField(default=0)
+
+  class Meta:
+    constraints = [models.UniqueConstraint(fields=['book', 'other'], name='unique_related_pair')]
+    indexes = [models.Index(fields=['book', '-score', 'other'], name='related_book_score_idx')]
+
+  def __str__(self):
+    return f"{self.book_id} borrowed with {self.other_id}"
+
+
+class BookFacet(models.Model):
+  """How many books have `value` for `facet` across the whole catalog, kept by users.facets."""
+  facet = models.CharField(max_length=16)
+  value = models.CharField(max_length=200)
+  count = models.IntegerField(default=0)
+
+  class Meta:
+    constraints = [models.UniqueConstraint(fields=['facet', 'value'], name='unique_book_facet')]
+    indexes = [models.Index(fields=['facet', '-count', 'value'], name='book_facet_count_idx')]
+
+  def __str__(self):
+    return f"{self.facet}={self.value}: {self.count}"
+
+
+class Overdue(models.Model):
+  """
+  A checkout kept past its due date, recorded by users.overdue.process_overdue.
+
+  While the book is still out the fine keeps accruing and is computed on read;
+  it is settled into `fine` when the return is processed.
+  """
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='overdues')
+  book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='overdues')
+  checkout = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='overdue')
+  due_date = models.DateField()
+  returned_at = models.DateTimeField(null=True, blank=True)
+  fine = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+  updated_at = models.DateTimeField()
+
+  class Meta:
+    ordering = ['due_date']
+    indexes = [models.Index(fields=['due_date', 'id'], name='overdue_due_date_id_idx')]
+
+  def days_overdue(self, today):
+    end = timezone.localdate(self.returned_at) if self.returned_at else today
+    return max((end - self.due_date).days, 0)
+
+  def fine_on(self, today):
+    if self.fine is not None:
+      return self.fine
+    return fine_for(self.days_overdue(today))
+
+  def __str__(self):
+    return f"{self.user_id} owes on {self.book_id}"
+
+
+class OverdueRun(models.Model):
+  """One pass of the overdue engine; the latest run's watermark bounds the next one."""
+  run_date = models.DateField()
+  started_at = models.DateTimeField()
+  finished_at = models.DateTimeField()
+  last_transaction_id = models.BigIntegerField()
+  created = models.IntegerField(default=0)
+  settled = models.IntegerField(default=0)
+
+  class Meta:
+    ordering = ['-id']
 
   def __str__(self):
-    return f"{self.user.username}"
\ No newline at end of file
+    return f"Overdue run for {self.run_date}"
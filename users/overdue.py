@@ -0,0 +1,140 @@
+"""
+Overdue loans and fines, computed incrementally by `process_overdue`.
+
+A run only touches what changed since the previous one:
+
+* active loans that have fallen due and are not recorded yet (a range scan on
+  loan_due_date_idx),
+* recorded overdues whose loan has been returned since, settled from the
+  RETURN transaction paired with their checkout,
+* late returns after the previous run's transaction watermark whose loan was
+  never seen overdue, e.g. due yesterday and returned this morning.
+
+The run also expires ready holds that were not picked up in time, so their
+copies go to the next patron in line.
+
+Everything is selected in SQL; Python only builds the rows being written.
+"""
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .circulation import expire_ready_holds
+from .models import Loan, Overdue, OverdueRun, Transaction, fine_for
+
+
+def in_batches(rows, size):
+  for start in range(0, len(rows), size):
+    yield rows[start:start + size]
+
+
+def record_new_overdues(today, now, batch_size):
+  recorded = Overdue.objects.filter(checkout_id=OuterRef('checkout_id'))
+  loans = list(
+    Loan.objects.filter(due_date__lt=today).filter(~Exists(recorded)).order_by()
+    .values_list('user_id', 'book_id', 'checkout_id', 'due_date')
+  )
+  for batch in in_batches(loans, batch_size):
+    with transaction.atomic():
+      Overdue.objects.bulk_create([
+        Overdue(user_id=user_id, book_id=book_id, checkout_id=checkout_id, due_date=due_date, updated_at=now)
+        for user_id, book_id, checkout_id, due_date in batch
+      ])
+  return len(loans)
+
+
+def settle_returned(now, batch_size):
+  returns = Transaction.objects.filter(
+    user=OuterRef('user_id'), book=OuterRef('book_id'),
+    transaction_type=Transaction.RETURN, id__gt=OuterRef('checkout_id'),
+  ).order_by('id')
+  overdues = list(
+    Overdue.objects.filter(returned_at__isnull=True)
+    .filter(~Exists(Loan.objects.filter(checkout_id=OuterRef('checkout_id'))))
+    .annotate(return_date=Subquery(returns.values('transaction_date')[:1]))
+    .filter(return_date__isnull=False)
+    .only('id', 'due_date')
+  )
+  for overdue in overdues:
+    overdue.returned_at = overdue.return_date
+    overdue.fine = fine_for(overdue.days_overdue(None))
+    overdue.updated_at = now
+  for batch in in_batches(overdues, batch_size):
+    with transaction.atomic():
+      Overdue.objects.bulk_update(batch, ['returned_at', 'fine', 'updated_at'])
+  return len(overdues)
+
+
+def record_late_returns(after_id, up_to_id, now, batch_size):
+  checkouts = Transaction.objects.filter(
+    user=OuterRef('user_id'), book=OuterRef('book_id'),
+    transaction_type=Transaction.CHECKOUT, id__lt=OuterRef('id'),
+  ).order_by('-id')
+  returns = list(
+    Transaction.objects.filter(transaction_type=Transaction.RETURN, id__gt=after_id, id__lte=up_to_id)
+    .annotate(checkout_ref=Subquery(checkouts.values('id')[:1]), checkout_due=Subquery(checkouts.values('due_date')[:1]))
+    .filter(checkout_due__lt=TruncDate('transaction_date'))
+    .filter(~Exists(Overdue.objects.filter(checkout_id=OuterRef('checkout_ref'))))
+    .order_by()
+    .values_list('user_id', 'book_id', 'checkout_ref', 'checkout_due', 'transaction_date')
+  )
+  rows = []
+  for user_id, book_id, checkout_id, due_date, returned_at in returns:
+    overdue = Overdue(
+      user_id=user_id, book_id=book_id, checkout_id=checkout_id, due_date=due_date,
+      returned_at=returned_at, updated_at=now,
+    )
+    overdue.fine = fine_for(overdue.days_overdue(None))
+    rows.append(overdue)
+  for batch in in_batches(rows, batch_size):
+    with transaction.atomic():
+      Overdue.objects.bulk_create(batch)
+  return len(rows)
+
+
+def accrued_fines(today):
+  """(open overdue loans, total fines they have accrued by `today`), grouped by due date in SQL."""
+  by_due_date = Counter(dict(
+    Overdue.objects.filter(returned_at__isnull=True).order_by()
+    .values('due_date').annotate(count=Count('id')).values_list('due_date', 'count')
+  ))
+  total = sum((fine_for((today - due_date).days) * count for due_date, count in by_due_date.items()), fine_for(0))
+  return sum(by_due_date.values()), total
+
+
+def process_overdue(today=None, batch_size=5000):
+  """
+  Bring the Overdue table up to date as of `today` and record the run. Each
+  step is idempotent, so an interrupted run is completed by the next one.
+  """
+  today = today or timezone.localdate()
+  started = time.perf_counter()
+  now = timezone.now()
+  previous = OverdueRun.objects.first()
+  watermark = previous.last_transaction_id if previous else 0
+  latest = Transaction.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+  created = record_new_overdues(today, now, batch_size)
+  settled = settle_returned(now, batch_size)
+  late = record_late_returns(watermark, latest, now, batch_size)
+  expired = expire_ready_holds(now)
+  OverdueRun.objects.create(
+    run_date=today, started_at=now, finished_at=timezone.now(), last_transaction_id=latest,
+    created=created + late, settled=settled + late,
+  )
+
+  open_count, fines = accrued_fines(today)
+  return {
+    'date': today.isoformat(),
+    'newly_overdue': created,
+    'settled_returns': settled,
+    'late_returns': late,
+    'expired_holds': expired,
+    'open': open_count,
+    'accrued_fines': str(fines),
+    'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+  }
@@ -0,0 +1,198 @@
+import base64
+import datetime
+import heapq
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+  """
+  Cursor pagination that seeks on the queryset ordering instead of using OFFSET.
+
+  The ordering is taken from the queryset (or the model's Meta.ordering) and is
+  made unique by appending the primary key, so `?cursor=` pages are stable and a
+  deep page costs the same indexed range scan as the first one. Cursors are
+  opaque base64 tokens holding the boundary row's ordering values; one that
+  does not decode to values of the ordering fields is a 400.
+  """
+  cursor_query_param = 'cursor'
+  page_size_query_param = 'page_size'
+  invalid_cursor_message = 'Invalid cursor'
+
+  def __init__(self):
+    self.page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE') or 50
+    self.max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+
+  def get_ordering(self, queryset):
+    ordering = [field for field in (queryset.query.order_by or queryset.model._meta.ordering)]
+    names = {field.lstrip('-') for field in ordering}
+    if not names & {'pk', 'id', queryset.model._meta.pk.name}:
+      descending = bool(ordering) and ordering[-1].startswith('-')
+      ordering.append('-pk' if descending else 'pk')
+    return ordering
+
+  def get_page_size(self, request):
+    try:
+      page_size = int(request.query_params[self.page_size_query_param])
+    except (KeyError, ValueError):
+      page_size = self.page_size
+    return max(1, min(page_size, self.max_page_size))
+
+  def decode_cursor(self, request):
+    encoded = request.query_params.get(self.cursor_query_param)
+    if not encoded:
+      return None, False
+    try:
+      data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+      position, reverse = data['p'], bool(data.get('r'))
+      if not isinstance(position, list) or len(position) != len(self.ordering):
+        raise ValueError
+    except (TypeError, ValueError, KeyError, UnicodeError):
+      raise ParseError(self.invalid_cursor_message)
+    return position, reverse
+
+  def encode_cursor(self, position, reverse):
+    data = json.dumps({'p': position, 'r': reverse}, cls=DjangoJSONEncoder, separators=(',', ':'))
+    encoded = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+    return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+  def seek(self, queryset, position, reverse):
+    # (a > x) OR (a = x AND b > y) OR ..., flipped for descending fields.
+    condition = Q()
+    for index, field in enumerate(self.ordering):
+      name = field.lstrip('-')
+      descending = field.startswith('-') != reverse
+      term = Q(**{f"{name}__{'lt' if descending else 'gt'}": position[index]})
+      for previous, value in zip(self.ordering[:index], position):
+        term &= Q(**{previous.lstrip('-'): value})
+      condition |= term
+    return queryset.filter(condition)
+
+  def get_position(self, obj):
+    position = []
+    for field in self.ordering:
+      name = field.lstrip('-')
+      value = obj.pk if name == 'pk' else getattr(obj, name)
+      if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+      position.append(value)
+    return position
+
+  def paginate_queryset(self, queryset, request, view=None):
+    return self.finish_page(list(self.page_queryset(queryset, request)))
+
+  async def apaginate_queryset(self, queryset, request, view=None):
+    return self.finish_page([obj async for obj in self.page_queryset(queryset, request)])
+
+  def page_queryset(self, queryset, request):
+    """The single sliced query for the requested page, plus one row to detect more."""
+    self.request = request
+    self.ordering = self.get_ordering(queryset)
+    self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+    self.page_size = self.get_page_size(request)
+    self.position, self.reverse = self.decode_cursor(request)
+
+    if self.reverse:
+      queryset = queryset.order_by(*[field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering])
+    else:
+      queryset = queryset.order_by(*self.ordering)
+    if self.position is not None:
+      try:
+        queryset = self.seek(queryset, self.position, self.reverse)
+      except (TypeError, ValueError, ValidationError):
+        # A well-formed cursor whose values do not fit the ordering fields.
+        raise ParseError(self.invalid_cursor_message)
+    return queryset[:self.page_size + 1]
+
+  def paginate_tiers(self, tiers, request, view=None):
+    """
+    One page merged from `tiers`, a list of (queryset, start) pairs with the
+    same ordering. A tier is only queried when the page reaches `start`, the
+    ordering value its rows all come after (None for always).
+    """
+    rows = []
+    for queryset, start in tiers:
+      if self.reaches(rows, start):
+        rows = self.merge(rows, list(self.page_queryset(queryset, request)))
+    return self.finish_page(rows)
+
+  async def apaginate_tiers(self, tiers, request, view=None):
+    rows = []
+    for queryset, start in tiers:
+      if self.reaches(rows, start):
+        rows = self.merge(rows, [obj async for obj in self.page_queryset(queryset, request)])
+    return self.finish_page(rows)
+
+  def reaches(self, rows, start):
+    if start is None or self.reverse or len(rows) <= self.page_size:
+      return True
+    # The row that decides `has_more` sorts before everything in the tier.
+    value = getattr(rows[self.page_size], self.ordering[0].lstrip('-'))
+    return value < start if self.ordering[0].startswith('-') else value > start
+
+  def merge(self, rows, more):
+    if not rows:
+      return more
+    directions = {field.startswith('-') for field in self.ordering}
+    if len(directions) != 1:
+      raise ValueError('Tiers can only be merged on an ordering with a single direction')
+    names = [field.lstrip('-') for field in self.ordering]
+
+    def key(obj):
+      return [obj.pk if name == 'pk' else getattr(obj, name) for name in names]
+    merged = []
+    # A row moved between tiers while they were read shows up in both, side by side.
+    for obj in heapq.merge(rows, more, key=key, reverse=directions.pop() != self.reverse):
+      if not merged or obj.pk != merged[-1].pk:
+        merged.append(obj)
+      if len(merged) > self.page_size:
+        break
+    return merged
+
+  def finish_page(self, results):
+    has_more = len(results) > self.page_size
+    results = results[:self.page_size]
+    if self.reverse:
+      results.reverse()
+      self.has_next, self.has_previous = self.position is not None, has_more
+    else:
+      self.has_next, self.has_previous = has_more, self.position is not None
+    self.page = results
+    return results
+
+  def get_next_link(self):
+    if not self.has_next or not self.page:
+      return None
+    return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+  def get_previous_link(self):
+    if not self.has_previous or not self.page:
+      return None
+    return self.encode_cursor(self.get_position(self.page[0]), True)
+
+  def get_paginated_response(self, data):
+    return Response(OrderedDict([
+      ('next', self.get_next_link()),
+      ('previous', self.get_previous_link()),
+      ('results', data),
+    ]))
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'required': ['results'],
+      'properties': {
+        'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'results': schema,
+      },
+    }
@@ -0,0 +1,213 @@
+"""
+"Also borrowed" index: for each book, the books most often borrowed by the
+same patrons, scored by how many patrons borrowed both.
+
+`rebuild_related` computes it from the CHECKOUT log in one streaming pass and
+keeps the `TOP_K` best pairs per book. Patrons who borrowed more than
+`MAX_BASKET` distinct books say little about any pair of them and are left
+out. users.circulation keeps it current in two steps. Inside the checkout
+transaction `count_checkouts` adds a point to the pairs already indexed, in
+one UPDATE. After commit `complete_checkouts` seeds the missing pairs with
+their count from the log, skipping those that cannot reach a full book's
+lowest kept score, trims the books back to TOP_K, and takes back the points
+of a patron whose basket grew past MAX_BASKET.
+
+Only a rebuild restores a pair pushed out of a book's list that would have
+moved back in when a patron's contribution was taken back, and a point lost
+when the process stops between the commit and the after-commit step.
+"""
+import heapq
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .cache import books_changed
+from .models import Book, RelatedBook, Transaction, TransactionSummary
+
+TOP_K = 20
+MAX_BASKET = 200
+
+
+def borrowed(*conditions, **filters):
+  """Distinct (user_id, book_id) checkouts across the hot log and the archived summaries."""
+  return (
+    Transaction.objects.filter(*conditions, transaction_type=Transaction.CHECKOUT, **filters)
+    .order_by().values_list('user_id', 'book_id')
+    .union(TransactionSummary.objects.filter(*conditions, checkouts__gt=0, **filters).order_by().values_list('user_id', 'book_id'))
+  )
+
+
+def co_borrowers(user_id, pairs, totals):
+  """
+  {(book_id, other): patrons other than `user_id` who borrowed both}, for the
+  unordered `pairs`. Patrons over MAX_BASKET are left out, as by the rebuild.
+  Only the readers of the less borrowed book of each pair, by `totals`, are
+  read from the log.
+  """
+  anchors = {min(pair, key=lambda book_id: totals.get(book_id, 0)) for pair in pairs}
+  readers = (
+    Q(user_id__in=Transaction.objects.filter(transaction_type=Transaction.CHECKOUT, book_id__in=anchors).values('user_id'))
+    | Q(user_id__in=TransactionSummary.objects.filter(checkouts__gt=0, book_id__in=anchors).values('user_id'))
+  )
+  books = defaultdict(set)
+  for reader, book_id in borrowed(readers, ~Q(user_id=user_id), book_id__in={book for pair in pairs for book in pair}):
+    books[reader].add(book_id)
+  counts = {pair: [reader for reader, seen in books.items() if pair[0] in seen and pair[1] in seen] for pair in pairs}
+  patrons = {reader for readers in counts.values() for reader in readers}
+  if not patrons:
+    return {pair: 0 for pair in pairs}
+  baskets = Counter(reader for reader, _ in borrowed(user_id__in=patrons))
+  return {pair: sum(1 for reader in readers if baskets[reader] <= MAX_BASKET) for pair, readers in counts.items()}
+
+
+def lowest_kept(book_ids):
+  """{book_id: score of its TOP_K-th pair} for the books whose list is full."""
+  return dict(
+    RelatedBook.objects.filter(book_id__in=book_ids)
+    .annotate(rank=Window(RowNumber(), partition_by=F('book_id'), order_by=[F('score').desc(), F('other_id').asc()]))
+    .filter(rank=TOP_K).values_list('book_id', 'score')
+  )
+
+
+def trim(book_ids):
+  """Drop the pairs of `book_ids` beyond their TOP_K best, in the order a rebuild keeps them."""
+  extra = list(
+    RelatedBook.objects.filter(book_id__in=book_ids)
+    .annotate(rank=Window(RowNumber(), partition_by=F('book_id'), order_by=[F('score').desc(), F('other_id').asc()]))
+    .filter(rank__gt=TOP_K).values_list('id', flat=True)
+  )
+  if extra:
+    RelatedBook.objects.filter(pk__in=extra).delete()
+
+
+def count_checkouts(user, book_ids):
+  """
+  Add a point to every indexed pair that `user` completes by borrowing
+  `book_ids`, in one UPDATE run inside the checkout transaction before the
+  CHECKOUT rows are inserted. A pair counts when one of its books is new to
+  the patron and the other is in their basket, and only while the basket,
+  with the new books, stays within MAX_BASKET. Everything else is left to
+  `complete_checkouts`.
+  """
+  book_ids = list(dict.fromkeys(book_ids))
+  hot = Transaction.objects.filter(user_id=user.pk, transaction_type=Transaction.CHECKOUT).values('book_id')
+  archived = TransactionSummary.objects.filter(user_id=user.pk, checkouts__gt=0).values('book_id')
+
+  def new(column):
+    return Q(**{f'{column}__in': book_ids}) & ~Q(**{f'{column}__in': hot}) & ~Q(**{f'{column}__in': archived})
+
+  def basket(column):
+    return Q(**{f'{column}__in': book_ids}) | Q(**{f'{column}__in': hot}) | Q(**{f'{column}__in': archived})
+
+  placeholders = ', '.join(['%s'] * len(book_ids))
+  within_basket = (
+    f'(SELECT COUNT(*) FROM (SELECT book_id FROM {Transaction._meta.db_table} WHERE user_id = %s AND transaction_type = %s'
+    f' UNION SELECT book_id FROM {TransactionSummary._meta.db_table} WHERE user_id = %s AND checkouts > 0)'
+    f' WHERE book_id NOT IN ({placeholders})) <= %s'
+  )
+  RelatedBook.objects.filter(new('book_id') & basket('other_id') | new('other_id') & basket('book_id')).exclude(
+    book_id=F('other_id')
+  ).extra(
+    where=[within_basket], params=[user.pk, Transaction.CHECKOUT, user.pk, *book_ids, MAX_BASKET - len(book_ids)]
+  ).update(score=F('score') + 1)
+
+
+def complete_checkouts(user_id, book_ids, checkout_ids):
+  """
+  The after-commit half of the upkeep for the CHECKOUT rows `checkout_ids` of
+  `book_ids`: seed the pairs `count_checkouts` found missing, then trim the
+  books that gained pairs back to TOP_K. A missing pair is only counted when
+  its books' checkout totals could reach the lowest score a full list keeps.
+  """
+  hot = (
+    Transaction.objects.filter(user_id=user_id, transaction_type=Transaction.CHECKOUT).exclude(pk__in=checkout_ids)
+    .order_by().values_list('book_id', flat=True)
+  )
+  archived = TransactionSummary.objects.filter(user_id=user_id, checkouts__gt=0).order_by().values_list('book_id', flat=True)
+  history = set(hot.union(archived))
+  new = [book_id for book_id in dict.fromkeys(book_ids) if book_id not in history]
+  basket = [*history, *new]
+  if not new or len(basket) < 2:
+    return
+  if len(basket) > MAX_BASKET:
+    if 2 <= len(history) <= MAX_BASKET:
+      # The patron no longer counts; take back what their history added.
+      with transaction.atomic():
+        pairs = RelatedBook.objects.filter(book_id__in=history, other_id__in=history).exclude(book_id=F('other_id'))
+        pairs.update(score=F('score') - 1)
+        RelatedBook.objects.filter(book_id__in=history, score__lte=0).delete()
+    return
+
+  wanted = {(book_id, other) for book_id in new for other in basket if other != book_id}
+  wanted |= {(other, book_id) for book_id, other in wanted}
+  present = set(
+    RelatedBook.objects.filter(Q(book_id__in=new, other_id__in=basket) | Q(book_id__in=history, other_id__in=new))
+    .values_list('book_id', 'other_id')
+  )
+  missing = wanted - present
+  if not missing:
+    return
+  # Patrons who borrowed both are at most the checkouts of either book.
+  totals = dict(Book.objects.filter(pk__in={book for pair in missing for book in pair}).values_list('pk', 'total_checkouts'))
+  floor = lowest_kept({book_id for book_id, _ in missing})
+  missing = {(a, b) for a, b in missing if min(totals.get(a, 0), totals.get(b, 0)) >= floor.get(a, 0)}
+  if not missing:
+    return
+  counts = co_borrowers(user_id, {tuple(sorted(pair)) for pair in missing}, totals)
+  with transaction.atomic():
+    # Another checkout may have seeded a pair since it was found missing; its count included this one.
+    RelatedBook.objects.bulk_create([
+      RelatedBook(book_id=a, other_id=b, score=counts[tuple(sorted((a, b)))] + 1)
+      for a, b in missing
+    ], ignore_conflicts=True)
+    trim({book_id for book_id, _ in missing})
+
+
+def count_pairs(chunk_size=20000):
+  """
+  {book_id: Counter({other: patrons})} from the CHECKOUT log and the archived
+  checkout summaries, read in `chunk_size` rows at a time.
+  """
+  counts = defaultdict(Counter)
+  hot = (
+    Transaction.objects.filter(transaction_type=Transaction.CHECKOUT).order_by('user_id')
+    .values_list('user_id', 'book_id').iterator(chunk_size=chunk_size)
+  )
+  archived = (
+    TransactionSummary.objects.filter(checkouts__gt=0).order_by('user_id')
+    .values_list('user_id', 'book_id').iterator(chunk_size=chunk_size)
+  )
+  rows = heapq.merge(hot, archived, key=itemgetter(0))
+  for _, group in groupby(rows, key=itemgetter(0)):
+    basket = {book_id for _, book_id in group}
+    if not 2 <= len(basket) <= MAX_BASKET:
+      continue
+    for book_id in basket:
+      # Counter.update counts in C; the book's count of itself is dropped later.
+      counts[book_id].update(basket)
+  return counts
+
+
+def top_pairs(counts, top_k):
+  for book_id, others in counts.items():
+    best = heapq.nsmallest(top_k, ((-score, other) for other, score in others.items() if other != book_id))
+    for score, other in best:
+      yield RelatedBook(book_id=book_id, other_id=other, score=-score)
+
+
+def rebuild_related(chunk_size=20000, top_k=TOP_K):
+  """
+  Recompute the index from the transaction log and replace it in one
+  transaction. Checkouts made while the log is being read are picked up by
+  the next rebuild. Returns {'books', 'pairs'} written.
+  """
+  counts = count_pairs(chunk_size)
+  with transaction.atomic():
+    RelatedBook.objects.all().delete()
+    pairs = RelatedBook.objects.bulk_create(top_pairs(counts, top_k), batch_size=chunk_size)
+    books_changed()
+  return {'books': sum(1 for others in counts.values() if len(others) > 1), 'pairs': len(pairs)}
@@ -0,0 +1,39 @@
+"""
+An orjson-backed drop-in for DRF's JSONRenderer.
+
+Enable it by listing `users.renderers.ORJSONRenderer` in
+REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] in place of JSONRenderer. It writes
+the same bytes as JSONRenderer's default compact UTF-8 output: dates, times,
+decimals and other non-JSON types still go through DRF's encoder, and
+U+2028/U+2029 are escaped the same way. It falls back to JSONRenderer when
+orjson is not installed, for indented or ASCII-only output, and for values
+orjson rejects (integers wider than 64 bits). Floats are written in their
+shortest round-trip form, which spells exponents differently from `repr()`
+(`1e16` rather than `1e+16`).
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+  encoder = JSONEncoder()
+
+  def render(self, data, accepted_media_type=None, renderer_context=None):
+    if (
+      orjson is None or data is None or self.ensure_ascii or not self.compact
+      or self.get_indent(accepted_media_type or '', renderer_context or {})
+    ):
+      return super().render(data, accepted_media_type, renderer_context)
+    try:
+      content = orjson.dumps(
+        data, default=self.encoder.default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS,
+      )
+    except orjson.JSONEncodeError:
+      return super().render(data, accepted_media_type, renderer_context)
+    return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,121 @@
+"""
+Read-only serialization straight from `.values_list()` rows.
+
+DRF's ModelSerializer builds a model instance per row and calls every field's
+`get_attribute` and `to_representation` on it. `RowSerializer` inspects the
+serializer once instead, maps each readable field to a database column and a
+precompiled converter, and builds the output dicts from plain row tuples.
+The output is the same as the serializer's, key for key and value for value.
+Serializers with a field it cannot map (a SerializerMethodField, a nested
+serializer, a property) are refused with `Unsupported`.
+"""
+from datetime import timezone
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import ISO_8601, fields, relations
+from rest_framework.settings import api_settings
+
+
+class Unsupported(TypeError):
+  """A serializer field that is not a plain column."""
+
+
+# Fields whose to_representation returns the database value unchanged.
+PASSTHROUGH = (fields.IntegerField, fields.CharField, fields.EmailField, fields.BooleanField, fields.ChoiceField)
+
+
+def datetime_converter(field):
+  output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+  if output_format is None or output_format.lower() != ISO_8601:
+    return field.to_representation
+  zone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+  if zone is None:
+    return field.to_representation
+  # The database returns UTC datetimes; converting them to a UTC zone is a no-op.
+  to_utc = zone is timezone.utc or getattr(zone, 'key', None) in ('UTC', 'Etc/UTC')
+
+  def convert(value):
+    if value.tzinfo is None:
+      return field.to_representation(value)
+    if not (to_utc and value.tzinfo is timezone.utc):
+      value = value.astimezone(zone)
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+  return convert
+
+
+def date_converter(field):
+  output_format = getattr(field, 'format', api_settings.DATE_FORMAT)
+  if output_format is None or output_format.lower() != ISO_8601:
+    return field.to_representation
+  return lambda value: value.isoformat()
+
+
+def column_for(model, field):
+  """The `values_list()` path behind `field`; only non-null relations may be followed."""
+  if isinstance(field, fields.SerializerMethodField) or not field.source_attrs or field.source == '*':
+    raise Unsupported(field.field_name)
+  for position, name in enumerate(field.source_attrs):
+    try:
+      model_field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+      raise Unsupported(field.field_name)
+    if position < len(field.source_attrs) - 1:
+      if not model_field.many_to_one and not model_field.one_to_one or model_field.null:
+        raise Unsupported(field.field_name)
+      model = model_field.related_model
+    elif model_field.is_relation and not isinstance(field, relations.PrimaryKeyRelatedField):
+      raise Unsupported(field.field_name)
+  return '__'.join(field.source_attrs)
+
+
+def converter_for(field):
+  if isinstance(field, relations.PrimaryKeyRelatedField):
+    if field.pk_field is not None:
+      raise Unsupported(field.field_name)
+    return None
+  if type(field) in PASSTHROUGH:
+    return None
+  if isinstance(field, fields.DateTimeField):
+    return datetime_converter(field)
+  if isinstance(field, fields.DateField):
+    return date_converter(field)
+  if isinstance(field, fields.Field) and not isinstance(field, (fields.ListField, fields.DictField, relations.RelatedField)):
+    return field.to_representation
+  raise Unsupported(field.field_name)
+
+
+class RowSerializer:
+  """
+  `serializer_class(fields=...)` rendered from row tuples.
+
+  Use `rows(queryset, *extra)` to fetch the columns (plus the ordering and any
+  `extra` columns, readable as attributes for the keyset paginator) and
+  `serialize(rows)` to turn them into the serializer's output.
+  """
+
+  def __init__(self, serializer_class, fields=None):
+    serializer = serializer_class(fields=fields) if fields is not None else serializer_class()
+    model = serializer.Meta.model
+    self.columns, self.output = [], []
+    for field in serializer._readable_fields:
+      column = column_for(model, field)
+      if column not in self.columns:
+        self.columns.append(column)
+      self.output.append((field.field_name, self.columns.index(column), converter_for(field)))
+
+  def rows(self, queryset, *extra):
+    ordering = [name.lstrip('-') for name in queryset.query.order_by or queryset.model._meta.ordering]
+    columns = list(dict.fromkeys([*self.columns, *ordering, 'pk', *extra]))
+    return queryset.values_list(*columns, named=True)
+
+  def serialize(self, rows):
+    output = self.output
+    results = []
+    for row in rows:
+      item = {}
+      for name, index, convert in output:
+        value = row[index]
+        item[name] = value if convert is None or value is None else convert(value)
+      results.append(item)
+    return results
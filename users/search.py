@@ -0,0 +1,108 @@
+import re
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Book
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class LikeSearchBackend:
+  """
+  The original `icontains` scan; needs no index but reads the whole table.
+  Also the base for indexed backends, which override the sync hooks that
+  `Book` signals call: `update`, `update_many`, `remove` and `rebuild`.
+  """
+
+  def search(self, queryset, query):
+    return queryset.filter(
+      models.Q(title__icontains=query) |
+      models.Q(author__icontains=query) |
+      models.Q(isbn__icontains=query)
+    )
+
+  def update(self, book):
+    pass
+
+  def update_many(self, books):
+    for book in books:
+      self.update(book)
+
+  def remove(self, pk):
+    pass
+
+  def rebuild(self, batch_size=2000):
+    return 0
+
+
+class SQLiteFTSBackend(LikeSearchBackend):
+  """
+  Searches an FTS5 shadow table whose rowid is the book id. Every word of the
+  query must match as a prefix of a title, author or ISBN token, and results
+  are ordered by bm25 relevance (`search_rank`, lower is better).
+  """
+  table = 'users_book_fts'
+
+  def match_expression(self, query):
+    tokens = TOKEN_RE.findall(query.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+  def search(self, queryset, query):
+    expression = self.match_expression(query)
+    if not expression:
+      return queryset.none()
+    return queryset.extra(
+      tables=[self.table],
+      where=[f'{self.table}.rowid = {Book._meta.db_table}.id', f'{self.table} MATCH %s'],
+      params=[expression],
+    ).annotate(search_rank=RawSQL(f'{self.table}.rank', ())).order_by('search_rank', 'id')
+
+  def update(self, book):
+    with connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [book.pk])
+      cursor.execute(
+        f'INSERT INTO {self.table} (rowid, title, author, isbn) VALUES (%s, %s, %s, %s)',
+        [book.pk, book.title, book.author, book.isbn]
+      )
+
+  def update_many(self, books):
+    rows = [(book.pk, book.title, book.author, book.isbn) for book in books]
+    with connection.cursor() as cursor:
+      for start in range(0, len(rows), 500):
+        chunk = rows[start:start + 500]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', [row[0] for row in chunk])
+      self._insert(cursor, rows)
+
+  def remove(self, pk):
+    with connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [pk])
+
+  def rebuild(self, batch_size=2000):
+    count = 0
+    rows = Book.objects.order_by().values_list('id', 'title', 'author', 'isbn')
+    with transaction.atomic(), connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {self.table}')
+      batch = []
+      for row in rows.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+          count += self._insert(cursor, batch)
+          batch = []
+      count += self._insert(cursor, batch)
+      cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+    return count
+
+  def _insert(self, cursor, rows):
+    if rows:
+      cursor.executemany(
+        f'INSERT INTO {self.table} (rowid, title, author, isbn) VALUES (%s, %s, %s, %s)', rows
+      )
+    return len(rows)
+
+
+def get_search_backend(path=None):
+  return import_string(path or getattr(settings, 'BOOK_SEARCH_BACKEND', 'users.search.SQLiteFTSBackend'))()
@@ -1,11 +1,26 @@
+from django.utils import timezone
 from rest_framework import serializers
-from .models import User, Transaction, Book
+from .isbn import to_isbn13
+from .models import User, Transaction, Book, Loan, Hold, Overdue, RelatedBook
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+  """Takes `fields=[...]` to serialize only those of Meta.fields (see users.sparse)."""
+
+  def __init__(self, *args, fields=None, **kwargs):
+    super().__init__(*args, **kwargs)
+    if fields is not None:
+      for name in set(self.fields) - set(fields):
+        self.fields.pop(name)
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
   class Meta:
     model = User
-    fields = ['id', 'username', 'email', 'password', 'date_of_membership', 'is_active']
-    read_only_fields = ['date_of_membership']
+    fields = [
+      'id', 'username', 'email', 'password', 'date_of_membership', 'is_active',
+      'active_loans', 'total_checkouts', 'last_activity_at',
+    ]
+    read_only_fields = ['date_of_membership', 'active_loans', 'total_checkouts', 'last_activity_at']
 
   def create(self, validated_data):
     password = validated_data.pop('password', None)
@@ -16,11 +31,26 @@ class UserSerializer(serializers.ModelSerializer):
     return instance
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
   class Meta:
     model = Book
-    fields = ['id', 'title', 'author', 'isbn', 'published_date', 'copies_available', 'created_at', 'updated_at']
-    read_only_fields = ['created_at', 'updated_at']
+    fields = [
+      'id', 'title', 'author', 'isbn', 'isbn13', 'published_date', 'copies_available', 'created_at', 'updated_at',
+      'active_loans', 'total_checkouts', 'last_activity_at',
+    ]
+    read_only_fields = ['isbn13', 'created_at', 'updated_at', 'active_loans', 'total_checkouts', 'last_activity_at']
+
+  def validate_isbn(self, value):
+    # The same book written as ISBN-10 and ISBN-13 must not be added twice.
+    isbn13 = to_isbn13(value)
+    if isbn13 is None:
+      raise serializers.ValidationError('Invalid ISBN number')
+    duplicates = Book.objects.filter(isbn13=isbn13)
+    if self.instance is not None:
+      duplicates = duplicates.exclude(pk=self.instance.pk)
+    if duplicates.exists():
+      raise serializers.ValidationError('book with this isbn already exists.')
+    return value
 
 class TransactionSerializer(serializers.ModelSerializer):
   username = serializers.CharField(source='user.username', read_only=True)
@@ -28,4 +58,57 @@ class TransactionSerializer(serializers.ModelSerializer):
   class Meta:
     model = Transaction
     fields = ['id', 'user', 'username', 'transaction_type', 'transaction_date', 'due_date']
-    read_only_fields = ['transaction_date']
\ No newline at end of file
+    read_only_fields = ['transaction_date']
+
+
+class LoanSerializer(serializers.ModelSerializer):
+  book_title = serializers.CharField(source='book.title', read_only=True)
+
+  class Meta:
+    model = Loan
+    fields = ['id', 'user', 'book', 'book_title', 'checked_out_at', 'due_date']
+    read_only_fields = fields
+
+class RelatedBookSerializer(serializers.ModelSerializer):
+  book = serializers.PrimaryKeyRelatedField(source='other', read_only=True)
+  title = serializers.CharField(source='other.title', read_only=True)
+  author = serializers.CharField(source='other.author', read_only=True)
+
+  class Meta:
+    model = RelatedBook
+    fields = ['book', 'title', 'author', 'score']
+    read_only_fields = fields
+
+
+class HoldSerializer(serializers.ModelSerializer):
+  """Expects `position` annotated by users.circulation.holds_with_position."""
+  book_title = serializers.CharField(source='book.title', read_only=True)
+  position = serializers.IntegerField(read_only=True, allow_null=True)
+
+  class Meta:
+    model = Hold
+    fields = ['id', 'user', 'book', 'book_title', 'status', 'position', 'created_at', 'ready_at']
+    read_only_fields = fields
+
+class OverdueSerializer(serializers.ModelSerializer):
+  """Open overdues report the fine accrued so far; returned ones the settled fine."""
+  username = serializers.CharField(source='user.username', read_only=True)
+  book_title = serializers.CharField(source='book.title', read_only=True)
+  days_overdue = serializers.SerializerMethodField()
+  fine = serializers.SerializerMethodField()
+
+  class Meta:
+    model = Overdue
+    fields = ['id', 'user', 'username', 'book', 'book_title', 'due_date', 'returned_at', 'days_overdue', 'fine']
+    read_only_fields = fields
+
+  def get_today(self):
+    if 'today' not in self.context:
+      self.context['today'] = timezone.localdate()
+    return self.context['today']
+
+  def get_days_overdue(self, obj):
+    return obj.days_overdue(self.get_today())
+
+  def get_fine(self, obj):
+    return str(obj.fine_on(self.get_today()))
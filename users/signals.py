@@ -0,0 +1,61 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .authentication import forget_user, user_cache
+from .cache import books_changed
+from .facets import FACET_FIELDS, book_facet_keys, books_replaced
+from .models import Book, User
+from .search import get_search_backend
+
+SEARCH_FIELDS = {'title', 'author', 'isbn'}
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, update_fields=None, **kwargs):
+  if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+    return
+  get_search_backend().update(instance)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+  get_search_backend().remove(instance.pk)
+
+
+@receiver(pre_save, sender=Book)
+def remember_facets(sender, instance, update_fields=None, **kwargs):
+  # None when the save cannot change any facet.
+  instance._stored_facets = None
+  if update_fields is None or set(FACET_FIELDS).intersection(update_fields):
+    stored = Book.objects.filter(pk=instance.pk).values_list(*FACET_FIELDS).first() if instance.pk is not None else None
+    instance._stored_facets = [book_facet_keys(*stored)] if stored is not None else []
+
+
+@receiver(post_save, sender=Book)
+def count_facets(sender, instance, **kwargs):
+  if instance._stored_facets is not None:
+    books_replaced(instance._stored_facets, [book_facet_keys(instance.author, instance.published_date, instance.copies_available)])
+
+
+@receiver(post_delete, sender=Book)
+def uncount_facets(sender, instance, **kwargs):
+  books_replaced([book_facet_keys(instance.author, instance.published_date, instance.copies_available)], [])
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_cache(sender, instance, **kwargs):
+  books_changed([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def refresh_cached_user(sender, instance, **kwargs):
+  if instance.is_active:
+    user_cache.delete(instance.pk)
+  else:
+    forget_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+  forget_user(instance.pk)
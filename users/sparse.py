@@ -0,0 +1,40 @@
+"""`?fields=` sparse fieldsets and `?ids=` multi-get for the list endpoints."""
+from django.conf import settings
+
+
+class QueryParamError(ValueError):
+  """An unusable `?fields=` or `?ids=` value; the views answer it with a 400."""
+
+
+def requested_fields(params, serializer_class):
+  """The fields named in `?fields=`, in serializer order, or None for all of them."""
+  value = params.get('fields')
+  if not value:
+    return None
+  names = {name.strip() for name in value.split(',') if name.strip()}
+  available = serializer_class.Meta.fields
+  unknown = sorted(names - set(available))
+  if unknown:
+    raise QueryParamError(f'Unknown fields: {", ".join(unknown)}. Choose from {", ".join(available)}.')
+  return [name for name in available if name in names]
+
+
+def requested_ids(params):
+  """The primary keys listed in `?ids=1,2,3`, or None when absent."""
+  value = params.get('ids')
+  if value is None:
+    return None
+  try:
+    ids = [int(part) for part in value.split(',') if part.strip()]
+  except ValueError:
+    raise QueryParamError('ids must be a comma-separated list of integers.')
+  limit = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+  if len(ids) > limit:
+    raise QueryParamError(f'At most {limit} ids can be requested at once.')
+  return ids
+
+
+def filter_ids(queryset, params):
+  ids = requested_ids(params)
+  return queryset if ids is None else queryset.filter(pk__in=ids)
+
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(AssertionError):
+  pass
+
+
+@contextmanager
+def query_budget(max_queries, using=DEFAULT_DB_ALIAS, label=None):
+  """
+  Fail if the block runs more than `max_queries` queries on `using`.
+
+  Unlike `assertNumQueries`, the budget is an upper bound, so an endpoint can
+  get cheaper without breaking its test but an N+1 regression cannot slip in.
+  """
+  with CaptureQueriesContext(connections[using]) as context:
+    yield context
+  executed = len(context.captured_queries)
+  if executed > max_queries:
+    statements = '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1))
+    raise QueryBudgetExceeded(
+      f"{label or 'Block'} ran {executed} queries, over its budget of {max_queries}:\n{statements}"
+    )
+
+
+class QueryBudgetMixin:
+  """TestCase mixin for asserting per-endpoint query budgets."""
+
+  def assertQueryBudget(self, max_queries, func=None, *args, using=DEFAULT_DB_ALIAS, label=None, **kwargs):
+    if func is None:
+      return query_budget(max_queries, using=using, label=label)
+    with query_budget(max_queries, using=using, label=label):
+      return func(*args, **kwargs)
+
+  def assertEndpointBudget(self, max_queries, method, url, status=200, **kwargs):
+    with query_budget(max_queries, label=f'{method.upper()} {url}'):
+      response = getattr(self.client, method)(url, **kwargs)
+      if hasattr(response, 'streaming_content'):
+        b''.join(response.streaming_content)
+    self.assertEqual(response.status_code, status, f'{method.upper()} {url}')
+    return response
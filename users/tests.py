@@ -1,3 +1,1329 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.contrib.auth.hashers import check_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from .archive import archive_transactions
+from .authentication import encode_token
+from .cache import VERSION_KEY, catalog_version
+from .circulation import (
+  CirculationError, cancel_hold, checkout_book, checkout_books, expire_ready_holds, place_hold, return_book,
+  return_books,
+)
+from .counters import repair_counters
+from .db import READ_ALIAS, ReadReplicaRouter, read_replica
+from .exports import export_rows
+from .facets import rebuild_facets
+from .hashing import PasswordHasherPool
+from .imports import ISBN_CONFLICT, import_books, import_users
+from .metrics import registry
+from .models import (
+  ArchivedTransaction, Book, BookFacet, Hold, Loan, Overdue, RelatedBook, Transaction, TransactionSummary, User,
+)
+from .overdue import process_overdue
+from .related import rebuild_related
+from .renderers import ORJSONRenderer
+from .rows import RowSerializer, Unsupported
+from .search import LikeSearchBackend, SQLiteFTSBackend
+from .serializers import BookSerializer, OverdueSerializer, TransactionSerializer, UserSerializer
+from .testing import QueryBudgetMixin
+
+
+class CirculationTests(TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='patron')
+    self.book = Book.objects.create(
+      title='Dune', author='Frank Herbert', isbn='9780441172719',
+      published_date=date(1965, 8, 1), copies_available=1
+    )
+
+  def test_loan_follows_checkout_and_return(self):
+    checkout_book(self.user, self.book.pk)
+    with self.assertRaisesMessage(CirculationError, 'already have this book'):
+      checkout_book(self.user, self.book.pk)
+    self.assertTrue(Loan.objects.filter(user=self.user, book=self.book).exists())
+
+    return_book(self.user, self.book.pk)
+    with self.assertRaisesMessage(CirculationError, 'not checked out'):
+      return_book(self.user, self.book.pk)
+    self.assertFalse(Loan.objects.exists())
+
+  def test_book_can_be_borrowed_again_after_return(self):
+    checkout_book(self.user, self.book.pk)
+    return_book(self.user, self.book.pk)
+    checkout_book(self.user, self.book.pk)
+
+    self.book.refresh_from_db()
+    self.assertEqual(self.book.copies_available, 0)
+    self.assertEqual(Transaction.objects.filter(user=self.user).count(), 3)
+
+  def test_book_detail_cache_revalidates_after_checkout(self):
+    first = self.client.get(f'/api/books/{self.book.pk}')
+    self.assertEqual(self.client.get(f'/api/books/{self.book.pk}', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    checkout_book(self.user, self.book.pk)
+    response = self.client.get(f'/api/books/{self.book.pk}', HTTP_IF_NONE_MATCH=first['ETag'])
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()['copies_available'], 0)
+
+  def test_book_list_does_not_revalidate_on_if_modified_since(self):
+    other = Book.objects.create(
+      title='Emma', author='Jane Austen', isbn='9780141439587',
+      published_date=date(1815, 12, 23), copies_available=1
+    )
+    first = self.client.get('/api/books')
+    self.assertNotIn('Last-Modified', first)
+    since = http_date(timezone.now().timestamp() + 60)
+
+    other.delete()
+    response = self.client.get('/api/books', HTTP_IF_MODIFIED_SINCE=since)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual([book['title'] for book in response.json()['results']], ['Dune'])
+
+    self.book.copies_available = 0
+    self.book.save()
+    response = self.client.get('/api/books', HTTP_IF_MODIFIED_SINCE=since)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()['results'][0]['copies_available'], 0)
+
+  def test_active_loans_listing(self):
+    checkout_book(self.user, self.book.pk)
+    response = self.client.get(f'/api/users/{self.user.pk}/loans')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual([loan['book_title'] for loan in response.json()['results']], ['Dune'])
+
+
+class JWTAuthenticationTests(TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='reader', email='reader@example.com', is_active=True)
+    self.user.set_password('correct horse')
+    self.user.save()
+    self.book = Book.objects.create(
+      title='Dune', author='Frank Herbert', isbn='9780441172719',
+      published_date=date(1965, 8, 1), copies_available=1
+    )
+
+  def login(self):
+    response = self.client.post('/api/login', {'email': 'reader@example.com', 'password': 'correct horse'})
+    self.assertEqual(response.status_code, 200)
+    return response.json()['jwt']
+
+  def test_bearer_token_authenticates_checkout(self):
+    token = self.login()
+    response = self.client.post(f'/api/books/{self.book.pk}/checkout', HTTP_AUTHORIZATION=f'Bearer {token}')
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(Loan.objects.filter(user=self.user, book=self.book).exists())
+
+  def test_deactivated_user_is_rejected_despite_cached_token(self):
+    token = self.login()
+    self.client.get('/api/books', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    response = self.client.put(
+      f'/api/users/{self.user.pk}',
+      {'username': 'reader', 'email': 'reader@example.com', 'password': 'x', 'is_active': False},
+      content_type='application/json'
+    )
+    self.assertEqual(response.status_code, 200)
+    response = self.client.get('/api/books', HTTP_AUTHORIZATION=f'Bearer {token}')
+    self.assertEqual(response.status_code, 401)
+
+  def test_invalid_token_is_rejected(self):
+    response = self.client.get('/api/books', HTTP_AUTHORIZATION='Bearer not-a-token')
+    self.assertEqual(response.status_code, 401)
+
+
+class AsyncReadTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create(username='reader', email='reader@example.com')
+    self.book = Book.objects.create(
+      title='Dune', author='Frank Herbert', isbn='9780441172719', published_date=date(1965, 8, 1), copies_available=1
+    )
+    checkout_book(self.user, self.book.pk)
+
+  def test_async_reads_match_the_sync_views(self):
+    urls = [
+      '/api/books?page_size=1', f'/api/books/{self.book.pk}', f'/api/users/{self.user.pk}',
+      f'/api/users/{self.user.pk}/borrowing-history', '/api/books/999', '/api/books?cursor=bad',
+    ]
+    token = encode_token(self.user, timedelta(minutes=5))
+    client = AsyncClient()
+    for url in urls:
+      for authorization in [None, f'Bearer {token}', 'Bearer not-a-token']:
+        headers = {'authorization': authorization} if authorization else {}
+        with self.subTest(url=url, authorization=authorization):
+          sync = self.client.get(url, headers=headers)
+          with override_settings(ROOT_URLCONF='users.benchmarks.asgi'):
+            response = async_to_sync(client.get)(url, headers=headers)
+          self.assertEqual((response.status_code, response.content), (sync.status_code, sync.content))
+          self.assertEqual(response.get('WWW-Authenticate'), sync.get('WWW-Authenticate'))
+    self.assertEqual(sync.status_code, 401)
+
+
+class RecordingRouter(ReadReplicaRouter):
+  """Record the alias ReadReplicaRouter picks, but leave the query on the test database."""
+
+  def __init__(self):
+    self.routed = []
+
+  def db_for_read(self, model, **hints):
+    self.routed.append(('read', model.__name__, super().db_for_read(model, **hints)))
+
+  def db_for_write(self, model, **hints):
+    self.routed.append(('write', model.__name__, super().db_for_write(model, **hints)))
+
+
+class ReadReplicaTests(TestCase):
+  def setUp(self):
+    self.router = ReadReplicaRouter()
+    self.user = User.objects.create(username='reader', email='reader@example.com')
+
+  def routed(self, func):
+    return read_replica(func)()
+
+  def test_reads_go_to_the_replica_only_inside_read_replica(self):
+    with mock.patch.dict(settings.DATABASES, {READ_ALIAS: settings.DATABASES['default']}):
+      self.assertEqual(self.router.db_for_read(User), 'default')
+      self.assertEqual(self.routed(lambda: self.router.db_for_read(User)), READ_ALIAS)
+      self.assertEqual(self.router.db_for_read(User), 'default')
+      self.assertEqual(self.router.db_for_write(User), 'default')
+      self.assertEqual(self.routed(lambda: self.router.db_for_write(User)), 'default')
+
+      async def read():
+        return self.router.db_for_read(User)
+      self.assertEqual(async_to_sync(read_replica(read))(), READ_ALIAS)
+      self.assertEqual(async_to_sync(read)(), 'default')
+
+  def test_reads_stay_on_the_primary_without_a_replica(self):
+    self.assertNotIn(READ_ALIAS, settings.DATABASES)
+    self.assertEqual(self.routed(lambda: self.router.db_for_read(User)), 'default')
+
+  def test_read_views_are_routed_and_writes_are_not(self):
+    router = RecordingRouter()
+    url = f'/api/users/{self.user.pk}'
+    with mock.patch.dict(settings.DATABASES, {READ_ALIAS: settings.DATABASES['default']}), \
+         override_settings(DATABASE_ROUTERS=[router]):
+      self.assertEqual(self.client.get(url).status_code, 200)
+      self.assertIn(('read', 'User', READ_ALIAS), router.routed)
+
+      router.routed.clear()
+      body = {'username': 'renamed', 'email': 'reader@example.com', 'password': 'correct horse'}
+      response = self.client.put(url, body, content_type='application/json')
+      self.assertEqual(response.status_code, 200)
+      self.assertIn(('write', 'User', 'default'), router.routed)
+      self.assertEqual({alias for _, _, alias in router.routed}, {'default'})
+
+  def production_connection(self, alias, path):
+    from libraryproject.settings_production import DATABASES
+
+    wrapper = DatabaseWrapper({**connection.settings_dict, **DATABASES[alias], 'NAME': path}, alias=alias)
+    self.addCleanup(wrapper.close)
+    wrapper.ensure_connection()
+    return wrapper
+
+  def test_production_connections_apply_pragmas_and_lock_at_begin(self):
+    path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'db.sqlite3')
+    primary = self.production_connection('default', path)
+    with primary.cursor() as cursor:
+      self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+      self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone(), (5000,))
+      self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone(), (1,))
+      cursor.execute('CREATE TABLE t (id integer)')
+
+    replica = self.production_connection('replica', path)
+    with replica.cursor() as cursor:
+      self.assertEqual(cursor.execute('PRAGMA query_only').fetchone(), (1,))
+      with self.assertRaisesMessage(OperationalError, 'readonly'):
+        cursor.execute('INSERT INTO t VALUES (1)')
+
+    # IMMEDIATE: BEGIN alone takes the write lock, before any write is made.
+    primary.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+    other = sqlite3.connect(path, timeout=0)
+    self.addCleanup(other.close)
+    with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+      other.execute('BEGIN IMMEDIATE')
+    primary.rollback()
+    primary.set_autocommit(True)
+
+
+class BookImportTests(TestCase):
+  def test_jsonl_import_upserts_on_isbn_and_reports_bad_rows(self):
+    stream = io.StringIO(
+      '{"title": "Dune", "author": "Frank Herbert", "isbn": "978-0-441-17271-9", "published_date": "1965-08-01", "copies_available": 3}\n'
+      'not json\n'
+      '{"title": "Fluent Python", "author": "Luciano Ramalho", "isbn": "9781491946008", "published_date": "2015-07-30", "copies_available": 1}\n'
+      '{"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "published_date": "1965-08-01", "copies_available": 4}\n'
+    )
+    report = import_books(stream, 'jsonl', batch_size=2)
+
+    self.assertEqual(report['failed'], 1)
+    self.assertEqual(report['errors'][0]['line'], 2)
+    self.assertEqual(Book.objects.get(isbn='9780441172719').copies_available, 4)
+    self.assertEqual(Book.objects.count(), 2)
+
+  def test_conflict_with_a_legacy_row_is_a_row_error(self):
+    legacy = Book.objects.create(
+      title='Dune', author='Frank Herbert', isbn='9780441172719', published_date=date(1965, 8, 1), copies_available=1
+    )
+    # Rows the 0007 backfill could not claim an isbn13 for.
+    Book.objects.filter(pk=legacy.pk).update(isbn13=None)
+    stream = io.StringIO(
+      'title,author,isbn,published_date,copies_available\n'
+      'Dune,Frank Herbert,978-0-441-17271-9,1965-08-01,5\n'
+      'Fluent Python,Luciano Ramalho,9781491946008,2015-07-30,1\n'
+    )
+    report = import_books(stream, 'csv')
+
+    self.assertEqual(report['imported'], 1)
+    self.assertEqual(report['errors'], [{'line': 2, 'errors': {'isbn': ISBN_CONFLICT}}])
+    legacy.refresh_from_db()
+    self.assertEqual(legacy.copies_available, 1)
+    self.assertTrue(Book.objects.filter(isbn13='9781491946008').exists())
+
+
+class ISBNLookupTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    cache.clear()
+    self.dune = Book.objects.create(
+      title='Dune', author='Frank Herbert', isbn='0441172717',
+      published_date=date(1965, 8, 1), copies_available=1
+    )
+    self.fluent = Book.objects.create(
+      title='Fluent Python', author='Luciano Ramalho', isbn='9781491946008',
+      published_date=date(2015, 7, 30), copies_available=1
+    )
+
+  def test_exact_lookup_accepts_any_isbn_notation(self):
+    self.assertEqual(self.dune.isbn13, '9780441172719')
+    for isbn in ['0-441-17271-7', '978-0-441-17271-9', '9780441172719']:
+      with self.subTest(isbn=isbn):
+        response = self.assertEndpointBudget(1, 'get', f'/api/books/isbn/{isbn}')
+        self.assertEqual(response.data['id'], self.dune.pk)
+    self.assertEndpointBudget(1, 'get', '/api/books/isbn/9780262033848', status=404)
+    self.assertEndpointBudget(0, 'get', '/api/books/isbn/12345', status=400)
+
+  def test_batch_lookup_is_one_query(self):
+    isbns = ['978-1-4919-4600-8', 'not-an-isbn', '9780262033848', '0441172717'] + [f'{n:09d}0' for n in range(200)]
+    response = self.assertEndpointBudget(1, 'post', '/api/books/isbn', data={'isbns': isbns}, content_type='application/json')
+    results = response.data['results']
+    self.assertEqual([result['isbn'] for result in results], isbns)
+    self.assertEqual(results[0]['book']['id'], self.fluent.pk)
+    self.assertEqual(results[1]['error'], 'Invalid ISBN number')
+    self.assertIsNone(results[2]['book'])
+    self.assertEqual(results[3]['book']['id'], self.dune.pk)
+
+  def test_evicted_catalog_version_does_not_revive_stale_pages(self):
+    seen = [catalog_version()]
+    for title in ['Dune (Deluxe Edition)', 'Dune']:
+      self.dune.title = title
+      self.dune.save()
+      seen.append(catalog_version())
+    cache.delete(VERSION_KEY)
+    # Pages cached under any earlier version must stay unreachable.
+    self.assertGreater(catalog_version(), max(seen))
+
+  def test_isbn10_and_isbn13_forms_are_the_same_book(self):
+    response = self.client.post('/api/books', {
+      'title': 'Dune', 'author': 'Frank Herbert', 'isbn': '9780441172719',
+      'published_date': '1965-08-01', 'copies_available': 2,
+    }, content_type='application/json')
+    self.assertEqual(response.status_code, 400)
+    self.assertIn('isbn', response.data)
+
+    stream = io.StringIO('title,author,isbn,published_date,copies_available\nDune,Frank Herbert,978-0-441-17271-9,1965-08-01,5\n')
+    self.assertEqual(import_books(stream, 'csv')['imported'], 1)
+    self.dune.refresh_from_db()
+    self.assertEqual(self.dune.copies_available, 5)
+    self.assertEqual(Book.objects.count(), 2)
+
+
+class SearchTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.backend = SQLiteFTSBackend()
+    self.books = {
+      title: Book.objects.create(title=title, author=author, isbn=isbn, published_date=date(2000, 1, 1), copies_available=1)
+      for title, author, isbn in [
+        ('Python Crash Course', 'Eric Matthes', '9781593279288'),
+        ('Fluent Python', 'Luciano Ramalho', '9781491946008'),
+        ('Python Python Python', 'Monty Python', '9780262510875'),
+        ('Dune', 'Frank Herbert', '9780441172719'),
+      ]
+    }
+
+  def titles(self, query, backend=None):
+    return [book.title for book in (backend or self.backend).search(Book.objects.all(), query)]
+
+  def test_every_word_must_match_a_token_prefix(self):
+    self.assertEqual(self.titles('herb'), ['Dune'])
+    self.assertEqual(self.titles('ramalho fluent'), ['Fluent Python'])
+    self.assertEqual(self.titles('fluent herbert'), [])
+    self.assertEqual(self.titles('9780441172719'), ['Dune'])
+    self.assertEqual(self.titles('"*()'), [])
+    self.assertEqual(self.titles('une'), [])
+    self.assertEqual(self.titles('une', LikeSearchBackend()), ['Dune'])
+
+  def test_results_are_ordered_by_relevance(self):
+    titles = self.titles('python')
+    self.assertEqual(titles[0], 'Python Python Python')
+    self.assertCountEqual(titles, ['Python Crash Course', 'Fluent Python', 'Python Python Python'])
+
+  def test_saves_and_deletes_keep_the_index_in_sync(self):
+    dune = self.books['Dune']
+    dune.title = 'Children of Dune'
+    dune.save()
+    self.assertEqual(self.titles('children'), ['Children of Dune'])
+    dune.delete()
+    self.assertEqual(self.titles('dune'), [])
+
+    response = self.client.get('/api/books?search=crash')
+    self.assertEqual([book['title'] for book in response.data['results']], ['Python Crash Course'])
+
+  def test_rebuild_restores_a_stale_index(self):
+    with connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {self.backend.table}')
+    self.assertEqual(self.titles('python'), [])
+
+    out = io.StringIO()
+    call_command('rebuild_search_index', stdout=out)
+    self.assertIn('Indexed 4 books', out.getvalue())
+    self.assertEqual(len(self.titles('python')), 3)
+
+
+class KeysetPaginationTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    # Titles repeat, so only the appended pk keeps the order total.
+    for n in range(7):
+      Book.objects.create(
+        title=f'Title {n % 3}', author='Author', isbn=f'{n:09d}0', published_date=date(2000, 1, 1), copies_available=1
+      )
+    joined = timezone.now()
+    for n in range(5):
+      User.objects.create(username=f'patron{n}', date_joined=joined)
+    self.orders = {
+      '/api/books': list(Book.objects.order_by('title', 'pk').values_list('pk', flat=True)),
+      '/api/users': list(User.objects.order_by('-date_joined', '-pk').values_list('pk', flat=True)),
+    }
+
+  def walk(self, url, direction):
+    ids, link = [], url
+    while link:
+      response = self.client.get(link)
+      self.assertEqual(response.status_code, 200)
+      page = [row['id'] for row in response.data['results']]
+      ids = ids + page if direction == 'next' else page + ids
+      last = response
+      link = response.data[direction]
+    return ids, last
+
+  def test_cursors_walk_every_row_once_in_both_directions(self):
+    for url, order in self.orders.items():
+      with self.subTest(url=url):
+        forward, last = self.walk(f'{url}?page_size=2', 'next')
+        self.assertEqual(forward, order)
+        self.assertIsNone(last.data['next'])
+        backward, first = self.walk(last.data['previous'], 'previous')
+        self.assertEqual(backward, order[:-len(last.data['results'])])
+        self.assertIsNone(first.data['previous'])
+
+  def test_tampered_cursors_are_rejected(self):
+    def cursor(data):
+      return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    for url, bad in [
+      ('/api/books', 'not a cursor'),
+      ('/api/books', cursor({'p': ['Title 1']})),
+      ('/api/books', cursor({'p': ['Title 1', 'x']})),
+      ('/api/users', cursor({'p': ['yesterday', 1], 'r': True})),
+    ]:
+      with self.subTest(url=url, cursor=bad):
+        response = self.client.get(url, {'cursor': bad})
+        self.assertEqual(response.status_code, 400)
+
+  @override_settings(API_MAX_PAGE_SIZE=3)
+  def test_page_size_is_capped(self):
+    for url in self.orders:
+      with self.subTest(url=url):
+        self.assertEqual(len(self.client.get(url, {'page_size': 100}).data['results']), 3)
+        self.assertEqual(len(self.client.get(url, {'page_size': 0}).data['results']), 1)
+        self.assertEqual(len(self.client.get(url, {'page_size': 'all'}).data['results']), 3)
+
+
+class SparseFieldsetTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.books = [
+      Book.objects.create(
+        title=title, author='Author', isbn=isbn, published_date=date(2000, 1, 1), copies_available=copies
+      )
+      for title, isbn, copies in [('Dune', '9780441172719', 1), ('Fluent Python', '9781491946008', 2), ('SICP', '9780262510875', 0)]
+    ]
+
+  def test_fields_narrow_the_output_and_the_select(self):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get('/api/books?fields=id,title,copies_available')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.data['results'][0], {'id': self.books[0].pk, 'title': 'Dune', 'copies_available': 1})
+    self.assertNotIn('author', queries.captured_queries[0]['sql'])
+
+    response = self.client.get('/api/books?fields=title&search=python')
+    self.assertEqual(response.data['results'], [{'title': 'Fluent Python'}])
+
+  def test_ids_fetch_several_rows(self):
+    ids = f'{self.books[2].pk},{self.books[0].pk},999'
+    response = self.client.get(f'/api/books?ids={ids}&fields=id')
+    self.assertEqual(response.data['results'], [{'id': self.books[0].pk}, {'id': self.books[2].pk}])
+
+    user = User.objects.create(username='patron')
+    response = self.client.get(f'/api/users?ids={user.pk}&fields=id,username')
+    self.assertEqual(response.data['results'], [{'id': user.pk, 'username': 'patron'}])
+
+  def test_bad_parameters_are_rejected(self):
+    for url in ['/api/books?fields=id,secret', '/api/books?ids=1,two', '/api/users?fields=token']:
+      with self.subTest(url=url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.data)
+
+
+class RowSerializerTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create(username='patrón', email='p@example.com')
+    for title, isbn in [('Dune\u2028', '9780441172719'), ('Fluent Python', '9781491946008')]:
+      book = Book.objects.create(
+        title=title, author='Ñoño', isbn=isbn, published_date=date(2000, 1, 1), copies_available=2
+      )
+      checkout_book(self.user, book.pk)
+
+  def assertSameJSON(self, serializer_class, queryset, fields=None):
+    rows = RowSerializer(serializer_class, fields)
+    kwargs = {'fields': fields} if fields is not None else {}
+    expected = JSONRenderer().render(serializer_class(queryset, many=True, **kwargs).data)
+    self.assertEqual(JSONRenderer().render(rows.serialize(rows.rows(queryset))), expected)
+    self.assertEqual(ORJSONRenderer().render(rows.serialize(rows.rows(queryset))), expected)
+
+  def test_rows_render_byte_identical_to_the_serializers(self):
+    self.assertSameJSON(BookSerializer, Book.objects.all())
+    self.assertSameJSON(BookSerializer, Book.objects.all(), ['isbn13', 'title', 'last_activity_at'])
+    self.assertSameJSON(TransactionSerializer, Transaction.objects.all())
+    self.assertSameJSON(UserSerializer, User.objects.all())
+    with timezone.override('Europe/Paris'):
+      self.assertSameJSON(TransactionSerializer, Transaction.objects.all())
+    with self.assertRaises(Unsupported):
+      RowSerializer(OverdueSerializer)
+
+  def test_orjson_renderer_is_a_drop_in(self):
+    self.client.force_login(User.objects.create(username='librarian', is_staff=True))
+    for url in ['/api/books', f'/api/users/{self.user.pk}/borrowing-history', f'/api/users/{self.user.pk}', '/api/overdue']:
+      with self.subTest(url=url):
+        response = self.client.get(url)
+        self.assertEqual(ORJSONRenderer().render(response.data), response.content)
+
+
+class RequestMetricsTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    registry.reset()
+    self.user = User.objects.create(username='patron')
+    self.book = Book.objects.create(
+      title='Dune', author='Frank Herbert', isbn='9780441172719',
+      published_date=date(1965, 8, 1), copies_available=1
+    )
+
+  def metrics(self):
+    response = self.client.get('/metrics')
+    self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+    return response.content.decode().splitlines()
+
+  def test_requests_are_aggregated_per_named_route(self):
+    self.client.get(f'/api/books/{self.book.pk}')
+    self.client.get(f'/api/books/{self.book.pk}')
+    self.client.force_login(self.user)
+    self.client.post(f'/api/books/{self.book.pk}/checkout')
+    self.client.force_login(User.objects.create(username='librarian', is_staff=True))
+    export = self.client.get('/api/transactions/export.ndjson')
+    body = b''.join(export.streaming_content)
+
+    lines = self.metrics()
+    self.assertIn('library_http_requests_total{route="book-detail",method="GET",status="200"} 2', lines)
+    self.assertIn('library_http_request_duration_seconds_count{route="book-detail",method="GET"} 2', lines)
+    self.assertIn('library_http_request_duration_seconds_bucket{route="book-detail",method="GET",le="+Inf"} 2', lines)
+    # Only the first, uncached detail request reads the database.
+    self.assertIn('library_db_queries_total{route="book-detail",method="GET"} 1', lines)
+    self.assertIn('library_http_requests_total{route="book-checkout",method="POST",status="200"} 1', lines)
+    # Streamed exports are recorded once the body has been sent.
+    self.assertIn(f'library_http_response_size_bytes_total{{route="transaction-export",method="GET"}} {len(body)}', lines)
+    self.assertIn('library_db_queries_total{route="transaction-export",method="GET"} 4', lines)
+
+  @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+  def test_slow_requests_are_logged_with_their_sql(self):
+    url = f'/api/books/{self.book.pk}'
+    with self.assertLogs('users.metrics', 'WARNING') as logs, CaptureQueriesContext(connection) as queries:
+      self.client.get(url)
+    self.assertEqual(len(logs.records), 1)
+    message = logs.records[0].getMessage()
+    self.assertRegex(message, rf'^Slow request GET {url} \(book-detail\): [0-9.]+ ms, {len(queries)} queries, ')
+    # One line per query, slowest first, with the SQL before parameters are bound.
+    self.assertEqual(len(message.splitlines()[1:]), len(queries))
+    self.assertIn('FROM "users_book" WHERE "users_book"."id" = %s', message)
+
+    with self.assertNoLogs('users.metrics'), override_settings(SLOW_REQUEST_THRESHOLD_MS=None):
+      self.client.get(url)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserImportTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.patron = User.objects.create(username='patron', email='patron@example.com')
+
+  def test_csv_import_dedupes_on_username_and_email(self):
+    stream = io.StringIO(
+      'username,email,password\n'
+      'ada,ada@example.com,secret-1\n'
+      'ada,other@example.com,secret-2\n'
+      'grace,ADA@example.com,secret-3\n'
+      'patron,new@example.com,secret-4\n'
+      'linus,not-an-email,secret-5\n'
+      'ken,ken@example.com,\n'
+      'barbara,Patron@Example.com,secret-6\n'
+      'guido,,secret-7\n'
+    )
+    report = import_users(stream, 'csv', batch_size=3, workers=1)
+
+    self.assertEqual(report['imported'], 2)
+    self.assertEqual(
+      {error['line']: sorted(error['errors']) for error in report['errors']},
+      {3: ['username'], 4: ['email'], 5: ['username'], 6: ['email'], 7: ['password'], 8: ['email']},
+    )
+    self.assertTrue(User.objects.get(username='ada').check_password('secret-1'))
+    self.assertTrue(User.objects.get(username='guido').check_password('secret-7'))
+    self.assertEqual(User.objects.count(), 3)
+
+  def test_pool_hashes_in_worker_processes(self):
+    passwords = [f'secret-{i}' for i in range(5)]
+    with PasswordHasherPool(workers=2, min_parallel=1) as pool:
+      hashed = pool.hash(passwords)
+    self.assertEqual(len(set(hashed)), len(passwords))
+    self.assertTrue(all(check_password(password, encoded) for password, encoded in zip(passwords, hashed)))
+
+  def test_import_endpoint_is_staff_only(self):
+    self.client.force_login(self.patron)
+    upload = SimpleUploadedFile('users.csv', b'username,email,password\nada,ada@example.com,s1\n')
+    self.assertEqual(self.client.post('/api/users/import', {'file': upload}).status_code, 403)
+    self.assertFalse(User.objects.filter(username='ada').exists())
+
+  def test_import_endpoint_budget(self):
+    self.client.force_login(User.objects.create(username='librarian', is_staff=True))
+    rows = ''.join(f'user{n},user{n}@example.com,s{n}\n' for n in range(10))
+    upload = SimpleUploadedFile('users.csv', f'username,email,password\n{rows}'.encode())
+    # Session auth, the username/email checks before hashing, the
+    # SAVEPOINT/RELEASE pair, the write lock, the checks again and one INSERT.
+    with mock.patch('users.hashing.os.cpu_count', return_value=4), mock.patch('users.hashing.ProcessPoolExecutor') as executor:
+      response = self.assertEndpointBudget(2 + 2 + 2 + 1 + 2 + 1, 'post', '/api/users/import', data={'file': upload})
+    self.assertEqual(response.data['imported'], 10)
+    executor.assert_not_called()
+
+
+class CirculationCounterTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='patron')
+    self.books = [
+      Book.objects.create(
+        title=f'Book {i}', author='Author', isbn=f'97800000000{i:02d}',
+        published_date=date(2000, 1, 1), copies_available=2
+      )
+      for i in range(3)
+    ]
+
+  def counters(self, obj):
+    obj.refresh_from_db()
+    return obj.active_loans, obj.total_checkouts
+
+  def test_counters_follow_checkouts_and_returns(self):
+    checkout_book(self.user, self.books[0].pk)
+    return_book(self.user, self.books[0].pk)
+    checkout_books(self.user, [book.pk for book in self.books])
+    return_books(self.user, [self.books[1].pk])
+
+    self.assertEqual(self.counters(self.user), (2, 4))
+    self.assertEqual([self.counters(book) for book in self.books], [(1, 2), (0, 1), (1, 1)])
+    self.assertIsNotNone(self.user.last_activity_at)
+    self.assertEqual(repair_counters(fix=False), {'users': {'checked': 1, 'stale': 0}, 'books': {'checked': 3, 'stale': 0}})
+
+  def test_repair_recomputes_drifted_counters_from_the_log(self):
+    checkout_book(self.user, self.books[0].pk)
+    Book.objects.filter(pk=self.books[0].pk).update(active_loans=7, total_checkouts=0)
+    User.objects.filter(pk=self.user.pk).update(last_activity_at=None)
+
+    self.assertEqual(repair_counters()['books']['stale'], 1)
+    self.assertEqual(self.counters(self.books[0]), (1, 1))
+    self.assertIsNotNone(User.objects.get(pk=self.user.pk).last_activity_at)
+    self.assertEqual(repair_counters(batch_size=1)['users'], {'checked': 1, 'stale': 0})
+
+  def test_popular_books_are_ordered_by_checkouts(self):
+    other = User.objects.create(username='reader')
+    checkout_books(self.user, [self.books[1].pk, self.books[2].pk])
+    checkout_book(other, self.books[2].pk)
+
+    response = self.assertEndpointBudget(1, 'get', '/api/books/popular?fields=id,total_checkouts')
+    self.assertEqual(response.json()['results'], [
+      {'id': self.books[2].pk, 'total_checkouts': 2},
+      {'id': self.books[1].pk, 'total_checkouts': 1},
+    ])
+    self.assertEqual(self.client.get(f'/api/users/{self.user.pk}').json()['active_loans'], 2)
+
+
+class BatchCirculationTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='patron')
+    self.books = [
+      Book.objects.create(
+        title=f'Book {i}', author='Author', isbn=f'97800000000{i:02d}',
+        published_date=date(2000, 1, 1), copies_available=0 if i == 3 else 2
+      )
+      for i in range(4)
+    ]
+    self.ids = [book.pk for book in self.books]
+
+  def test_all_or_nothing_rolls_back_the_whole_cart(self):
+    results = checkout_books(self.user, self.ids)
+    self.assertEqual([result['status'] for result in results], ['skipped', 'skipped', 'skipped', 'failed'])
+    self.assertEqual(results[3]['error'], 'No copies available')
+    self.assertFalse(Transaction.objects.exists())
+    self.assertIsNone(User.objects.get(pk=self.user.pk).last_activity_at)
+
+  def test_best_effort_processes_what_it_can(self):
+    results = checkout_books(self.user, self.ids + [self.ids[0]], all_or_nothing=False)
+    self.assertEqual([result['status'] for result in results], ['checked_out'] * 3 + ['failed'])
+    self.assertEqual(Loan.objects.filter(user=self.user).count(), 3)
+    self.assertEqual(Book.objects.get(pk=self.ids[0]).copies_available, 1)
+
+    results = return_books(self.user, [self.ids[0], self.ids[3], 0], all_or_nothing=False)
+    self.assertEqual([result.get('error') for result in results], [None, 'You have not checked out this book', 'Book not found'])
+    self.assertEqual(Book.objects.get(pk=self.ids[0]).copies_available, 2)
+    self.assertEqual(Transaction.objects.filter(transaction_type=Transaction.RETURN).count(), 1)
+
+  def test_batch_endpoints_run_a_fixed_number_of_queries(self):
+    self.client.force_login(self.user)
+    cart = {'books': self.ids[:3]}
+    # Session auth, SAVEPOINT/RELEASE, then the same queries for 3 books as
+    # for 1; the "also borrowed" pairs only get their one UPDATE here.
+    self.assertEndpointBudget(2 + 2 + 7, 'post', '/api/checkout/batch', data=cart, content_type='application/json')
+    self.assertEndpointBudget(2 + 2 + 7, 'post', '/api/return/batch', data=cart, content_type='application/json')
+
+    response = self.client.post('/api/checkout/batch', {'books': self.ids}, content_type='application/json')
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.json()['error'], 'No books were checked out.')
+    response = self.client.post('/api/checkout/batch', {'books': self.ids, 'mode': 'best-effort'}, content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(self.client.post('/api/return/batch', {'books': 'all'}, content_type='application/json').status_code, 400)
+
+  def test_batch_endpoints_require_authentication(self):
+    for url in ['/api/checkout/batch', '/api/return/batch']:
+      response = self.client.post(url, {'books': self.ids[:1]}, content_type='application/json')
+      self.assertEqual(response.status_code, 401, url)
+    self.assertFalse(Transaction.objects.exists())
+
+
+class HoldTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.patrons = [User.objects.create(username=f'patron{i}') for i in range(4)]
+    self.book = Book.objects.create(
+      title='Dune', author='Frank Herbert', isbn='9780441172719',
+      published_date=date(1965, 8, 1), copies_available=1
+    )
+
+  def status(self, user):
+    return Hold.objects.filter(user=user, book=self.book).values_list('status', flat=True).first()
+
+  def copies(self):
+    return Book.objects.get(pk=self.book.pk).copies_available
+
+  def test_returned_copy_goes_to_the_first_holder(self):
+    first, second, third, _ = self.patrons
+    with self.assertRaisesMessage(CirculationError, 'check the book out instead'):
+      place_hold(second, self.book.pk)
+    checkout_book(first, self.book.pk)
+    with self.assertRaisesMessage(CirculationError, 'already have this book checked out'):
+      place_hold(first, self.book.pk)
+    place_hold(second, self.book.pk)
+    place_hold(third, self.book.pk)
+    with self.assertRaisesMessage(CirculationError, 'already have a hold'):
+      place_hold(third, self.book.pk)
+
+    return_book(first, self.book.pk)
+    self.assertEqual((self.status(second), self.status(third), self.copies()), (Hold.READY, Hold.WAITING, 0))
+    with self.assertRaisesMessage(CirculationError, 'No copies available'):
+      checkout_book(third, self.book.pk)
+    checkout_book(second, self.book.pk)
+    self.assertEqual((self.status(second), self.copies()), (None, 0))
+
+    return_book(second, self.book.pk)
+    results = checkout_books(third, [self.book.pk])
+    self.assertEqual(results[0]['status'], 'checked_out')
+    self.assertEqual((Hold.objects.count(), self.copies()), (0, 0))
+
+  def test_restock_and_cancel_serve_the_queue_in_order(self):
+    checkout_book(self.patrons[0], self.book.pk)
+    for patron in self.patrons[1:]:
+      place_hold(patron, self.book.pk)
+
+    data = {**BookSerializer(self.book).data, 'copies_available': 2}
+    response = self.client.put(f'/api/books/{self.book.pk}', data, content_type='application/json')
+    self.assertEqual(response.json()['copies_available'], 0)
+    self.assertEqual([self.status(patron) for patron in self.patrons[1:]], [Hold.READY, Hold.READY, Hold.WAITING])
+
+    cancel_hold(self.patrons[1], self.book.pk)
+    self.assertEqual((self.status(self.patrons[3]), self.copies()), (Hold.READY, 0))
+    cancel_hold(self.patrons[3], self.book.pk)
+    self.assertEqual(self.copies(), 1)
+    with self.assertRaisesMessage(CirculationError, 'no hold'):
+      cancel_hold(self.patrons[3], self.book.pk)
+
+  def test_hold_status_is_served_conditionally(self):
+    checkout_book(self.patrons[0], self.book.pk)
+    self.client.force_login(self.patrons[2])
+    url = f'/api/books/{self.book.pk}/hold'
+    self.assertEqual(self.client.get(url).status_code, 404)
+    place_hold(self.patrons[1], self.book.pk)
+    response = self.client.post(url)
+    self.assertEqual(response.status_code, 201)
+    self.assertEqual((response.json()['status'], response.json()['position']), (Hold.WAITING, 2))
+
+    etag = response['ETag']
+    # The session lookups and the hold itself.
+    self.assertEndpointBudget(2 + 1, 'get', url, status=304, HTTP_IF_NONE_MATCH=etag)
+
+    cancel_hold(self.patrons[1], self.book.pk)
+    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual((response.status_code, response.json()['position']), (200, 1))
+    self.assertNotEqual(response['ETag'], etag)
+
+    # A hold served by another worker is seen through the database alone.
+    etag = response['ETag']
+    Hold.objects.filter(user=self.patrons[2]).update(status=Hold.READY, ready_at=timezone.now())
+    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual((response.status_code, response.json()['status']), (200, Hold.READY))
+    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+    self.assertEqual(self.client.delete(url).status_code, 204)
+
+  @override_settings(HOLD_PICKUP_DAYS=2)
+  def test_ready_holds_not_picked_up_expire_in_the_overdue_run(self):
+    first, second, third, _ = self.patrons
+    other = Book.objects.create(
+      title='Emma', author='Jane Austen', isbn='9780141439587', published_date=date(1815, 12, 23), copies_available=1
+    )
+    for book in [self.book, other]:
+      checkout_book(first, book.pk)
+    place_hold(second, self.book.pk)
+    place_hold(third, self.book.pk)
+    place_hold(third, other.pk)
+    return_books(first, [self.book.pk, other.pk])
+    self.assertEqual(Hold.objects.filter(status=Hold.READY).count(), 2)
+
+    self.assertEqual(process_overdue()['expired_holds'], 0)
+    stale = timezone.now() - timedelta(days=2, minutes=1)
+    Hold.objects.filter(status=Hold.READY).update(ready_at=stale)
+    self.assertEqual(process_overdue()['expired_holds'], 2)
+
+    self.assertEqual((self.status(second), self.status(third), self.copies()), (None, Hold.READY, 0))
+    self.assertGreater(Hold.objects.get(user=third, book=self.book).ready_at, stale)
+    self.assertFalse(Hold.objects.filter(book=other).exists())
+    self.assertEqual(Book.objects.get(pk=other.pk).copies_available, 1)
+    self.assertEqual(expire_ready_holds(), 0)
+    checkout_book(third, self.book.pk)
+
+
+class RelatedBookTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.patrons = [User.objects.create(username=f'patron{i}') for i in range(3)]
+    self.books = [
+      Book.objects.create(
+        title=f'Book {i}', author='Author', isbn=f'97800000000{i:02d}',
+        published_date=date(2000, 1, 1), copies_available=3
+      )
+      for i in range(4)
+    ]
+    first, second, third, fourth = (book.pk for book in self.books)
+    self.checkout(self.patrons[0], first)
+    self.checkout(self.patrons[0], second, third)
+    self.checkout(self.patrons[1], first, second)
+    self.checkout(self.patrons[2], first)
+    self.checkout(self.patrons[2], fourth)
+
+  def checkout(self, user, *book_ids):
+    # The pairs a checkout completes are seeded once it commits.
+    with self.captureOnCommitCallbacks(execute=True):
+      if len(book_ids) == 1:
+        checkout_book(user, book_ids[0])
+      else:
+        checkout_books(user, list(book_ids))
+
+  def index(self):
+    return sorted(RelatedBook.objects.filter(score__gt=0).values_list('book_id', 'other_id', 'score'))
+
+  def test_incremental_updates_match_a_rebuild(self):
+    first, second, third, fourth = (book.pk for book in self.books)
+    return_book(self.patrons[2], first)
+    self.checkout(self.patrons[2], first)
+    incremental = self.index()
+    self.assertIn((first, second, 2), incremental)
+    self.assertIn((fourth, first, 1), incremental)
+
+    self.assertEqual(rebuild_related(chunk_size=2), {'books': 4, 'pairs': len(incremental)})
+    self.assertEqual(self.index(), incremental)
+    rebuild_related(top_k=1)
+    self.assertEqual(RelatedBook.objects.filter(book_id=first).count(), 1)
+
+  def test_incremental_updates_keep_the_rebuild_rules(self):
+    shelf = self.books + [
+      Book.objects.create(
+        title=f'Book {i}', author='Author', isbn=f'97800000000{i:02d}',
+        published_date=date(2000, 1, 1), copies_available=9
+      )
+      for i in range(4, 9)
+    ]
+    Book.objects.update(copies_available=9)
+    patrons = self.patrons + [User.objects.create(username=f'reader{i}') for i in range(6)]
+    rng = random.Random(7)
+    with mock.patch('users.related.TOP_K', 2):
+      rebuild_related(top_k=2)
+      for step in range(40):
+        patron, book = rng.choice(patrons), rng.choice(shelf)
+        if not Loan.objects.filter(user=patron, book=book).exists():
+          self.checkout(patron, book.pk)
+          return_book(patron, book.pk)
+        if step == 20:
+          rebuild_related(top_k=2)
+      incremental = self.index()
+      self.assertLessEqual(max(Counter(book for book, _, _ in incremental).values()), 2)
+      rebuild_related(top_k=2)
+    self.assertEqual(self.index(), incremental)
+
+  def test_patron_past_the_basket_limit_stops_counting(self):
+    first, second, third, fourth = (book.pk for book in self.books)
+    with mock.patch('users.related.MAX_BASKET', 3):
+      self.checkout(self.patrons[1], third)
+      self.assertIn((first, third, 2), self.index())
+      self.checkout(self.patrons[1], fourth)
+      incremental = self.index()
+      self.assertIn((first, third, 1), incremental)
+      self.assertNotIn((fourth, second, 1), incremental)
+      rebuild_related()
+    self.assertEqual(self.index(), incremental)
+
+  def test_pairs_that_cannot_make_a_full_list_are_not_seeded(self):
+    popular = [
+      Book.objects.create(title=f'Hit {i}', author='Author', isbn=f'97800000001{i:02d}', published_date=date(2000, 1, 1), copies_available=9)
+      for i in range(3)
+    ]
+    fresh = Book.objects.create(title='Debut', author='Author', isbn='9780000000200', published_date=date(2000, 1, 1), copies_available=9)
+    for i in range(3):
+      self.checkout(User.objects.create(username=f'fan{i}'), *(book.pk for book in popular))
+    newcomer = User.objects.create(username='newcomer')
+    self.checkout(newcomer, popular[0].pk, popular[1].pk)
+    with mock.patch('users.related.TOP_K', 2):
+      rebuild_related(top_k=2)
+      # The hits keep pairs scored 3; the debut has one reader, so it cannot
+      # enter their lists and only gets its own.
+      with CaptureQueriesContext(connection) as queries:
+        self.checkout(newcomer, fresh.pk)
+      self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('DELETE')])
+      incremental = self.index()
+      self.assertIn((fresh.pk, popular[0].pk, 1), incremental)
+      self.assertNotIn((popular[0].pk, fresh.pk, 1), incremental)
+      rebuild_related(top_k=2)
+    self.assertEqual(self.index(), incremental)
+
+  def test_related_books_are_one_indexed_lookup(self):
+    first, second = self.books[0].pk, self.books[1].pk
+    response = self.assertEndpointBudget(1, 'get', f'/api/books/{first}/related')
+    self.assertEqual(response.json()['results'][0], {'book': second, 'title': 'Book 1', 'author': 'Author', 'score': 2})
+    self.assertEqual([row['score'] for row in response.json()['results']], [2, 1, 1])
+    self.assertEqual(self.client.get('/api/books/0/related').status_code, 404)
+
+
+class FacetTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='patron')
+    self.books = [
+      Book.objects.create(
+        title=title, author=author, isbn=isbn, published_date=date(year, 1, 1), copies_available=copies
+      )
+      for title, author, isbn, year, copies in [
+        ('Dune', 'Frank Herbert', '9780441172719', 1965, 1),
+        ('Dune Messiah', 'Frank Herbert', '9780593098233', 1969, 0),
+        ('Fluent Python', 'Luciano Ramalho', '9781491946008', 2015, 2),
+      ]
+    ]
+
+  def summary(self):
+    return sorted(BookFacet.objects.filter(count__gt=0).values_list('facet', 'value', 'count'))
+
+  def test_summary_follows_catalog_and_stock_changes(self):
+    dune, messiah, fluent = self.books
+    checkout_book(self.user, dune.pk)
+    place_hold(User.objects.create(username='waiting'), dune.pk)
+    checkout_books(self.user, [fluent.pk])
+    data = {**BookSerializer(messiah).data, 'author': 'Brian Herbert', 'copies_available': 1}
+    self.client.put(f'/api/books/{messiah.pk}', data, content_type='application/json')
+    return_books(self.user, [dune.pk, fluent.pk])
+    import_books(io.StringIO(
+      'title,author,isbn,published_date,copies_available\n'
+      'Fluent Python,Luciano Ramalho,9781491946008,2015-07-30,0\n'
+      'Python Tricks,Dan Bader,9781775093305,2017-10-25,3\n'
+    ), 'csv')
+    Book.objects.get(pk=dune.pk).delete()
+
+    maintained = self.summary()
+    self.assertIn(('available', 'false', 1), maintained)
+    self.assertNotIn(('author', 'Frank Herbert', 1), maintained)
+    rebuild_facets()
+    self.assertEqual(self.summary(), maintained)
+
+  def test_list_returns_facets_with_the_page(self):
+    response = self.assertEndpointBudget(2, 'get', '/api/books?facets=author,available&page_size=1')
+    self.assertEqual(len(response.json()['results']), 1)
+    self.assertEqual(response.json()['facets'], {
+      'author': [{'value': 'Frank Herbert', 'count': 2}, {'value': 'Luciano Ramalho', 'count': 1}],
+      'available': [{'value': 'true', 'count': 2}, {'value': 'false', 'count': 1}],
+    })
+
+    response = self.assertEndpointBudget(2, 'get', '/api/books?author=Frank Herbert&available=true&facets=year,available')
+    self.assertEqual([book['title'] for book in response.json()['results']], ['Dune'])
+    self.assertEqual(response.json()['facets'], {
+      'year': [{'value': '1965', 'count': 1}], 'available': [{'value': 'true', 'count': 1}],
+    })
+    facets = self.client.get('/api/books?search=dune&facets=year').json()['facets']
+    self.assertEqual(facets, {'year': [{'value': '1965', 'count': 1}, {'value': '1969', 'count': 1}]})
+    self.assertEqual(self.client.get('/api/books?facets=publisher').status_code, 400)
+    self.assertEqual(self.client.get('/api/books?year=recent').status_code, 400)
+
+  def test_list_rejects_non_integer_filters(self):
+    self.assertEqual(
+      [book['copies_available'] for book in self.client.get('/api/books?copies_available=0').json()['results']], [0]
+    )
+    for url in ['/api/books?copies_available=abc', '/api/books?copies_available=1.5']:
+      with self.subTest(url=url):
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'copies_available must be an integer.'}))
+        with override_settings(ROOT_URLCONF='users.benchmarks.asgi'):
+          response = async_to_sync(AsyncClient().get)(url)
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'copies_available must be an integer.'}))
+
+
+class TransactionExportTests(TestCase):
+  def setUp(self):
+    self.patron = User.objects.create(username='patron')
+    self.book = Book.objects.create(
+      title='Dune, Messiah', author='Frank Herbert', isbn='9780441172719',
+      published_date=date(1965, 8, 1), copies_available=1
+    )
+    for _ in range(2):
+      checkout_book(self.patron, self.book.pk)
+      return_book(self.patron, self.book.pk)
+    self.ids = list(Transaction.objects.order_by('id').values_list('id', flat=True))
+    for day, pk in enumerate(self.ids, start=1):
+      Transaction.objects.filter(pk=pk).update(transaction_date=timezone.make_aware(datetime(2024, 1, day, 10)))
+    self.client.force_login(User.objects.create(username='staff', is_staff=True))
+
+  def export(self, url):
+    response = self.client.get(url)
+    self.assertEqual(response.status_code, 200)
+    return b''.join(response.streaming_content).decode()
+
+  def exported_ids(self, query):
+    return [row['id'] for row in map(json.loads, self.export(f'/api/transactions/export.ndjson?{query}').splitlines())]
+
+  def test_csv_and_ndjson_carry_the_same_rows(self):
+    response = self.client.get('/api/transactions/export.csv')
+    self.assertEqual(response['Content-Type'], 'text/csv')
+    self.assertEqual(response['Content-Disposition'], 'attachment; filename="transactions.csv"')
+    header, *rows = csv.reader(io.StringIO(b''.join(response.streaming_content).decode()))
+    self.assertEqual(header, [
+      'id', 'user', 'username', 'book', 'book_title', 'book_isbn', 'transaction_type', 'transaction_date', 'due_date',
+    ])
+    self.assertEqual(rows[0], [
+      str(self.ids[0]), str(self.patron.pk), 'patron', str(self.book.pk), 'Dune, Messiah', '9780441172719',
+      Transaction.CHECKOUT, '2024-01-01T10:00:00+00:00', Transaction.objects.get(pk=self.ids[0]).due_date.isoformat(),
+    ])
+    self.assertEqual(rows[1][-1], '')
+
+    lines = self.export('/api/transactions/export.ndjson').splitlines()
+    self.assertEqual(self.client.get('/api/transactions/export.ndjson')['Content-Type'], 'application/x-ndjson')
+    records = [json.loads(line) for line in lines]
+    self.assertEqual([list(record) for record in records], [header] * len(self.ids))
+    self.assertEqual([[str(value or '') for value in record.values()] for record in records], rows)
+    self.assertEqual(self.client.get('/api/transactions/export.xml').status_code, 404)
+
+  def test_since_and_until_bound_the_range(self):
+    self.assertEqual(self.exported_ids('since=2024-01-02&until=2024-01-03'), self.ids[1:3])
+    self.assertEqual(self.exported_ids('since=2024-01-02T10:00:01'), self.ids[2:])
+    self.assertEqual(self.exported_ids('until=2024-01-01'), self.ids[:1])
+    response = self.client.get('/api/transactions/export.csv?since=yesterday')
+    self.assertEqual(response.status_code, 400)
+
+  def test_after_resumes_past_the_ids_already_sent(self):
+    sent = self.exported_ids('until=2024-01-02')
+    self.assertEqual(self.exported_ids(f'after={sent[-1]}'), self.ids[2:])
+    self.assertEqual(self.exported_ids(f'after={self.ids[-1]}'), [])
+    self.assertEqual(self.client.get('/api/transactions/export.csv?after=last').status_code, 400)
+
+
+class ArchiveTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='patron')
+    self.books = [
+      Book.objects.create(
+        title=f'Book {i}', author='Author', isbn=f'97800000000{i:02d}',
+        published_date=date(2000, 1, 1), copies_available=1
+      )
+      for i in range(3)
+    ]
+    for cycle in range(12):
+      book = self.books[cycle % 3]
+      checkout_book(self.user, book.pk)
+      return_book(self.user, book.pk)
+    checkout_book(self.user, self.books[0].pk)
+    now = timezone.now()
+    for days, pk in enumerate(Transaction.objects.order_by('id').values_list('id', flat=True)):
+      Transaction.objects.filter(pk=pk).update(transaction_date=now - timedelta(days=30 - days))
+    self.cutoff = now - timedelta(days=20)
+
+  def history(self):
+    pages, url = [], f'/api/users/{self.user.pk}/borrowing-history?page_size=4'
+    while url:
+      pages.append(self.client.get(url).json())
+      url = pages[-1]['next']
+    return pages
+
+  def test_history_export_and_counters_read_both_tiers(self):
+    pinned = Transaction.objects.order_by('id').first()
+    Overdue.objects.create(
+      user=self.user, book=pinned.book, checkout=pinned, due_date=pinned.due_date, updated_at=timezone.now(),
+    )
+    process_overdue()
+    rebuild_related()
+    repair_counters()
+    before = self.history(), list(export_rows(chunk_size=4)), sorted(RelatedBook.objects.values_list('book', 'other', 'score'))
+
+    summary = archive_transactions(self.cutoff, batch_size=4)
+    self.assertEqual((summary['archived'], summary['hot']), (9, 16))
+    self.assertTrue(Transaction.objects.filter(pk=pinned.pk).exists())
+    self.assertEqual(TransactionSummary.objects.get(user=self.user, book=self.books[1]).checkouts, 2)
+    rebuild_related()
+    after = self.history(), list(export_rows(chunk_size=4)), sorted(RelatedBook.objects.values_list('book', 'other', 'score'))
+    self.assertEqual(after, before)
+
+    pages = after[0]
+    self.assertEqual(self.client.get(pages[-1]['previous']).json()['results'], pages[-2]['results'])
+    self.assertEqual(repair_counters(fix=False), {'users': {'checked': 1, 'stale': 0}, 'books': {'checked': 3, 'stale': 0}})
+    self.assertEqual(archive_transactions(self.cutoff)['archived'], 0)
+
+  def test_recent_pages_do_not_read_the_archive(self):
+    process_overdue()
+    archive_transactions(self.cutoff)
+    self.assertEqual(ArchivedTransaction.objects.count(), 10)
+    url = f'/api/users/{self.user.pk}/borrowing-history?page_size=4'
+    response = self.assertEndpointBudget(2, 'get', url)
+    response = self.assertEndpointBudget(2, 'get', response.json()['next'])
+    response = self.assertEndpointBudget(2, 'get', response.json()['next'])
+    response = self.assertEndpointBudget(3, 'get', response.json()['next'])
+    self.assertEqual(len(response.json()['results']), 4)
+
+
+class OverdueTests(QueryBudgetMixin, TestCase):
+  def setUp(self):
+    self.user = User.objects.create(username='patron')
+    self.book = Book.objects.create(
+      title='Dune', author='Frank Herbert', isbn='9780441172719',
+      published_date=date(1965, 8, 1), copies_available=2
+    )
+    self.today = timezone.localdate()
+
+  def checkout_due(self, days_ago):
+    checkout_book(self.user, self.book.pk)
+    due = self.today - timedelta(days=days_ago)
+    Loan.objects.filter(user=self.user, book=self.book).update(due_date=due)
+    Transaction.objects.filter(user=self.user, book=self.book).update(due_date=due)
+
+  def test_overdue_loans_are_recorded_once_and_settled_on_return(self):
+    self.checkout_due(days_ago=4)
+    summary = process_overdue(self.today)
+    self.assertEqual((summary['newly_overdue'], summary['open'], summary['accrued_fines']), (1, 1, '1.00'))
+    self.assertEqual(process_overdue(self.today)['newly_overdue'], 0)
+
+    return_book(self.user, self.book.pk)
+    summary = process_overdue(self.today)
+    self.assertEqual((summary['settled_returns'], summary['open']), (1, 0))
+    overdue = Overdue.objects.get()
+    self.assertIsNotNone(overdue.returned_at)
+    self.assertEqual(overdue.fine, Decimal('1.00'))
+
+  def test_late_return_between_runs_is_recorded_from_the_watermark(self):
+    process_overdue(self.today)
+    self.checkout_due(days_ago=2)
+    return_book(self.user, self.book.pk)
+
+    summary = process_overdue(self.today)
+    self.assertEqual((summary['newly_overdue'], summary['late_returns']), (0, 1))
+    self.assertEqual(Overdue.objects.get().fine, Decimal('0.50'))
+    self.assertEqual(process_overdue(self.today)['late_returns'], 0)
+
+  def test_fines_are_capped(self):
+    self.checkout_due(days_ago=400)
+    process_overdue(self.today)
+    self.client.force_login(self.user)
+    self.assertEqual(self.client.get('/api/overdue').status_code, 403)
+    self.client.force_login(User.objects.create(username='librarian', is_staff=True))
+    response = self.client.get('/api/overdue?status=open')
+    self.assertEqual([row['fine'] for row in response.json()['results']], ['10.00'])
+    self.assertEqual(self.client.get('/api/overdue?status=returned').json()['results'], [])
+    self.assertEqual(self.client.get('/api/overdue?status=late').status_code, 400)
+    self.assertEndpointBudget(2 + 1, 'get', f'/api/overdue?user={self.user.pk}')
+
+  def test_cron_hook_requires_the_secret(self):
+    self.assertEqual(self.client.get('/api/overdue/run').status_code, 403)
+    with override_settings(CRON_SECRET='s3cret'):
+      self.assertEqual(self.client.get('/api/overdue/run', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+      response = self.client.get('/api/overdue/run', HTTP_AUTHORIZATION='Bearer s3cret')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()['newly_overdue'], 0)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+  threads = 8
+  attempts_per_thread = 5
+  copies = 10
+
+  def setUp(self):
+    self.book = Book.objects.create(
+      title='Popular', author='Author', isbn='9781491946008',
+      published_date=date(2020, 1, 1), copies_available=self.copies
+    )
+    self.users = [User.objects.create(username=f'patron{i}') for i in range(self.threads * self.attempts_per_thread)]
+
+  def hammer(self, action, users, outcomes):
+    def worker(batch):
+      try:
+        for user in batch:
+          try:
+            action(user, self.book.pk)
+            outcomes.append('ok')
+          except CirculationError:
+            outcomes.append('refused')
+      finally:
+        connection.close()
+
+    step = self.attempts_per_thread
+    workers = [threading.Thread(target=worker, args=(users[i:i + step],)) for i in range(0, len(users), step)]
+    for thread in workers:
+      thread.start()
+    for thread in workers:
+      thread.join()
+
+  def test_concurrent_checkouts_never_oversell(self):
+    outcomes = []
+    self.hammer(checkout_book, self.users, outcomes)
+
+    self.assertEqual(len(outcomes), len(self.users))
+    self.assertEqual(outcomes.count('ok'), self.copies)
+    self.book.refresh_from_db()
+    self.assertEqual(self.book.copies_available, 0)
+    self.assertEqual(Transaction.objects.filter(book=self.book, transaction_type=Transaction.CHECKOUT).count(), self.copies)
+
+  def test_concurrent_returns_restock_exactly(self):
+    borrowers = self.users[:self.copies]
+    for user in borrowers:
+      checkout_book(user, self.book.pk)
+
+    outcomes = []
+    self.hammer(return_book, self.users, outcomes)
+
+    self.assertEqual(outcomes.count('ok'), self.copies)
+    self.book.refresh_from_db()
+    self.assertEqual(self.book.copies_available, self.copies)
+
+
+class EndpointQueryBudgetTests(QueryBudgetMixin, TestCase):
+  """Every endpoint runs a fixed number of queries, however many rows it returns."""
+  rows = 25
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.staff = User.objects.create(username='librarian', is_staff=True, is_superuser=True)
+    cls.users = [User.objects.create(username=f'patron{i}') for i in range(cls.rows)]
+    cls.books = [
+      Book.objects.create(
+        title=f'Book {i}', author='Author', isbn=f'97980000000{i:02d}'[:12] + str(i % 10),
+        published_date=date(2000, 1, 1), copies_available=5
+      )
+      for i in range(cls.rows)
+    ]
+    cls.reader = cls.users[0]
+    for book in cls.books[:-1]:
+      checkout_book(cls.reader, book.pk)
+
+  def setUp(self):
+    cache.clear()
+
+  def test_read_endpoint_budgets(self):
+    budgets = [
+      (1, '/api/books'),
+      (1, '/api/books?search=book'),
+      (1, f'/api/books/{self.books[0].pk}'),
+      (1, '/api/books/popular'),
+      (1, '/api/users'),
+      (1, f'/api/users?ids={self.users[0].pk},{self.users[5].pk}&fields=id,username'),
+      (1, f'/api/books?ids={self.books[0].pk},{self.books[3].pk}&fields=id,title,copies_available'),
+      (1, f'/api/users/{self.reader.pk}'),
+      (2, f'/api/users/{self.reader.pk}/borrowing-history'),
+      (2, f'/api/users/{self.reader.pk}/loans'),
+    ]
+    for budget, url in budgets:
+      with self.subTest(url=url):
+        self.assertEndpointBudget(budget, 'get', url)
+
+  def test_write_endpoint_budgets(self):
+    self.client.force_login(self.reader)
+    # Session auth adds two lookups, and the enclosing test transaction turns
+    # the atomic block into a SAVEPOINT/RELEASE pair. The checkout is the
+    # conditional stock UPDATE, the state SELECT, the patron's and the "also
+    # borrowed" counter UPDATEs and the transaction and loan INSERTs; seeding
+    # new pairs waits for the commit.
+    self.assertEndpointBudget(2 + 2 + 6, 'post', f'/api/books/{self.books[-1].pk}/checkout')
+    self.assertEndpointBudget(2 + 2 + 5, 'post', f'/api/books/{self.books[-1].pk}/return')
+    self.assertEndpointBudget(2, 'get', '/api/transactions/export.ndjson', status=403)
+    self.client.force_login(self.staff)
+    self.assertEndpointBudget(2 + 2, 'get', '/api/transactions/export.ndjson')
+
+  def test_admin_changelist_budgets(self):
+    self.client.force_login(self.staff)
+    for url in ['/admin/users/transaction/', '/admin/users/loan/', '/admin/users/book/', '/admin/users/overdue/', '/admin/users/hold/']:
+      with self.subTest(url=url):
+        self.assertEndpointBudget(6, 'get', url)
@@ -1,22 +1,71 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
   UserListCreateAPIView, 
+  UserImportAPIView,
   UserDetailAPIView, 
   BorrowingHistoryAPIView,
+  UserLoansAPIView,
+  TransactionExportAPIView,
   BookListCreateAPIView,
   BookDetailAPIView,
+  BookPopularAPIView,
+  BookRelatedAPIView,
+  BookImportAPIView,
+  BookByISBNAPIView,
+  BookISBNBatchAPIView,
+  BookCacheStatsAPIView,
   BookCheckoutAPIView,
   BookReturnAPIView,
+  BookBatchCheckoutAPIView,
+  BookBatchReturnAPIView,
+  BookHoldAPIView,
+  OverdueListAPIView,
+  OverdueRunAPIView,
   LoginView
 )
 
 urlpatterns = [
     path('login', LoginView.as_view(), name='user-login'),
     path('users', UserListCreateAPIView.as_view(), name='user-list-create'),
+    path('users/import', UserImportAPIView.as_view(), name='user-import'),
     path('users/<int:pk>', UserDetailAPIView.as_view(), name='user-detail'),
     path('users/<int:pk>/borrowing-history', BorrowingHistoryAPIView.as_view(), name='user-borrowing-history'),
+    path('users/<int:pk>/loans', UserLoansAPIView.as_view(), name='user-active-loans'),
+    path('transactions/export.<str:file_format>', TransactionExportAPIView.as_view(), name='transaction-export'),
     path('books', BookListCreateAPIView.as_view(), name='book-list-create'),
+    path('books/popular', BookPopularAPIView.as_view(), name='book-popular'),
+    path('books/import', BookImportAPIView.as_view(), name='book-import'),
+    path('books/isbn', BookISBNBatchAPIView.as_view(), name='book-isbn-batch'),
+    path('books/isbn/<str:isbn>', BookByISBNAPIView.as_view(), name='book-isbn-detail'),
+    path('books/cache-stats', BookCacheStatsAPIView.as_view(), name='book-cache-stats'),
     path('books/<int:pk>', BookDetailAPIView.as_view(), name='book-detail'),
+    path('books/<int:pk>/related', BookRelatedAPIView.as_view(), name='book-related'),
     path('books/<int:pk>/checkout', BookCheckoutAPIView.as_view(), name='book-checkout'),
     path('books/<int:pk>/return', BookReturnAPIView.as_view(), name='book-return'),
+    path('books/<int:pk>/hold', BookHoldAPIView.as_view(), name='book-hold'),
+    path('checkout/batch', BookBatchCheckoutAPIView.as_view(), name='book-checkout-batch'),
+    path('return/batch', BookBatchReturnAPIView.as_view(), name='book-return-batch'),
+    path('overdue', OverdueListAPIView.as_view(), name='overdue-list'),
+    path('overdue/run', OverdueRunAPIView.as_view(), name='overdue-run'),
 ]
+
+
+def with_async_reads(patterns):
+  """Swap the read-only routes for their async versions from users.async_views."""
+  from . import async_views
+
+  async_routes = {
+    'user-detail': async_views.user_detail_view,
+    'user-borrowing-history': async_views.borrowing_history_view,
+    'book-list-create': async_views.book_list_view,
+    'book-detail': async_views.book_detail_view,
+  }
+  return [
+    path(str(pattern.pattern), async_routes[pattern.name], name=pattern.name) if pattern.name in async_routes else pattern
+    for pattern in patterns
+  ]
+
+
+if settings.ASYNC_READ_VIEWS:
+  urlpatterns = with_async_reads(urlpatterns)
@@ -1,22 +1,41 @@
-from django.db import models
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
-from rest_framework import status, filters
-from rest_framework.decorators import action
+from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.exceptions import AuthenticationFailed
-from django_filters.rest_framework import DjangoFilterBackend
-from .models import User, Transaction, Book
-from .serializers import UserSerializer, TransactionSerializer, BookSerializer
-from datetime import datetime, timedelta
-import jwt, datetime
-from django.http import Http404
+from .models import User, Transaction, ArchivedTransaction, Book, Loan, Hold, Overdue, RelatedBook
+from .serializers import (
+  UserSerializer, TransactionSerializer, BookSerializer, LoanSerializer, HoldSerializer, OverdueSerializer,
+  RelatedBookSerializer,
+)
+from .search import get_search_backend
+from .pagination import KeysetPagination
+from .circulation import (
+  CirculationError, allocate_holds, cancel_hold, checkout_book, checkout_books, holds_with_position, place_hold,
+  return_book, return_books,
+)
+from . import exports
+from .archive import archive_bound
+from .authentication import encode_token
+from .db import read_replica
+from .cache import cached_response, detail_key, isbn_key, list_key, stats as cache_stats
+from .isbn import to_isbn13
+from .facets import facet_counts, requested_facets
+from .related import TOP_K
+from .rows import RowSerializer
+from .sparse import QueryParamError, filter_ids, requested_fields
+import datetime
+import hmac
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
 
 # Create your views here.
 
 #LOGIN VIEWS
 class LoginView(APIView):
+  authentication_classes = []
 
   def post(self, request):
     email = request.data.get('email')
@@ -33,13 +52,7 @@ class LoginView(APIView):
     if not user.check_password(password):
       raise AuthenticationFailed('Incorrect password!')
     
-    payload = {
-      'id': user.id,
-      'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=60),
-      'iat': datetime.datetime.utcnow()
-    }
-
-    token = jwt.encode(payload, 'secret', algorithm='HS256').decode('utf-8')
+    token = encode_token(user, datetime.timedelta(minutes=60))
 
     response = Response()
     response.set_cookie(key='jwt', value=token, httponly=True)
@@ -54,9 +67,15 @@ class UserListCreateAPIView(APIView):
     #permission_classes = [AllowAny]
 
     def get(self, request):
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        try:
+            fields = requested_fields(request.query_params, UserSerializer)
+            users = filter_ids(User.objects.all(), request.query_params)
+        except QueryParamError as exc:
+            return Response({'error': str(exc)}, status=400)
+        serializer = RowSerializer(UserSerializer, fields)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(serializer.rows(users), request, view=self)
+        return paginator.get_paginated_response(serializer.serialize(page))
 
     def post(self, request):
         serializer = UserSerializer(data=request.data)
@@ -65,9 +84,29 @@ class UserListCreateAPIView(APIView):
             return Response(serializer.data, status=201)
         return Response(serializer.errors, status=400)
 
+class UserImportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        from .imports import FORMATS, guess_format, import_users
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Upload a CSV or JSONL file in the "file" field.'}, status=400)
+
+        input_format = request.data.get('input_format') or guess_format(upload.name)
+        if input_format not in FORMATS:
+            return Response({'error': f'input_format must be one of {", ".join(FORMATS)}.'}, status=400)
+
+        # Hashed in this worker: a process pool per request would multiply
+        # under concurrent uploads. Large files go through `import_users`.
+        report = import_users(upload.file, input_format, workers=1)
+        return Response(report)
+
 class UserDetailAPIView(APIView):
     #permission_classes = [IsAuthenticated]
 
+    @read_replica
     def get(self, request, pk):
         user = get_object_or_404(User, pk=pk)
         serializer = UserSerializer(user)
@@ -86,39 +125,126 @@ class UserDetailAPIView(APIView):
         user.delete()
         return Response(status=204)
     
+def history_tiers(serializer, user):
+    """The user's hot transactions, then the archived ones once a page reaches past the archive cutoff."""
+    tiers = [(serializer.rows(Transaction.objects.filter(user=user)), None)]
+    if user.archived_before is not None:
+        tiers.append((serializer.rows(ArchivedTransaction.objects.filter(user=user)), user.archived_before))
+    return tiers
+
+
 class BorrowingHistoryAPIView(APIView):
     #permission_classes = [IsAuthenticated]
 
+    @read_replica
+    def get(self, request, pk):
+        user = get_object_or_404(User.objects.annotate(archived_before=archive_bound()), pk=pk)
+        serializer = RowSerializer(TransactionSerializer)
+        paginator = KeysetPagination()
+        page = paginator.paginate_tiers(history_tiers(serializer, user), request, view=self)
+        return paginator.get_paginated_response(serializer.serialize(page))
+
+
+class UserLoansAPIView(APIView):
+    #permission_classes = [IsAuthenticated]
+
     def get(self, request, pk):
         user = get_object_or_404(User, pk=pk)
-        transactions = Transaction.objects.filter(user=user)
-        serializer = TransactionSerializer(transactions, many=True)
-        return Response(serializer.data)
+        loans = Loan.objects.filter(user=user).select_related('book')
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(loans, request, view=self)
+        serializer = LoanSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+
+class TransactionExportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, file_format):
+        if file_format not in exports.FORMATS:
+            raise Http404('Unknown export format')
+        try:
+            user = request.query_params.get('user')
+            after = request.query_params.get('after')
+            rows = exports.export_rows(
+                user=int(user) if user else None,
+                since=exports.parse_bound(request.query_params.get('since')),
+                until=exports.parse_bound(request.query_params.get('until'), end=True),
+                after=int(after) if after else None,
+            )
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=400)
+
+        response = StreamingHttpResponse(exports.render(rows, file_format), content_type=exports.FORMATS[file_format])
+        response['Content-Disposition'] = f'attachment; filename="transactions.{file_format}"'
+        return response
     
 
 # BOOKS VIEWS
 class BookListCreateAPIView(APIView):
   #permission_classes = [IsAuthenticated]
+  # Query parameters that narrow the list; without any, facets come from the summary table.
+  filters = ('ids', 'copies_available', 'search', 'author', 'year', 'available')
 
+  @read_replica
   def get(self, request):
-    books = Book.objects.all()
+    try:
+      return cached_response(request, 'book-list', list_key(request), lambda: self.list_books(request))
+    except QueryParamError as exc:
+      return Response({'error': str(exc)}, status=400)
+
+  @staticmethod
+  def filter_books(params):
+    # `?ids=1,2,3` fetches several books in the one page query.
+    books = filter_ids(Book.objects.all(), params)
 
     # Filtering based on `copies_available`
-    copies_available = request.query_params.get('copies_available')
+    copies_available = params.get('copies_available')
     if copies_available is not None:
-      books = books.filter(copies_available=copies_available)
+      try:
+        books = books.filter(copies_available=int(copies_available))
+      except ValueError:
+        raise QueryParamError('copies_available must be an integer.')
+
+    # Facet values: `?author=` (exact), `?year=` and `?available=true|false`
+    author = params.get('author')
+    if author is not None:
+      books = books.filter(author=author)
+    year = params.get('year')
+    if year is not None:
+      try:
+        books = books.filter(published_date__year=int(year))
+      except ValueError:
+        raise QueryParamError('year must be an integer.')
+    available = params.get('available')
+    if available is not None:
+      if available not in ('true', 'false'):
+        raise QueryParamError('available must be true or false.')
+      books = books.filter(copies_available__gt=0) if available == 'true' else books.filter(copies_available__lte=0)
 
     # Searching based on `title`, `author`, or `isbn`
-    search_query = request.query_params.get('search')
+    search_query = params.get('search')
     if search_query:
-      books = books.filter(
-        models.Q(title__icontains=search_query) |
-        models.Q(author__icontains=search_query) |
-        models.Q(isbn__icontains=search_query)
-      )
-
-    serializer = BookSerializer(books, many=True)
-    return Response(serializer.data)
+      books = get_search_backend().search(books, search_query)
+    return books
+
+  @classmethod
+  def is_filtered(cls, params):
+    return any(name in params for name in cls.filters)
+
+  def list_books(self, request):
+    params = request.query_params
+    serializer = RowSerializer(BookSerializer, requested_fields(params, BookSerializer))
+    facets = requested_facets(params)
+    books = self.filter_books(params)
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(serializer.rows(books), request, view=self)
+    data = paginator.get_paginated_response(serializer.serialize(page)).data
+    if facets:
+      data['facets'] = facet_counts(facets, books, self.is_filtered(params))
+    # No Last-Modified: a deleted book or one leaving the filter does not move
+    # the page's newest `updated_at`, so lists revalidate on the ETag alone.
+    return data, None
 
   def post(self, request):
     serializer = BookSerializer(data=request.data)
@@ -128,19 +254,77 @@ class BookListCreateAPIView(APIView):
     return Response(serializer.errors, status=400)
 
 
+class BookPopularAPIView(APIView):
+  """The most borrowed books, read from the precomputed Book.total_checkouts."""
+
+  @read_replica
+  def get(self, request):
+    try:
+      return cached_response(request, 'book-popular', list_key(request, name='popular'), lambda: self.list_popular(request))
+    except QueryParamError as exc:
+      return Response({'error': str(exc)}, status=400)
+
+  def list_popular(self, request):
+    serializer = RowSerializer(BookSerializer, requested_fields(request.query_params, BookSerializer))
+    books = Book.objects.filter(total_checkouts__gt=0).order_by('-total_checkouts')
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(serializer.rows(books), request, view=self)
+    return paginator.get_paginated_response(serializer.serialize(page)).data, None
+
+
+class BookRelatedAPIView(APIView):
+  """Books most often borrowed by the patrons who borrowed this one, read from users.related."""
+
+  @read_replica
+  def get(self, request, pk):
+    def build():
+      serializer = RowSerializer(RelatedBookSerializer)
+      related = RelatedBook.objects.filter(book_id=pk).order_by('-score', 'other_id')
+      rows = list(serializer.rows(related)[:TOP_K])
+      if not rows and not Book.objects.filter(pk=pk).exists():
+        raise Http404('Book not found')
+      return {'results': serializer.serialize(rows)}, None
+    return cached_response(request, 'book-related', list_key(request, name=f'related:{pk}'), build)
+
+
+class BookImportAPIView(APIView):
+  permission_classes = [IsAuthenticated]
+
+  def post(self, request):
+    # Deferred so the importer (and isbnlib) is not loaded on cold start.
+    from .imports import FORMATS, guess_format, import_books
+
+    upload = request.FILES.get('file')
+    if upload is None:
+      return Response({'error': 'Upload a CSV or JSONL file in the "file" field.'}, status=400)
+
+    input_format = request.data.get('input_format') or guess_format(upload.name)
+    if input_format not in FORMATS:
+      return Response({'error': f'input_format must be one of {", ".join(FORMATS)}.'}, status=400)
+
+    report = import_books(upload.file, input_format)
+    return Response(report)
+
+
 class BookDetailAPIView(APIView):
   #permission_classes = [IsAuthenticated]
 
+  @read_replica
   def get(self, request, pk):
-    book = get_object_or_404(Book, pk=pk)
-    serializer = BookSerializer(book)
-    return Response(serializer.data)
+    def build():
+      book = get_object_or_404(Book, pk=pk)
+      return BookSerializer(book).data, book.updated_at
+    return cached_response(request, 'book-detail', detail_key(pk), build)
 
   def put(self, request, pk):
     book = get_object_or_404(Book, pk=pk)
     serializer = BookSerializer(book, data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+          serializer.save()
+          # A restock serves the hold queue before any copy reaches the shelf.
+          if book.copies_available > 0 and allocate_holds([pk]):
+            book.refresh_from_db()
         return Response(serializer.data)
     return Response(serializer.errors, status=400)
 
@@ -150,48 +334,58 @@ class BookDetailAPIView(APIView):
     return Response(status=204)
 
 
+class BookByISBNAPIView(APIView):
+
+  @read_replica
+  def get(self, request, isbn):
+    isbn13 = to_isbn13(isbn)
+    if isbn13 is None:
+      return Response({'error': 'Invalid ISBN number'}, status=400)
+
+    def build():
+      book = get_object_or_404(Book, isbn13=isbn13)
+      return BookSerializer(book).data, book.updated_at
+    return cached_response(request, 'book-isbn', isbn_key(isbn13), build)
+
+
+class BookISBNBatchAPIView(APIView):
+  max_isbns = 1000
+
+  @read_replica
+  def post(self, request):
+    isbns = request.data.get('isbns')
+    if not isinstance(isbns, list) or not all(isinstance(isbn, str) for isbn in isbns):
+      return Response({'error': '"isbns" must be a list of ISBN strings.'}, status=400)
+    if len(isbns) > self.max_isbns:
+      return Response({'error': f'At most {self.max_isbns} ISBNs can be looked up at once.'}, status=400)
+
+    canonical = {isbn: to_isbn13(isbn) for isbn in isbns}
+    books = Book.objects.filter(isbn13__in={isbn13 for isbn13 in canonical.values() if isbn13})
+    found = {book['isbn13']: book for book in BookSerializer(books, many=True).data}
+
+    results = []
+    for isbn in isbns:
+      if canonical[isbn] is None:
+        results.append({'isbn': isbn, 'book': None, 'error': 'Invalid ISBN number'})
+      else:
+        results.append({'isbn': isbn, 'book': found.get(canonical[isbn])})
+    return Response({'results': results})
+
+
+class BookCacheStatsAPIView(APIView):
+
+  def get(self, request):
+    return Response(cache_stats.snapshot())
+
+
 class BookCheckoutAPIView(APIView):
   #permission_classes = [IsAuthenticated]
 
   def post(self, request, pk):
     try:
-      book = Book.objects.get(pk=pk)
-    except Book.DoesNotExist:
-      raise Http404("Book not found")
-    
-    user = request.user
-
-    # Check if user already has this book checked out
-    existing_checkout = Transaction.objects.filter(
-      user=user,
-      book=book,
-      transaction_type=Transaction.CHECKOUT
-    ).exists()
-
-    if existing_checkout:
-      return Response(
-          {'error': 'You already have this book checked out'},
-          status=status.HTTP_400_BAD_REQUEST
-      )
-
-    if book.copies_available <= 0:
-      return Response(
-          {'error': 'No copies available'},
-          status=status.HTTP_400_BAD_REQUEST
-      )
-
-    # Create checkout transaction
-    due_date = datetime.now().date() + timedelta(days=14)
-    Transaction.objects.create(
-      user=request.user,
-      book=book,
-      transaction_type=Transaction.CHECKOUT,
-      due_date=due_date
-    )
-
-    # Update book copies
-    book.copies_available -= 1
-    book.save()
+      checkout_book(request.user, pk)
+    except CirculationError as exc:
+      return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
     return Response({'status': 'Book checked out successfully'})
 
@@ -200,31 +394,137 @@ class BookReturnAPIView(APIView):
   #permission_classes = [IsAuthenticated]
 
   def post(self, request, pk):
-    book = get_object_or_404(Book, pk=pk)
-    user = request.user
-
-    # Check if user has this book checked out
-    checkout = Transaction.objects.filter(
-      user=user,
-      book=book,
-      transaction_type=Transaction.CHECKOUT
-    ).first()
-
-    if not checkout:
-      return Response(
-        {'error': 'You have not checked out this book'},
-        status=status.HTTP_400_BAD_REQUEST
-      )
-
-    # Create return transaction
-    Transaction.objects.create(
-      user=user,
-      book=book,
-      transaction_type=Transaction.RETURN
-    )
-
-    # Update book copies
-    book.copies_available += 1
-    book.save()
-
-    return Response({'status': 'Book returned successfully'})
\ No newline at end of file
+    try:
+      return_book(request.user, pk)
+    except CirculationError as exc:
+      return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({'status': 'Book returned successfully'})
+
+
+class BatchCirculationAPIView(APIView):
+  """
+  `{"books": [1, 2, 3], "mode": "all-or-nothing" | "best-effort"}`: process
+  a desk "cart" in one transaction and report a result per book.
+  """
+  permission_classes = [IsAuthenticated]
+  max_books = 100
+  modes = ('all-or-nothing', 'best-effort')
+  process = None
+  verb = None
+
+  def post(self, request):
+    book_ids = request.data.get('books')
+    if not isinstance(book_ids, list) or not all(isinstance(book_id, int) and not isinstance(book_id, bool) for book_id in book_ids):
+      return Response({'error': '"books" must be a list of book ids.'}, status=400)
+    if len(book_ids) > self.max_books:
+      return Response({'error': f'At most {self.max_books} books can be processed at once.'}, status=400)
+    mode = request.data.get('mode', self.modes[0])
+    if mode not in self.modes:
+      return Response({'error': f'"mode" must be one of {", ".join(self.modes)}.'}, status=400)
+
+    try:
+      results = type(self).process(request.user, book_ids, all_or_nothing=mode == self.modes[0])
+    except CirculationError as exc:
+      return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if mode == self.modes[0] and any(result['status'] == 'failed' for result in results):
+      return Response({'error': f'No books were {self.verb}.', 'results': results}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'results': results})
+
+
+class BookBatchCheckoutAPIView(BatchCirculationAPIView):
+  process = checkout_books
+  verb = 'checked out'
+
+
+class BookBatchReturnAPIView(BatchCirculationAPIView):
+  process = return_books
+  verb = 'returned'
+
+
+class BookHoldAPIView(APIView):
+  """
+  The patron's hold on a book: POST joins the queue, DELETE leaves it.
+
+  Poll GET with `If-None-Match` instead of retrying the checkout. The ETag is
+  derived from the hold's status, ready time and queue position as read from
+  the database, so any worker answers 304 while nothing the patron can see
+  has changed, and 200 as soon as it has.
+  """
+  permission_classes = [IsAuthenticated]
+
+  def get_hold(self, request, pk):
+    return holds_with_position(Hold.objects.select_related('book')).filter(user=request.user, book_id=pk).first()
+
+  def etag(self, hold):
+    ready_at = hold.ready_at.timestamp() if hold.ready_at else ''
+    return f'"hold-{hold.pk}-{hold.status}-{ready_at}-{hold.position or 0}"'
+
+  def hold_response(self, hold, status_code=200):
+    if hold is None:
+      return Response({'error': 'You have no hold on this book'}, status=404)
+    response = Response(HoldSerializer(hold).data, status=status_code)
+    response['ETag'] = self.etag(hold)
+    return response
+
+  def get(self, request, pk):
+    hold = self.get_hold(request, pk)
+    if hold is not None and request.headers.get('If-None-Match') == self.etag(hold):
+      response = Response(status=304)
+      response['ETag'] = self.etag(hold)
+      return response
+    return self.hold_response(hold)
+
+  def post(self, request, pk):
+    try:
+      place_hold(request.user, pk)
+    except CirculationError as exc:
+      return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return self.hold_response(self.get_hold(request, pk), status_code=201)
+
+  def delete(self, request, pk):
+    try:
+      cancel_hold(request.user, pk)
+    except CirculationError as exc:
+      return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(status=204)
+
+
+# OVERDUE VIEWS
+class OverdueListAPIView(APIView):
+  permission_classes = [IsAdminUser]
+
+  def get(self, request):
+    overdues = Overdue.objects.select_related('user', 'book')
+    state = request.query_params.get('status')
+    if state not in (None, 'open', 'returned'):
+      return Response({'error': 'status must be open or returned.'}, status=400)
+    if state:
+      overdues = overdues.filter(returned_at__isnull=state == 'open')
+    user = request.query_params.get('user')
+    if user is not None:
+      try:
+        overdues = overdues.filter(user_id=int(user))
+      except ValueError:
+        return Response({'error': 'user must be an integer.'}, status=400)
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(overdues, request, view=self)
+    serializer = OverdueSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+class OverdueRunAPIView(APIView):
+  """Scheduler hook: Vercel Cron calls it with `Authorization: Bearer $CRON_SECRET`."""
+  authentication_classes = []
+  permission_classes = []
+
+  def get(self, request):
+    secret = settings.CRON_SECRET
+    supplied = request.headers.get('Authorization', '')
+    if not secret or not hmac.compare_digest(supplied.encode(), f'Bearer {secret}'.encode()):
+      return Response({'error': 'Invalid cron secret.'}, status=403)
+
+    from .overdue import process_overdue
+    return Response(process_overdue())
+
+  post = get